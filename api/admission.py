@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from django.conf import settings
+from redis.exceptions import RedisError
+from . import async_cache
+from .log_pipeline import get_logger
+from .metrics import registry
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+GLOBAL_LEASES_KEY = "admission:leases"
+GLOBAL_POLL_SECONDS = 0.05
+
+registry.describe("admission_active", "Cache-miss trip requests running in this worker.")
+registry.describe("admission_waiting", "Cache-miss trip requests queued in this worker.")
+registry.describe("admission_admitted_total", "Cache-miss trip requests admitted.")
+registry.describe("admission_rejected_total", "Cache-miss trip requests shed with a 503.")
+
+
+class Overloaded(Exception):
+    """Raised when cache-miss work cannot be admitted within the queue timeout."""
+
+    def __init__(self, retry_after):
+        super().__init__("The service is busy planning other trips. Please retry shortly.")
+        self.retry_after = retry_after
+
+
+class WorkerLimiter:
+    """
+    Counting semaphore for the requests of one worker process.
+
+    Requests may run on different event loops (async_to_sync starts one per
+    request), so waiters are futures woken on their own loop. A released slot is
+    handed directly to the oldest waiter, keeping the queue FIFO.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.active = 0
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, limit, queue_size, timeout):
+        """
+        Takes a slot, queueing for at most `timeout` seconds.
+
+        Returns:
+            bool: False when the queue is full or the timeout expired.
+        """
+        with self._lock:
+            if self.active < limit and not self._waiters:
+                self.active += 1
+                return True
+            if len(self._waiters) >= queue_size:
+                return False
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            entry = (loop, waiter)
+            self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._forget(entry)
+            return False
+        except asyncio.CancelledError:
+            self._forget(entry)
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._grant, waiter)
+                    return
+                except RuntimeError:  # The waiter's loop is already closed
+                    continue
+            self.active -= 1
+
+    def _grant(self, waiter):
+        # The waiter may have timed out after the slot was handed over: pass it on
+        if waiter.done():
+            self.release()
+        else:
+            waiter.set_result(True)
+
+    def _forget(self, entry):
+        with self._lock:
+            try:
+                self._waiters.remove(entry)
+            except ValueError:
+                pass
+
+
+_worker = WorkerLimiter()
+registry.gauge_callback("admission_active", lambda: _worker.active)
+registry.gauge_callback("admission_waiting", lambda: _worker.waiting)
+
+
+async def _acquire_global(token, deadline):
+    while True:
+        try:
+            if await async_cache.acquire_lease(
+                GLOBAL_LEASES_KEY, token, settings.ADMISSION_GLOBAL_LIMIT, settings.ADMISSION_LEASE_SECONDS
+            ):
+                return True
+        except RedisError as e:
+            # Without Redis the per-worker limit still applies
+            logger.warning(f"Global admission unavailable: {str(e)}")
+            return True
+        if time.monotonic() + GLOBAL_POLL_SECONDS > deadline:
+            return False
+        await asyncio.sleep(GLOBAL_POLL_SECONDS)
+
+
+async def _release_global(token):
+    try:
+        await async_cache.release_lease(GLOBAL_LEASES_KEY, token)
+    except RedisError as e:
+        logger.warning(f"Failed to release admission lease: {str(e)}")
+
+
+@asynccontextmanager
+async def admit():
+    """
+    Admits one unit of cache-miss work (provider calls, corridor and station queries).
+
+    At most ADMISSION_WORKER_LIMIT run per worker and ADMISSION_GLOBAL_LIMIT across
+    all workers (0 disables the global limit). Up to ADMISSION_QUEUE_SIZE requests
+    per worker wait up to ADMISSION_QUEUE_TIMEOUT seconds for a slot.
+
+    Raises:
+        Overloaded: If no slot is free in time; the request should be shed.
+    """
+    deadline = time.monotonic() + settings.ADMISSION_QUEUE_TIMEOUT
+    if not await _worker.acquire(
+        settings.ADMISSION_WORKER_LIMIT, settings.ADMISSION_QUEUE_SIZE, settings.ADMISSION_QUEUE_TIMEOUT
+    ):
+        registry.inc("admission_rejected_total")
+        raise Overloaded(settings.ADMISSION_RETRY_AFTER)
+
+    token = None
+    try:
+        if settings.ADMISSION_GLOBAL_LIMIT:
+            token = uuid.uuid4().hex
+            if not await _acquire_global(token, deadline):
+                token = None
+                registry.inc("admission_rejected_total")
+                raise Overloaded(settings.ADMISSION_RETRY_AFTER)
+        registry.inc("admission_admitted_total")
+        yield
+    finally:
+        if token is not None:
+            await _release_global(token)
+        _worker.release()
@@ -0,0 +1,251 @@
+import asyncio
+import functools
+import msgpack
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from .background import background_loop
+
+# MGETs KEYS and, when the last one holds the name of another key, GETs that key
+# too, so a lookup through an index costs a single round trip.
+DEREF_SCRIPT = """
+local values = redis.call('MGET', unpack(KEYS))
+local pointer = values[#KEYS]
+if pointer then
+    values[#KEYS + 1] = redis.call('GET', ARGV[1] .. pointer)
+end
+return values
+"""
+
+# Counting semaphore shared by all workers: members of the sorted set are leases scored
+# by their expiry, so the slots of a crashed worker free themselves.
+LEASE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])))
+return 1
+"""
+
+# Provider quota: takes a token from the provider's bucket (refilled at ARGV[2] per
+# second up to ARGV[3]) and counts the call against its daily limit ARGV[1] (0 means
+# unlimited), atomically. Returns {1, used} when allowed, {0, used} when the daily
+# quota is spent and {-1, used} when the bucket is empty.
+QUOTA_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+if limit > 0 and used >= limit then
+    return {0, used}
+end
+local rate = tonumber(ARGV[2])
+if rate > 0 then
+    local burst = tonumber(ARGV[3])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local bucket = redis.call('HMGET', KEYS[2], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        return {-1, used}
+    end
+    redis.call('HSET', KEYS[2], 'tokens', tokens - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[2], math.ceil(burst / rate) + 1)
+end
+used = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {1, used}
+"""
+
+# redis.asyncio connections belong to the loop that opened them, and async_to_sync
+# starts a loop per request. The process keeps a single client and pool on the
+# long-lived background loop instead, and every operation runs there (`pooled`).
+_client = None
+
+
+def get_client():
+    """Returns the process-wide Redis client; only call it on the background loop."""
+    global _client
+    if _client is None:
+        pool = aioredis.ConnectionPool.from_url(
+            settings.ASYNC_CACHE_URL, max_connections=settings.ASYNC_CACHE_MAX_CONNECTIONS
+        )
+        client = aioredis.Redis(connection_pool=pool)
+        client.deref_script = client.register_script(DEREF_SCRIPT)
+        client.lease_script = client.register_script(LEASE_SCRIPT)
+        client.quota_script = client.register_script(QUOTA_SCRIPT)
+        _client = client
+    return _client
+
+
+def pooled(func):
+    """Runs a coroutine function on the background loop, where the shared pool lives."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = background_loop()
+        if asyncio.get_running_loop() is loop:
+            return await func(*args, **kwargs)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(func(*args, **kwargs), loop))
+    return wrapper
+
+
+_sync_client = None
+
+
+def get_sync_client():
+    """Returns a blocking client for the synchronous writers (ingestion, scripts); never use it on the request path."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(settings.ASYNC_CACHE_URL)
+    return _sync_client
+
+
+def bump_counter(key):
+    """Increments an integer counter from synchronous code; read it with `get_counters`."""
+    return get_sync_client().incr(make_key(key))
+
+
+def delete_many_sync(keys):
+    """Deletes keys from synchronous code, e.g. negative entries once an import resolves them."""
+    if keys:
+        get_sync_client().delete(*[make_key(key) for key in keys])
+
+
+def make_key(key):
+    return f"{settings.ASYNC_CACHE_PREFIX}:{key}"
+
+
+def dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def loads(data):
+    return None if data is None else msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+@pooled
+async def get(key):
+    return loads(await get_client().get(make_key(key)))
+
+
+@pooled
+async def get_many(keys):
+    """Fetches several keys with one MGET; missing keys are left out of the result."""
+    if not keys:
+        return {}
+    values = await get_client().mget([make_key(key) for key in keys])
+    return {key: loads(value) for key, value in zip(keys, values) if value is not None}
+
+
+@pooled
+async def set(key, value, timeout=None):
+    await get_client().set(make_key(key), dumps(value), ex=timeout)
+
+
+@pooled
+async def set_many(mapping, timeout=None):
+    """Stores several values in one pipelined round trip."""
+    async with get_client().pipeline(transaction=False) as pipe:
+        for key, value in mapping.items():
+            pipe.set(make_key(key), dumps(value), ex=timeout)
+        await pipe.execute()
+
+
+@pooled
+async def add(key, value, timeout=None):
+    """Stores `value` unless `key` exists; returns True when it was stored."""
+    return bool(await get_client().set(make_key(key), dumps(value), ex=timeout, nx=True))
+
+
+@pooled
+async def set_raw(key, value, timeout=None):
+    """Stores a plain string, e.g. the name of another key for `get_many_deref`."""
+    await get_client().set(make_key(key), value, ex=timeout)
+
+
+@pooled
+async def delete_many(keys):
+    if keys:
+        await get_client().delete(*[make_key(key) for key in keys])
+
+
+@pooled
+async def ttl(key):
+    """Returns the seconds left before `key` expires: 0 when missing, None when it never expires."""
+    remaining = await get_client().ttl(make_key(key))
+    if remaining == -2:
+        return 0
+    return None if remaining == -1 else remaining
+
+
+@pooled
+async def get_many_deref(keys, pointer_key, counter_keys=()):
+    """
+    Fetches `keys`, `counter_keys` and `pointer_key`, following the pointer, in one round trip.
+
+    Args:
+        keys (list): Keys holding msgpack values.
+        pointer_key (str): Key holding the name of another key (stored with `set_raw`).
+        counter_keys (list): Keys holding integer counters (see `bump_counter`).
+
+    Returns:
+        tuple: {key: value} for the keys found, {key: count} for the counters (0 when
+        missing), and the value the pointer leads to (or None).
+    """
+    counter_keys = list(counter_keys)
+    full_keys = [make_key(key) for key in keys + counter_keys] + [make_key(pointer_key)]
+    client = get_client()
+    values = await client.deref_script(keys=full_keys, args=[make_key("")], client=client)
+    values = list(values) + [None] * (len(full_keys) + 1 - len(values))
+    found = {key: loads(value) for key, value in zip(keys, values) if value is not None}
+    counters = {key: int(value or 0) for key, value in zip(counter_keys, values[len(keys):])}
+    return found, counters, loads(values[-1])
+
+
+@pooled
+async def acquire_lease(key, token, limit, lease_seconds):
+    """
+    Takes one of `limit` slots shared by every worker for at most `lease_seconds`.
+
+    Returns:
+        bool: True when a slot was free; release it with `release_lease`.
+    """
+    client = get_client()
+    acquired = await client.lease_script(keys=[make_key(key)], args=[token, limit, lease_seconds], client=client)
+    return bool(acquired)
+
+
+@pooled
+async def release_lease(key, token):
+    await get_client().zrem(make_key(key), token)
+
+
+@pooled
+async def take_quota(counter_key, bucket_key, daily_limit, rate, burst, counter_ttl):
+    """
+    Consumes one call from a daily counter and a token bucket shared by every worker.
+
+    Returns:
+        tuple: (status, used) where status is 1 when allowed, 0 when the daily limit
+        is spent and -1 when the bucket is empty; used is the day's count so far.
+    """
+    client = get_client()
+    allowed, used = await client.quota_script(
+        keys=[make_key(counter_key), make_key(bucket_key)],
+        args=[daily_limit, rate, burst, counter_ttl],
+        client=client,
+    )
+    return int(allowed), int(used)
+
+
+@pooled
+async def get_counters(keys):
+    """Reads integer counters with one MGET; missing counters read as 0."""
+    if not keys:
+        return {}
+    values = await get_client().mget([make_key(key) for key in keys])
+    return {key: int(value) if value is not None else 0 for key, value in zip(keys, values)}
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+_lock = threading.Lock()
+_loop = None
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def background_loop():
+    """Returns the process-wide event loop for background work, starting it on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_run_loop, args=(_loop,), name="background-loop", daemon=True).start()
+        return _loop
+
+
+def submit(coro):
+    """
+    Schedules a coroutine on the background loop, outliving the current request.
+
+    Returns:
+        concurrent.futures.Future: Future resolved with the coroutine's result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, background_loop())
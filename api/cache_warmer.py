@@ -0,0 +1,174 @@
+import time
+import asyncio
+import hashlib
+import threading
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from . import async_cache
+from .background import submit
+from .log_pipeline import get_logger
+from .route_model import CachedRoute, Route
+from .utils import fetch_coordinate, format_city_name, get_route, make_route_key
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+
+class CountMinSketch:
+    """Fixed-size frequency sketch: counts never underestimate, and overestimate boundedly."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+
+    def _columns(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=4 * self.depth).digest()
+        return np.frombuffer(digest, dtype=np.uint32) % self.width
+
+    def add(self, item, count=1):
+        """Adds `count` occurrences of `item` and returns its new estimated count."""
+        rows = np.arange(self.depth)
+        columns = self._columns(item)
+        self.table[rows, columns] += count
+        return int(self.table[rows, columns].min())
+
+    def estimate(self, item):
+        return int(self.table[np.arange(self.depth), self._columns(item)].min())
+
+    def decay(self):
+        """Halves every counter so that hotness follows recent traffic."""
+        self.table >>= 1
+
+
+class LaneTracker:
+    """Tracks the top-K most requested lanes on top of a Count-Min sketch."""
+
+    def __init__(self, top_k, width=2048, depth=4):
+        self.top_k = top_k
+        self.sketch = CountMinSketch(width, depth)
+        self.top = {}
+        self._lock = threading.Lock()
+
+    def record(self, lane):
+        with self._lock:
+            estimate = self.sketch.add(lane)
+            if lane in self.top or len(self.top) < self.top_k:
+                self.top[lane] = estimate
+                return
+            coldest = min(self.top, key=self.top.get)
+            if estimate > self.top[coldest]:
+                del self.top[coldest]
+                self.top[lane] = estimate
+
+    def hottest(self):
+        """Returns tracked lanes, hottest first."""
+        with self._lock:
+            return sorted(self.top, key=self.top.get, reverse=True)
+
+    def decay(self):
+        with self._lock:
+            self.sketch.decay()
+            self.top = {lane: self.sketch.estimate(lane) for lane in self.top}
+            self.top = {lane: count for lane, count in self.top.items() if count > 0}
+
+
+_tracker = None
+_started = False
+_start_lock = threading.Lock()
+
+
+def get_tracker():
+    global _tracker
+    with _start_lock:
+        if _tracker is None:
+            _tracker = LaneTracker(settings.CACHE_WARMER_TOP_K)
+        return _tracker
+
+
+def record_lane(start_city, finish_city):
+    """
+    Counts a request for a lane and makes sure the warmer runs.
+
+    Args:
+        start_city (str): Start city slug as found in the URL.
+        finish_city (str): Finish city slug as found in the URL.
+    """
+    if not settings.CACHE_WARMER_ENABLED:
+        return
+    get_tracker().record(f"{start_city}|{finish_city}")
+    _ensure_started()
+
+
+def _ensure_started():
+    global _started
+    with _start_lock:
+        if not _started:
+            _started = True
+            submit(_warm_forever())
+
+
+def take_provider_budget():
+    """
+    Consumes one provider call from the budget shared by all workers for the current hour.
+
+    Returns:
+        bool: True when the call is within `CACHE_WARMER_PROVIDER_BUDGET`.
+    """
+    window_key = "cache_warmer_budget"
+    cache.add(window_key, 0, timeout=3600)
+    try:
+        used = cache.incr(window_key)
+    except ValueError:  # The window expired between add and incr
+        cache.add(window_key, 1, timeout=3600)
+        used = 1
+    return used <= settings.CACHE_WARMER_PROVIDER_BUDGET
+
+
+async def warm_lane(lane):
+    """
+    Refreshes the route cache of a lane if it is missing or about to go stale.
+
+    Returns:
+        bool: True when a provider call was made.
+    """
+    start_city, finish_city = lane.split("|")
+    start = await fetch_coordinate(format_city_name(start_city))
+    finish = await fetch_coordinate(format_city_name(finish_city))
+    if not start or not finish:
+        return False
+
+    route_key = make_route_key(start, finish)
+    entry = CachedRoute.from_cache(await async_cache.get(route_key))
+    if entry is not None and entry.fresh_until - time.time() > settings.CACHE_WARMER_REFRESH_BEFORE:
+        return False
+    # Only one worker refreshes a given lane at a time
+    if not cache.add(f"warming_{route_key}", 1, timeout=settings.CACHE_WARMER_INTERVAL):
+        return False
+    if not take_provider_budget():
+        return False
+
+    route = await get_route(start, finish, refresh=True)
+    if not isinstance(route, Route):
+        logger.warning(f"Cache warmer failed to refresh lane {lane}: {route['error']}")
+    return True
+
+
+async def warm_once():
+    """Runs one warming pass over the hottest lanes; returns the number of provider calls."""
+    calls = 0
+    for lane in get_tracker().hottest():
+        try:
+            calls += await warm_lane(lane)
+        except Exception as e:
+            logger.error(f"Cache warmer failed on lane {lane}: {str(e)}", exc_info=True)
+    get_tracker().decay()
+    if calls:
+        logger.info(f"Cache warmer refreshed {calls} lanes.")
+    return calls
+
+
+async def _warm_forever():
+    while True:
+        await asyncio.sleep(settings.CACHE_WARMER_INTERVAL)
+        await warm_once()
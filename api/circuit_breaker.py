@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import deque
+from django.conf import settings
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    """
+    Tracks the recent calls to one provider in this worker.
+
+    The breaker opens when the error rate over the last ROUTE_BREAKER_WINDOW seconds
+    reaches ROUTE_BREAKER_ERROR_RATE (with at least ROUTE_BREAKER_MIN_CALLS calls),
+    and calls are skipped while it is open. After ROUTE_BREAKER_COOLDOWN seconds a
+    single probe call is let through: its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probing = False
+        self._outcomes = deque()  # (timestamp, succeeded, latency)
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        horizon = now - settings.ROUTE_BREAKER_WINDOW
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+
+    def available(self, now=None):
+        """Tells whether a call could be let through, without reserving a probe."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == OPEN:
+                return now - self.opened_at >= settings.ROUTE_BREAKER_COOLDOWN
+            return not (self.state == HALF_OPEN and self._probing)
+
+    def allow(self, now=None):
+        """Reserves a call; in the half-open state only one probe is in flight at a time."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.state == OPEN:
+                if now - self.opened_at < settings.ROUTE_BREAKER_COOLDOWN:
+                    return False
+                self.state = HALF_OPEN
+                self._outcomes.clear()
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def release(self):
+        """Gives back a call reserved with `allow` that was not made after all."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, succeeded, latency, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._outcomes.append((now, succeeded, latency))
+            self._trim(now)
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if succeeded:
+                    self.state = CLOSED
+                else:
+                    self._open(now)
+            elif self.state == CLOSED and len(self._outcomes) >= settings.ROUTE_BREAKER_MIN_CALLS:
+                if self._error_rate() >= settings.ROUTE_BREAKER_ERROR_RATE:
+                    self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+
+    def _error_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, succeeded, _ in self._outcomes if not succeeded) / len(self._outcomes)
+
+    def health(self, now=None):
+        """
+        Returns the share of recent calls that failed or took longer than
+        ROUTE_BREAKER_SLOW_CALL seconds: 0 for a healthy (or unused) provider.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._trim(now)
+            if not self._outcomes:
+                return 0.0
+            degraded = sum(
+                1 for _, succeeded, latency in self._outcomes
+                if not succeeded or latency > settings.ROUTE_BREAKER_SLOW_CALL
+            )
+            return degraded / len(self._outcomes)
+
+    def mean_latency(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return sum(outcome[2] for outcome in self._outcomes) / len(self._outcomes)
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self._probing = False
+            self._outcomes.clear()
+
+
+def by_health(breakers):
+    """
+    Orders the breakers that can take a call by recent health (to a tenth, so that
+    noise does not reshuffle healthy providers), then by their configured priority.
+    Open breakers still cooling down are left out.
+    """
+    now = time.monotonic()
+    candidates = [breaker for breaker in breakers if breaker.available(now)]
+    return sorted(candidates, key=lambda breaker: (round(breaker.health(now), 1), breaker.priority))
@@ -0,0 +1,327 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from . import async_cache
+from .geometry import (
+    MILES_PER_DEGREE,
+    cumulative_miles,
+    encode_polyline,
+    great_circle_points,
+    haversine_miles,
+    project_onto_route,
+    simplify,
+)
+from .log_pipeline import get_logger
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+# Vehicle parameters; capacity and safety margin are expressed in miles of range
+VehicleProfile = namedtuple("VehicleProfile", ["fuel_capacity", "miles_per_gallon", "safety_margin"])
+
+# Stations farther off the route than this are not worth the detour
+MAX_DETOUR_MILES = 25.0
+# Level-of-detail geometry: maximum deviation in miles from the full route
+DETAIL_TOLERANCES = {"low": 1.0, "medium": 0.1}
+DETAIL_LEVELS = ("low", "medium", "full")
+LOCAL_CACHE_SIZE = 256
+# Stations are prefetched around the great circle while the route is being fetched
+PREFETCH_BUFFER_DEG = 2.5
+# Road distance rarely exceeds the great-circle distance by more than this factor
+ROAD_DETOUR_FACTOR = 1.4
+
+
+class TripInfeasible(Exception):
+    """Raised when a vehicle would run dry before reaching the next station or the destination."""
+
+    def __init__(self, stranded_at):
+        super().__init__(
+            f"The trip cannot be completed with this vehicle: no fuel station is reachable "
+            f"before mile {stranded_at:.0f}."
+        )
+        self.stranded_at = stranded_at
+
+
+class RouteCorridor:
+    """
+    Profile-independent preprocessing of a route: decoded geometry, cumulative
+    miles, and the projection of the stations along it (mile marker of their
+    closest point on the route, detour distance off the route, price).
+
+    Station arrays are sorted by mile marker and stay None until stations are
+    attached, which only long trips need. Simplified encoded geometries for the
+    lower detail levels are built once and cached along with the corridor.
+
+    Like routes, cached corridors are fresh until `fresh_until` (epoch seconds)
+    and then served stale while they are rebuilt in the background.
+    """
+
+    pyramid = None
+    fresh_until = 0.0
+    ARRAY_FIELDS = ("lats", "lons", "miles", "station_prices", "station_miles", "station_detours")
+
+    def __init__(self, lats, lons, miles, station_ids=None, station_addresses=None,
+                 station_prices=None, station_miles=None, station_detours=None):
+        self.lats = lats
+        self.lons = lons
+        self.miles = miles
+        self.station_ids = station_ids
+        self.station_addresses = station_addresses
+        self.station_prices = station_prices
+        self.station_miles = station_miles
+        self.station_detours = station_detours
+
+    @classmethod
+    def from_points(cls, route_points):
+        points = np.asarray(route_points, dtype=float)
+        return cls.from_arrays(points[:, 0].copy(), points[:, 1].copy())
+
+    @classmethod
+    def from_arrays(cls, lats, lons):
+        return cls(lats, lons, cumulative_miles(lats, lons))
+
+    def to_cache(self):
+        """Returns a msgpack-friendly dict, arrays as raw little-endian float64 bytes."""
+        value = {
+            "station_ids": self.station_ids,
+            "station_addresses": self.station_addresses,
+            "pyramid": self.pyramid,
+            "fresh_until": self.fresh_until,
+        }
+        for name in self.ARRAY_FIELDS:
+            array = getattr(self, name)
+            value[name] = None if array is None else np.ascontiguousarray(array, dtype="<f8").tobytes()
+        return value
+
+    @classmethod
+    def from_cache(cls, value):
+        """Rebuilds a cached corridor, whose arrays are read-only views of the cached bytes."""
+        if not isinstance(value, dict):
+            return None
+        arrays = {
+            name: None if value[name] is None else np.frombuffer(value[name], dtype="<f8")
+            for name in cls.ARRAY_FIELDS
+        }
+        corridor = cls(station_ids=value["station_ids"], station_addresses=value["station_addresses"], **arrays)
+        corridor.pyramid, corridor.fresh_until = value["pyramid"], value["fresh_until"]
+        return corridor
+
+    def build_pyramid(self):
+        """Encodes the route simplified at each tolerance in `DETAIL_TOLERANCES`."""
+        pyramid = {}
+        for detail, tolerance in DETAIL_TOLERANCES.items():
+            kept = simplify(self.lats, self.lons, tolerance)
+            pyramid[detail] = encode_polyline(self.lats[kept], self.lons[kept])
+        self.pyramid = pyramid
+
+    def simplified_geometry(self, detail):
+        """Returns the encoded polyline for a detail level below "full"."""
+        if self.pyramid is None:
+            self.build_pyramid()
+        return self.pyramid[detail]
+
+    @property
+    def total_miles(self):
+        return float(self.miles[-1]) if len(self.miles) else 0.0
+
+    @property
+    def is_stale(self):
+        return time.time() >= self.fresh_until
+
+    @property
+    def has_stations(self):
+        return self.station_miles is not None
+
+    def route_points(self):
+        return list(zip(self.lats.tolist(), self.lons.tolist()))
+
+    def attach_stations(self, stations, max_detour=None):
+        """
+        Projects stations onto the route once and stores them sorted by mile marker.
+
+        Args:
+            stations (list): (opis_truckstop_id, address, price, lat, lon) tuples.
+            max_detour (float): Stations farther than this many miles off the route are dropped.
+        """
+        max_detour = MAX_DETOUR_MILES if max_detour is None else max_detour
+        self.station_ids, self.station_addresses = [], []
+        self.station_prices, self.station_miles, self.station_detours = np.empty(0), np.empty(0), np.empty(0)
+        if not stations:
+            return
+        ids, addresses, prices, lats, lons = zip(*stations)
+        station_miles, detours = project_onto_route(self.lats, self.lons, self.miles, lats, lons)
+        keep = np.flatnonzero(detours <= max_detour)
+        order = keep[np.argsort(station_miles[keep], kind="stable")]
+        self.station_ids = [ids[i] for i in order]
+        self.station_addresses = [addresses[i] for i in order]
+        self.station_prices = np.asarray(prices, dtype=float)[order]
+        self.station_miles = station_miles[order]
+        self.station_detours = detours[order]
+
+    def max_offset(self, path_lats, path_lons):
+        """Returns the largest distance in miles from a vertex of this route to another polyline."""
+        path_lats = np.asarray(path_lats, dtype=float)
+        path_lons = np.asarray(path_lons, dtype=float)
+        _, offsets = project_onto_route(
+            path_lats, path_lons, cumulative_miles(path_lats, path_lons), self.lats, self.lons
+        )
+        return float(offsets.max()) if len(offsets) else 0.0
+
+    def stations_between(self, start_mile, end_mile):
+        """Returns the (lo, hi) slice of stations whose mile marker is in [start_mile, end_mile]."""
+        lo = int(np.searchsorted(self.station_miles, start_mile, side="left"))
+        hi = int(np.searchsorted(self.station_miles, end_mile, side="right"))
+        return lo, hi
+
+
+def build_corridor(lats, lons):
+    """Builds a corridor and its geometry pyramid; suitable for the planning pool."""
+    corridor = RouteCorridor.from_arrays(lats, lons)
+    corridor.build_pyramid()
+    return corridor
+
+
+def with_stations(corridor, stations):
+    """Attaches stations to a corridor and returns it; suitable for the planning pool."""
+    corridor.attach_stations(stations)
+    return corridor
+
+
+def prefetch_path(start, finish, profiles):
+    """
+    Returns the great-circle path to prefetch stations along, or None when the trip
+    is short enough that no vehicle profile is expected to refuel.
+
+    Args:
+        start (tuple): (latitude, longitude) of the start.
+        finish (tuple): (latitude, longitude) of the finish.
+        profiles (list): VehicleProfile tuples being planned.
+    """
+    straight_miles = float(haversine_miles(start[0], start[1], finish[0], finish[1]))
+    if straight_miles * ROAD_DETOUR_FACTOR <= min(profile.fuel_capacity for profile in profiles):
+        return None
+    return great_circle_points(start[0], start[1], finish[0], finish[1])
+
+
+def prefetch_covers(corridor, path_lats, path_lons, buffer_deg=PREFETCH_BUFFER_DEG, max_detour=None):
+    """
+    Tells whether stations prefetched around a path include every station the
+    route can use, i.e. whether the route plus the detour allowance stays inside
+    the prefetched corridor.
+    """
+    max_detour = MAX_DETOUR_MILES if max_detour is None else max_detour
+    # A degree of longitude is shortest at the corridor edge farthest from the equator
+    edge_lat = min(89.0, float(np.abs(path_lats).max()) + buffer_deg)
+    half_width = buffer_deg * MILES_PER_DEGREE * np.cos(np.radians(edge_lat))
+    return corridor.max_offset(path_lats, path_lons) + max_detour <= half_width
+
+
+_local_cache = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def corridor_cache_key(route_key, stations_version):
+    return f"corridor_{route_key}_{stations_version}"
+
+
+async def get_cached_corridor(key):
+    """Looks a corridor up in this process first, then in the shared cache."""
+    with _local_lock:
+        corridor = _local_cache.get(key)
+        if corridor is not None:
+            _local_cache.move_to_end(key)
+            return corridor
+    corridor = RouteCorridor.from_cache(await async_cache.get(key))
+    if corridor is not None:
+        _remember(key, corridor)
+    return corridor
+
+
+async def store_corridor(key, corridor):
+    corridor.fresh_until = time.time() + settings.ROUTE_FRESH_SECONDS
+    _remember(key, corridor)
+    await async_cache.set(key, corridor.to_cache(), timeout=settings.ROUTE_STALE_SECONDS)
+
+
+def reset_corridors():
+    """Forgets the corridors cached in this process."""
+    with _local_lock:
+        _local_cache.clear()
+
+
+def _remember(key, corridor):
+    with _local_lock:
+        _local_cache[key] = corridor
+        _local_cache.move_to_end(key)
+        while len(_local_cache) > LOCAL_CACHE_SIZE:
+            _local_cache.popitem(last=False)
+
+
+def plan_stops(corridor, profile, max_distance):
+    """
+    Plans refuelling stops for one vehicle profile with a single pass over the
+    corridor arrays: from each position, refuel at the cheapest station that can
+    be reached (detour included) while keeping the safety margin.
+
+    Args:
+        corridor (RouteCorridor): Corridor with stations attached.
+        profile (VehicleProfile): Vehicle parameters.
+        max_distance (float): Miles from the start within which the initial fill is bought.
+
+    Returns:
+        tuple: A list of (id, address, price, miles_from_start, cost) stops and the total fuel cost.
+
+    Raises:
+        TripInfeasible: If the vehicle needs to refuel and no station is within its range.
+    """
+    miles, prices, detours = corridor.station_miles, corridor.station_prices, corridor.station_detours
+    total_distance = corridor.total_miles
+    usable_range = profile.fuel_capacity - profile.safety_margin
+    if miles is None or len(miles) == 0:
+        if total_distance > usable_range:
+            logger.warning("No fuel stations available along the route.")
+            raise TripInfeasible(usable_range)
+        return [], 0.0
+
+    # Initial fill at the cheapest station near the start
+    _, start_end = corridor.stations_between(0.0, min(max_distance, usable_range))
+    start_end = start_end or corridor.stations_between(0.0, usable_range)[1] or len(miles)
+    start_price = prices[:start_end].min()
+    total_fuel_cost = (profile.fuel_capacity / profile.miles_per_gallon) * start_price
+
+    stops = []
+    position, remaining_range = 0.0, profile.fuel_capacity
+    # Stations behind the last stop are never reconsidered: the window only slides forward
+    lo = 0
+    while total_distance - position > remaining_range - profile.safety_margin:
+        reach = remaining_range - profile.safety_margin
+        lo = max(lo, int(np.searchsorted(miles, position, side="right")))
+        hi = int(np.searchsorted(miles, position + reach, side="right"))
+        reachable = np.flatnonzero(miles[lo:hi] - position + detours[lo:hi] <= reach)
+        if not len(reachable):
+            logger.warning("No reachable fuel station; the trip cannot be completed with this vehicle.")
+            raise TripInfeasible(position + reach)
+        best = lo + int(reachable[np.argmin(prices[lo:hi][reachable])])
+        # Driving off the route to the station
+        detour = float(detours[best])
+        remaining_range -= miles[best] - position + detour
+        position = float(miles[best])
+        lo = best + 1
+        # Fill up, or just enough to drive back and reach the destination with the safety margin left
+        fuel_needed = min(profile.fuel_capacity, total_distance - position + detour + profile.safety_margin) - remaining_range
+        if fuel_needed > 0:
+            cost = (fuel_needed / profile.miles_per_gallon) * prices[best]
+            total_fuel_cost += cost
+            remaining_range += fuel_needed
+            stops.append((
+                corridor.station_ids[best],
+                corridor.station_addresses[best] or 'not specified',
+                float(prices[best]),
+                round(position, 2),
+                round(cost, 2),
+            ))
+        # Back onto the route
+        remaining_range -= detour
+
+    return stops, round(total_fuel_cost, 2)
@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from .metrics import registry
+
+_lock = threading.Lock()
+_executor = None
+_size = 0
+_in_use = 0
+_waiting = 0
+
+registry.describe("db_pool_size", "Threads available for database queries.")
+registry.describe("db_pool_in_use", "Database queries currently running.")
+registry.describe("db_pool_waiting", "Database queries waiting for a free thread.")
+registry.describe("db_pool_saturated_total", "Queries that found every database thread busy.")
+registry.describe("db_pool_wait_seconds_total", "Time queries spent waiting for a database thread.")
+
+
+def get_executor():
+    """Returns the process-wide pool of database threads, creating it on first use."""
+    global _executor, _size
+    with _lock:
+        if _executor is None:
+            _size = settings.DB_POOL_SIZE
+            _executor = ThreadPoolExecutor(max_workers=_size, thread_name_prefix="db")
+            registry.set_gauge("db_pool_size", _size)
+            registry.gauge_callback("db_pool_in_use", lambda: _in_use)
+            registry.gauge_callback("db_pool_waiting", lambda: _waiting)
+        return _executor
+
+
+def pool_stats():
+    return {"size": _size, "in_use": _in_use, "waiting": _waiting}
+
+
+def shutdown_pool():
+    """Waits for running queries and discards the pool; the next query creates a new one."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def _run(func, submitted_at, args, kwargs):
+    global _in_use, _waiting
+    with _lock:
+        _waiting -= 1
+        _in_use += 1
+    registry.inc("db_pool_wait_seconds_total", time.monotonic() - submitted_at)
+    # Each pool thread keeps its own connection (CONN_MAX_AGE); drop broken or expired ones
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+        with _lock:
+            _in_use -= 1
+
+
+def db_async(func):
+    """
+    Runs a synchronous ORM function on the database thread pool.
+
+    Unlike `database_sync_to_async`, which queues every call from every request
+    onto one thread, independent queries run in parallel on up to DB_POOL_SIZE
+    threads, each with its own persistent connection.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _waiting
+        executor = get_executor()
+        with _lock:
+            if _in_use + _waiting >= _size:
+                registry.inc("db_pool_saturated_total")
+            _waiting += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, _run, func, time.monotonic(), args, kwargs)
+    return wrapper
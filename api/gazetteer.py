@@ -0,0 +1,120 @@
+import io
+import re
+import pandas as pd
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import CityCoordinates, PriceAggregate
+from .log_pipeline import get_logger
+
+logger = get_logger(__name__, 'fuel_data_loading.log')
+
+# Legal/statistical area descriptions the Census appends to place names
+PLACE_SUFFIX = re.compile(
+    r"\s+(city and borough|consolidated government|metropolitan government|unified government|"
+    r"urban county|municipality|comunidad|zona urbana|borough|village|city|town|CDP)$"
+)
+BALANCE_SUFFIX = re.compile(r"\s*\(balance\)$")
+COLUMNS = ["city", "state", "latitude", "longitude", "land_area"]
+
+
+def clean_place_name(name):
+    """Turns a Census place name ("Big Cabin town") into the city name used by the API ("Big Cabin")."""
+    name = BALANCE_SUFFIX.sub("", name.strip())
+    name = PLACE_SUFFIX.sub("", name)
+    return name.title()
+
+
+def read_places(path):
+    """
+    Reads a Census Gazetteer places file (tab-separated, e.g. 2023_Gaz_place_national.txt).
+
+    Returns:
+        pd.DataFrame: One row per (city, state) with coordinates and land area,
+        keeping the largest place when a cleaned name repeats within a state.
+    """
+    df = pd.read_csv(path, sep="\t", dtype={"USPS": str, "NAME": str}, encoding="ISO-8859-1")
+    df.columns = df.columns.str.strip()
+    places = pd.DataFrame({
+        "city": df["NAME"].map(clean_place_name),
+        "state": df["USPS"].str.strip(),
+        "latitude": pd.to_numeric(df["INTPTLAT"], errors="coerce"),
+        "longitude": pd.to_numeric(df["INTPTLONG"], errors="coerce"),
+        "land_area": pd.to_numeric(df["ALAND_SQMI"], errors="coerce").fillna(0.0),
+    }).dropna(subset=["latitude", "longitude"])
+    places = places[places["city"].str.len().between(1, 255)]
+    return places.sort_values("land_area", ascending=False).drop_duplicates(["city", "state"])[COLUMNS]
+
+
+def _copy_places(places):
+    """Streams places into a temporary table with COPY and upserts them in one statement."""
+    buffer = io.StringIO()
+    places.to_csv(buffer, sep="\t", header=False, index=False)
+    buffer.seek(0)
+    table = CityCoordinates._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE gazetteer_places (city varchar(255), state varchar(2), "
+            "latitude double precision, longitude double precision, land_area double precision) ON COMMIT DROP"
+        )
+        cursor.copy_expert("COPY gazetteer_places FROM STDIN", buffer)
+        # status has no database default, and places left pending or unresolved are now resolved
+        cursor.execute(
+            f"INSERT INTO {table} (city, state, latitude, longitude, land_area, status, checked_at) "
+            "SELECT city, state, latitude, longitude, land_area, %s, %s FROM gazetteer_places "
+            "ON CONFLICT (city, state) DO UPDATE SET latitude = EXCLUDED.latitude, "
+            "longitude = EXCLUDED.longitude, land_area = EXCLUDED.land_area, "
+            "status = EXCLUDED.status, checked_at = EXCLUDED.checked_at",
+            [CityCoordinates.STATUS_RESOLVED, timezone.now()],
+        )
+
+
+def _bulk_places(places, batch_size=5000):
+    """Portable fallback for databases without COPY."""
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            (city.city, city.state): city
+            for city in CityCoordinates.objects.exclude(state='').filter(state__in=places["state"].unique())
+        }
+        to_update, to_create = [], []
+        for city, state, latitude, longitude, land_area in places.itertuples(index=False):
+            place = existing.get((city, state))
+            if place is None:
+                to_create.append(CityCoordinates(
+                    city=city, state=state, latitude=latitude, longitude=longitude, land_area=land_area,
+                    status=CityCoordinates.STATUS_RESOLVED, checked_at=now,
+                ))
+            else:
+                place.latitude, place.longitude, place.land_area = latitude, longitude, land_area
+                place.status, place.checked_at = CityCoordinates.STATUS_RESOLVED, now
+                to_update.append(place)
+        CityCoordinates.objects.bulk_update(
+            to_update, ["latitude", "longitude", "land_area", "status", "checked_at"], batch_size=batch_size
+        )
+        CityCoordinates.objects.bulk_create(to_create, batch_size=batch_size)
+
+
+def load_gazetteer(path):
+    """
+    Imports a Census Gazetteer places file into CityCoordinates.
+
+    Places are stored state-qualified and never overwrite cities geocoded by name,
+    so ingestion and request-time lookups resolve without calling the geocoding API.
+
+    Args:
+        path (str): Path of the Gazetteer places file.
+
+    Returns:
+        int: Number of places imported.
+    """
+    places = read_places(path)
+    if connection.vendor == "postgresql":
+        _copy_places(places)
+    else:
+        _bulk_places(places)
+    # Names that were unresolvable may now be known
+    CityCoordinates.forget_unresolved(places["city"].unique())
+    # Workers reload their region cell to state map with the price aggregates
+    PriceAggregate.bump_version()
+    logger.info(f"Imported {len(places)} gazetteer places from {path}.")
+    return len(places)
@@ -0,0 +1,85 @@
+import asyncio
+import time
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .models import CityCoordinates, FuelStation, GeocodeRequest, PriceAggregate
+from .log_pipeline import get_logger
+
+logger = get_logger(__name__, 'fuel_data_loading.log')
+
+
+def due_requests(limit):
+    return list(
+        GeocodeRequest.objects.filter(status=GeocodeRequest.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+        .order_by('next_attempt_at')[:limit]
+    )
+
+
+async def drain_once(session, limit=None):
+    """
+    Geocodes the due requests at GEOCODING_RATE_PER_SECOND and backfills their stations.
+
+    Stops as soon as the provider quota is exhausted; the requests left pending are
+    picked up again once the pause set from `X-RateLimit-Reset` is over.
+
+    Args:
+        session (aiohttp.ClientSession): Session used for the geocoding calls.
+        limit (int): Maximum requests to process, defaults to GEOCODING_BATCH_SIZE.
+
+    Returns:
+        dict: Numbers of resolved and failed requests and of backfilled stations.
+    """
+    stats = {"resolved": 0, "failed": 0, "backfilled": 0}
+    if CityCoordinates.geocoding_paused_until():
+        return stats
+
+    interval = 1.0 / settings.GEOCODING_RATE_PER_SECOND
+    requests = await sync_to_async(due_requests)(limit or settings.GEOCODING_BATCH_SIZE)
+    for request in requests:
+        # Several workers may drain the queue; each city is geocoded by one of them
+        if not cache.add(f"geocoding_{request.city}", 1, timeout=60):
+            continue
+        started = time.monotonic()
+        latitude, longitude = await CityCoordinates.fetch_coordinates(session, request.city)
+        if latitude is None or longitude is None:
+            if CityCoordinates.geocoding_paused_until():
+                cache.delete(f"geocoding_{request.city}")
+                break
+            # Names the provider has no result for are negatively cached: retrying is pointless
+            unresolvable = bool(cache.get(CityCoordinates.negative_cache_key(request.city)))
+            await sync_to_async(request.record_failure)("No geocoding result", final=unresolvable)
+            stats["failed"] += 1
+        else:
+            stats["backfilled"] += await sync_to_async(request.backfill)(latitude, longitude)
+            stats["resolved"] += 1
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    if stats["backfilled"]:
+        await sync_to_async(FuelStation.build_snapshot, thread_sensitive=False)()
+        FuelStation.bump_version()
+        PriceAggregate.bump_version()
+    if stats["resolved"] or stats["failed"]:
+        logger.info(
+            f"Geocoding queue: {stats['resolved']} resolved, {stats['failed']} failed, "
+            f"{stats['backfilled']} stations backfilled."
+        )
+    return stats
+
+
+async def drain_forever():
+    """Drains the queue, sleeping while it is empty or while the provider quota is exhausted."""
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                stats = await drain_once(session)
+            except Exception as e:
+                logger.error(f"Geocoding queue pass failed: {str(e)}", exc_info=True)
+                stats = {}
+            paused_until = CityCoordinates.geocoding_paused_until()
+            if paused_until:
+                await asyncio.sleep(paused_until - time.time())
+            elif not stats.get("resolved") and not stats.get("failed"):
+                await asyncio.sleep(settings.GEOCODING_IDLE_INTERVAL)
@@ -0,0 +1,259 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in miles between arrays of points."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def cumulative_miles(lats, lons):
+    """
+    Returns the distance along a polyline at each vertex.
+
+    Args:
+        lats (np.ndarray): Vertex latitudes.
+        lons (np.ndarray): Vertex longitudes.
+
+    Returns:
+        np.ndarray: Miles from the first vertex, starting at 0.
+    """
+    miles = np.zeros(len(lats))
+    if len(lats) > 1:
+        np.cumsum(haversine_miles(lats[:-1], lons[:-1], lats[1:], lons[1:]), out=miles[1:])
+    return miles
+
+
+def great_circle_points(lat1, lon1, lat2, lon2, spacing=25.0):
+    """
+    Samples the great circle between two points.
+
+    Args:
+        lat1 (float): Start latitude.
+        lon1 (float): Start longitude.
+        lat2 (float): End latitude.
+        lon2 (float): End longitude.
+        spacing (float): Approximate miles between consecutive samples.
+
+    Returns:
+        tuple: Latitude and longitude arrays, endpoints included.
+    """
+    phi1, lam1, phi2, lam2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.array([np.cos(phi1) * np.cos(lam1), np.cos(phi1) * np.sin(lam1), np.sin(phi1)])
+    b = np.array([np.cos(phi2) * np.cos(lam2), np.cos(phi2) * np.sin(lam2), np.sin(phi2)])
+    angle = np.arccos(np.clip(a @ b, -1.0, 1.0))
+    count = max(2, int(np.ceil(angle * EARTH_RADIUS_MILES / spacing)) + 1)
+    t = np.linspace(0.0, 1.0, count)
+    if angle < 1e-12:
+        points = np.repeat(a[None, :], count, axis=0)
+    else:
+        points = (np.sin((1 - t) * angle)[:, None] * a + np.sin(t * angle)[:, None] * b) / np.sin(angle)
+    lats = np.degrees(np.arcsin(np.clip(points[:, 2], -1.0, 1.0)))
+    lons = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return lats, lons
+
+
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * np.pi / 180
+
+
+def to_plane(lats, lons, reference_lat):
+    """Equirectangular projection to (x, y) in miles, accurate near `reference_lat`."""
+    scale = MILES_PER_DEGREE * np.cos(np.radians(reference_lat))
+    return np.column_stack([np.asarray(lons) * scale, np.asarray(lats) * MILES_PER_DEGREE])
+
+
+def project_onto_route(lats, lons, miles, point_lats, point_lons, candidates=4):
+    """
+    Projects points onto their closest point on a polyline.
+
+    Works in a local equirectangular plane (in miles) and only tests the segments
+    around the `candidates` nearest vertices of each point, all in one vectorized pass.
+
+    Args:
+        lats (np.ndarray): Route vertex latitudes.
+        lons (np.ndarray): Route vertex longitudes.
+        miles (np.ndarray): Cumulative miles at each vertex.
+        point_lats (np.ndarray): Latitudes of the points to project.
+        point_lons (np.ndarray): Longitudes of the points to project.
+        candidates (int): Nearest vertices whose adjacent segments are tested.
+
+    Returns:
+        tuple: Mile marker of each projection along the route and the distance
+        in miles from each point to the route.
+    """
+    point_lats = np.asarray(point_lats, dtype=float)
+    point_lons = np.asarray(point_lons, dtype=float)
+    if len(lats) < 2:
+        return np.zeros(len(point_lats)), haversine_miles(lats[0], lons[0], point_lats, point_lons)
+
+    reference_lat = lats.mean()
+    route_xy = to_plane(lats, lons, reference_lat)
+    point_xy = to_plane(point_lats, point_lons, reference_lat)
+
+    k = min(candidates, len(lats))
+    _, nearest = cKDTree(route_xy).query(point_xy, k=k)
+    nearest = nearest.reshape(len(point_xy), k)
+    # Each vertex contributes the segment ending and the segment starting at it
+    segments = np.clip(np.concatenate([nearest - 1, nearest], axis=1), 0, len(lats) - 2)
+
+    a, b = route_xy[segments], route_xy[segments + 1]
+    ab = b - a
+    ap = point_xy[:, None, :] - a
+    length_sq = (ab ** 2).sum(axis=2)
+    t = np.divide((ap * ab).sum(axis=2), length_sq, out=np.zeros_like(length_sq), where=length_sq > 0)
+    t = np.clip(t, 0.0, 1.0)
+    distances = np.hypot(*(ap - t[..., None] * ab).transpose(2, 0, 1))
+
+    best = distances.argmin(axis=1)
+    rows = np.arange(len(point_xy))
+    segment, t = segments[rows, best], t[rows, best]
+    mile_markers = miles[segment] + t * (miles[segment + 1] - miles[segment])
+    return mile_markers, distances[rows, best]
+
+
+def decode_polyline(encoded, precision=5):
+    """
+    Decodes an encoded polyline string with array operations instead of a
+    per-character loop.
+
+    Args:
+        encoded (str): Google encoded polyline.
+        precision (int): Decimal places encoded (5 for GraphHopper, ORS and OSRM).
+
+    Returns:
+        tuple: Latitude and longitude arrays.
+
+    Raises:
+        ValueError: If the string is not a valid encoded polyline.
+    """
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if len(chunks) == 0:
+        return np.empty(0), np.empty(0)
+    if chunks.min() < 0 or chunks.max() > 63 or chunks[-1] >= 0x20:
+        raise ValueError("Invalid encoded polyline.")
+
+    # A chunk without the continuation bit closes its value
+    ends = np.flatnonzero(chunks < 0x20)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chunks & 0x1F) << (5 * position), starts)
+    if len(values) % 2:
+        raise ValueError("Invalid encoded polyline: odd number of values.")
+
+    deltas = (values >> 1) ^ -(values & 1)
+    coords = np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+    return coords[:, 0], coords[:, 1]
+
+
+FLEXIBLE_POLYLINE_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+_FLEXIBLE_VALUES = np.full(256, -1, dtype=np.int64)
+_FLEXIBLE_VALUES[np.frombuffer(FLEXIBLE_POLYLINE_ALPHABET, dtype=np.uint8)] = np.arange(64)
+
+
+def decode_flexible_polyline(encoded):
+    """
+    Decodes a HERE flexible polyline, dropping the third dimension if present.
+
+    Args:
+        encoded (str): Flexible polyline (format version 1).
+
+    Returns:
+        tuple: Latitude and longitude arrays.
+
+    Raises:
+        ValueError: If the string is not a valid flexible polyline.
+    """
+    chunks = _FLEXIBLE_VALUES[np.frombuffer(encoded.encode("ascii"), dtype=np.uint8)]
+    if len(chunks) == 0 or chunks.min() < 0 or chunks[-1] >= 0x20:
+        raise ValueError("Invalid flexible polyline.")
+
+    ends = np.flatnonzero(chunks < 0x20)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position = np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1)
+    values = np.add.reduceat((chunks & 0x1F) << (5 * position), starts)
+    if len(values) < 2 or values[0] != 1:
+        raise ValueError("Unsupported flexible polyline version.")
+
+    header = int(values[1])
+    precision, third_dim = header & 0x0F, (header >> 4) & 0x07
+    dimensions = 3 if third_dim else 2
+    values = values[2:]
+    if len(values) % dimensions:
+        raise ValueError("Invalid flexible polyline: incomplete coordinate.")
+
+    deltas = (values >> 1) ^ -(values & 1)
+    coords = np.cumsum(deltas.reshape(-1, dimensions)[:, :2], axis=0) / 10 ** precision
+    return coords[:, 0], coords[:, 1]
+
+
+def encode_polyline(lats, lons, precision=5):
+    """
+    Encodes coordinate arrays as a polyline string, the inverse of `decode_polyline`.
+
+    Args:
+        lats (np.ndarray): Latitudes.
+        lons (np.ndarray): Longitudes.
+        precision (int): Decimal places to encode.
+
+    Returns:
+        str: Google encoded polyline.
+    """
+    if len(lats) == 0:
+        return ""
+    factor = 10 ** precision
+    scaled = np.column_stack([
+        np.round(np.asarray(lats, dtype=float) * factor),
+        np.round(np.asarray(lons, dtype=float) * factor),
+    ]).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=0).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)
+
+    # Split each value into 5-bit chunks, least significant first
+    shifts = 5 * np.arange(13)
+    groups = (values[:, None] >> shifts) & 0x1F
+    counts = np.maximum(1, (np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) // 5) + 1)
+    used = np.arange(len(shifts)) < counts[:, None]
+    continued = np.arange(len(shifts)) < (counts - 1)[:, None]
+    chars = (groups | (continued * 0x20)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def simplify(lats, lons, tolerance):
+    """
+    Simplifies a polyline with the Douglas-Peucker algorithm.
+
+    Args:
+        lats (np.ndarray): Vertex latitudes.
+        lons (np.ndarray): Vertex longitudes.
+        tolerance (float): Maximum distance in miles between the polyline and its simplification.
+
+    Returns:
+        np.ndarray: Sorted indices of the vertices to keep, endpoints included.
+    """
+    count = len(lats)
+    if count < 3:
+        return np.arange(count)
+    xy = to_plane(lats, lons, np.mean(lats))
+    keep = np.zeros(count, dtype=bool)
+    keep[[0, -1]] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, ab = xy[first], xy[last] - xy[first]
+        ap = xy[first + 1:last] - a
+        length_sq = ab @ ab
+        t = np.clip(ap @ ab / length_sq, 0.0, 1.0) if length_sq > 0 else np.zeros(len(ap))
+        distances = np.hypot(*(ap - t[:, None] * ab).T)
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.extend([(first, split), (split, last)])
+    return np.flatnonzero(keep)
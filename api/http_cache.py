@@ -0,0 +1,51 @@
+import hashlib
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+
+def trip_etag(route_key, route, versions, params, planner_defaults):
+    """
+    Builds a strong ETag for a trip plan without doing any planning work.
+
+    The plan is fully determined by the route, the request parameters, the
+    planner defaults and the versions of the station and price datasets.
+
+    Args:
+        route_key (str): Route cache key of the lane.
+        route (Route): Route the plan is built on.
+        versions (dict): Dataset versions, as returned by `lookup_trip`.
+        params (QueryDict): Request query parameters.
+        planner_defaults (tuple): Default vehicle parameters of the view.
+
+    Returns:
+        str: Quoted ETag value.
+    """
+    parts = [
+        route_key,
+        repr(tuple(route)),
+        repr(sorted(versions.items())),
+        repr(planner_defaults),
+        repr(sorted(params.lists())),
+    ]
+    digest = hashlib.sha256("|".join(map(str, parts)).encode("utf-8")).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(request, etag):
+    """
+    Checks `If-None-Match` against an ETag with the weak comparison RFC 7232
+    requires for GET, so tags weakened by compression still match.
+    """
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return "*" in tags or etag.removeprefix("W/") in {tag.removeprefix("W/") for tag in tags}
+
+
+def set_cache_headers(response, etag):
+    """Sets the ETag and lets browsers and shared caches reuse the plan for TRIP_CACHE_MAX_AGE seconds."""
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=settings.TRIP_CACHE_MAX_AGE)
+    return response
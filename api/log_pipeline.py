@@ -0,0 +1,189 @@
+import copy
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+import atexit
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from django.conf import settings
+
+# Per-request fields (request id, stage timings, ...) attached to every log line
+request_context = ContextVar("request_context", default=None)
+
+_lock = threading.Lock()
+_queue = None
+_listener = None
+_router = None
+_stats = {"enqueued": 0, "sampled_out": 0, "dropped": 0}
+
+
+def bind_request(request_id=None, **fields):
+    """
+    Starts a new logging context for the current request.
+
+    Args:
+        request_id (str): Incoming request ID, a new one is generated when missing.
+        **fields: Extra fields to attach to every log line of the request.
+
+    Returns:
+        Token: Token to pass to `release_request` once the request is done.
+    """
+    context = {"request_id": request_id or uuid.uuid4().hex, "stage_timings": {}}
+    context.update(fields)
+    return request_context.set(context)
+
+
+def release_request(token):
+    request_context.reset(token)
+
+
+def annotate_request(**fields):
+    """Adds fields to the current request context (no-op outside a request)."""
+    context = request_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+def current_request_id():
+    context = request_context.get()
+    return context["request_id"] if context else None
+
+
+@contextmanager
+def stage(name):
+    """Times a block of the request and records it under `stage_timings`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        context = request_context.get()
+        if context is not None:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            context["stage_timings"][name] = round(elapsed_ms, 2)
+
+
+class JsonFormatter(logging.Formatter):
+    """Renders a log record as a single JSON line."""
+
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update(getattr(record, "context", None) or {})
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, default=str)
+
+
+class SamplingQueueHandler(QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+
+    Once the queue is filled above `LOG_SAMPLE_THRESHOLD`, records below WARNING are
+    sampled at `LOG_SAMPLE_RATE`; when the queue is full the record is dropped.
+    """
+
+    def __init__(self, log_queue, log_file):
+        super().__init__(log_queue)
+        self.log_file = log_file
+
+    def prepare(self, record):
+        # Resolve everything that depends on the caller before leaving its thread
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        context = request_context.get()
+        # Underscore-prefixed keys hold per-request machinery, not log fields
+        record.context = {k: v for k, v in context.items() if not k.startswith("_")} if context else None
+        if record.context:
+            record.context["stage_timings"] = dict(record.context["stage_timings"])
+        record.log_file = self.log_file
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        maxsize = self.queue.maxsize
+        if (
+            record.levelno < logging.WARNING
+            and self.queue.qsize() >= maxsize * settings.LOG_SAMPLE_THRESHOLD
+            and random.random() >= settings.LOG_SAMPLE_RATE
+        ):
+            _stats["sampled_out"] += 1
+            return
+        try:
+            self.queue.put_nowait(record)
+            _stats["enqueued"] += 1
+        except queue.Full:
+            _stats["dropped"] += 1
+
+
+class _FileRouter(logging.Handler):
+    """Writer-side handler that dispatches records to one file handler per log file."""
+
+    def __init__(self):
+        super().__init__()
+        self.handlers = {}
+
+    def add_file(self, log_file):
+        if log_file not in self.handlers:
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(JsonFormatter())
+            self.handlers[log_file] = handler
+
+    def emit(self, record):
+        self.handlers[record.log_file].handle(record)
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+        _router.close()
+
+
+def get_logger(name, log_file):
+    """
+    Returns a logger whose records are written to `log_file` by a background thread.
+
+    Args:
+        name (str): Logger name.
+        log_file (str): Path of the JSON lines file to write to.
+
+    Returns:
+        logging.Logger: Logger with a non-blocking queue handler attached.
+    """
+    global _queue, _listener, _router
+    logger = logging.getLogger(name)
+    with _lock:
+        if _listener is None:
+            _queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+            _router = _FileRouter()
+            _listener = QueueListener(_queue, _router)
+            _listener.start()
+            atexit.register(_stop_listener)
+        _router.add_file(log_file)
+        if not any(isinstance(h, SamplingQueueHandler) and h.log_file == log_file for h in logger.handlers):
+            logger.addHandler(SamplingQueueHandler(_queue, log_file))
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def pipeline_stats():
+    """Returns counters of enqueued, sampled-out and dropped log records."""
+    stats = dict(_stats)
+    stats["queue_depth"] = _queue.qsize() if _queue is not None else 0
+    return stats
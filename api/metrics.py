@@ -0,0 +1,48 @@
+import threading
+from collections import defaultdict
+
+
+class MetricsRegistry:
+    """Process-local counters and gauges, exported in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1.0):
+        with self._lock:
+            self._counters[name] += amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def gauge_callback(self, name, callback):
+        """Registers a gauge whose value is read from `callback` at export time."""
+        with self._lock:
+            self._gauges[name] = callback
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        return counters, {name: value() if callable(value) else value for name, value in gauges.items()}
+
+    def render(self):
+        counters, gauges = self.snapshot()
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(values):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {values[name]:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
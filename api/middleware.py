@@ -0,0 +1,76 @@
+import re
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from .log_pipeline import bind_request, release_request, current_request_id
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+
+class RequestContextMiddleware:
+    """Binds a request ID to the logging context and echoes it in `X-Request-ID`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = bind_request(request.headers.get("X-Request-ID"), path=request.path)
+        try:
+            response = self.get_response(request)
+            response["X-Request-ID"] = current_request_id()
+            return response
+        finally:
+            release_request(token)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses responses with brotli when the client accepts it, gzip otherwise.
+
+    Brotli is optional: without the package installed this behaves exactly
+    like Django's GZipMiddleware.
+    """
+
+    def process_response(self, request, response):
+        if brotli is None or not self._accepts_brotli(request) or not self._compressible(response):
+            return super().process_response(request, response)
+
+        compressed = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = "br"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        # A strong ETag no longer matches the compressed body
+        if response.has_header("ETag"):
+            response["ETag"] = re.sub(r'^"', 'W/"', response["ETag"])
+        return response
+
+    @staticmethod
+    def _accepts_brotli(request):
+        encodings = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        for part in encodings.split(","):
+            coding, *params = [item.strip() for item in part.split(";")]
+            if coding.lower() != "br":
+                continue
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+    @staticmethod
+    def _compressible(response):
+        return (
+            not response.streaming
+            and not response.has_header("Content-Encoding")
+            and len(response.content) >= settings.COMPRESSION_MIN_SIZE
+        )
@@ -1,19 +1,23 @@
-from django.db import models
+from collections import defaultdict
+from django.db import models, transaction
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
 import pandas as pd
 import aiohttp
 from django.core.cache import cache
-import logging
 from asgiref.sync import sync_to_async, async_to_sync
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from decouple import config
+from django.conf import settings
+from django.utils import timezone
+from .log_pipeline import get_logger
+from .spatial import cell_key, region_key
+from .station_snapshot import build_snapshot
+from . import async_cache, provider_quota
 
 # Logger settings
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler('fuel_data_loading.log')
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+logger = get_logger(__name__, 'fuel_data_loading.log')
 
 file_path_csv = r"D:\\fuel-prices-for-be-assessment.csv"
 API_KEY = config('OPENCAGE_API_KEY')
@@ -26,47 +30,116 @@ class RouteData(models.Model):
         return self.route_key
 
 class CityCoordinates(models.Model):
-    city = models.CharField(max_length=255, unique=True)
+    STATUS_RESOLVED = 'resolved'
+    STATUS_PENDING = 'pending'  # Waiting for the geocoding API (e.g. quota exhausted)
+    STATUS_UNRESOLVED = 'unresolved'  # The geocoding API has no result for this name
+    STATUS_CHOICES = [(STATUS_RESOLVED, 'Resolved'), (STATUS_PENDING, 'Pending'), (STATUS_UNRESOLVED, 'Unresolved')]
+
+    city = models.CharField(max_length=255)
+    # Empty for cities geocoded by name only; gazetteer places carry their state
+    state = models.CharField(max_length=2, blank=True, default='')
     latitude = models.FloatField(default=0.0)
     longitude = models.FloatField(default=0.0)
+    # Land area in square miles, used to prefer the larger place when a name exists in several states
+    land_area = models.FloatField(default=0.0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RESOLVED)
+    checked_at = models.DateTimeField(null=True, blank=True)  # Last geocoding attempt
 
     def __str__(self):
-        return self.city
+        return f"{self.city}, {self.state}" if self.state else self.city
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'state'], name='unique_city_state'),
+        ]
         indexes = [
             models.Index(fields=['city']),
             models.Index(fields=['latitude', 'longitude']),
         ]
 
+    PAUSE_CACHE_KEY = 'geocoding_paused_until'
+
+    @classmethod
+    def resolved(cls):
+        """Cities with usable coordinates (legacy 0.0/0.0 placeholders excluded)."""
+        return cls.objects.filter(status=cls.STATUS_RESOLVED).exclude(latitude=0.0, longitude=0.0)
+
+    @staticmethod
+    def negative_cache_key(city):
+        """Key of a name's negative entry, both in the cache and in the request path's async cache."""
+        return f"unresolved_{city.replace(' ', '_')}"
+
+    @classmethod
+    def forget_unresolved(cls, cities):
+        """Drops the negative entries of names that now resolve, wherever they are cached."""
+        keys = [cls.negative_cache_key(city) for city in cities]
+        cache.delete_many(keys)
+        async_cache.delete_many_sync(keys)
+
+    @classmethod
+    def remember_unresolved(cls, city, timeout):
+        """Rejects further lookups of a name without any I/O for `timeout` seconds."""
+        if timeout > 0:
+            cache.set(cls.negative_cache_key(city), True, timeout=int(timeout))
+
+    @classmethod
+    def pause_geocoding(cls, reset_timestamp=None):
+        """Stops every worker from calling the geocoding API until the quota resets."""
+        now = time.time()
+        until = reset_timestamp if reset_timestamp and reset_timestamp > now else now + settings.GEOCODING_DEFAULT_PAUSE
+        cache.set(cls.PAUSE_CACHE_KEY, until, timeout=int(until - now) + 1)
+        return until
+
+    @classmethod
+    def geocoding_paused_until(cls):
+        """Returns the timestamp geocoding is paused until, or None when calls are allowed."""
+        until = cache.get(cls.PAUSE_CACHE_KEY)
+        return until if until and until > time.time() else None
+
     @staticmethod
     async def fetch_coordinates(session, city):
         try:
             cache_key = city.replace(" ", "_")
-            cached_coords = cache.get(cache_key)
-            if cached_coords:
-                return cached_coords
+            cached = cache.get_many([cache_key, CityCoordinates.negative_cache_key(city)])
+            if cached.get(cache_key):
+                return cached[cache_key]
+            if cached.get(CityCoordinates.negative_cache_key(city)):
+                return None, None
 
-            city_obj = await sync_to_async(CityCoordinates.objects.get_or_create, thread_sensitive=False)(
-                city=city, defaults={"latitude": 0.0, "longitude": 0.0}
+            city_obj, created = await sync_to_async(CityCoordinates.objects.get_or_create, thread_sensitive=False)(
+                city=city, state='', defaults={"status": CityCoordinates.STATUS_PENDING}
             )
 
-            if city_obj[1] is False:  # City already exists
-                coords = (city_obj[0].latitude, city_obj[0].longitude)
+            # A 0.0/0.0 row is a placeholder left by an earlier failed lookup
+            if (not created and city_obj.status == CityCoordinates.STATUS_RESOLVED
+                    and (city_obj.latitude, city_obj.longitude) != (0.0, 0.0)):  # City already exists
+                coords = (city_obj.latitude, city_obj.longitude)
                 cache.set(cache_key, coords, 604800)  # Cache for 7 days
                 return coords
 
+            # Known-bad names are not sent to the API again until their TTL expires
+            if city_obj.status == CityCoordinates.STATUS_UNRESOLVED and city_obj.checked_at:
+                remaining = settings.GEOCODING_NEGATIVE_TTL - (timezone.now() - city_obj.checked_at).total_seconds()
+                if remaining > 0:
+                    CityCoordinates.remember_unresolved(city, remaining)
+                    return None, None
+
+            if CityCoordinates.geocoding_paused_until():
+                return None, None
+            # Shared with every worker and the geocoding queue. A refusal pauses geocoding
+            # like the provider's own 429, so the city stays pending without using a retry
+            quota = await provider_quota.check("opencage")
+            if quota != provider_quota.ALLOWED:
+                CityCoordinates.pause_geocoding(provider_quota.retry_at("opencage", quota))
+                return None, None
+
             url = f"https://api.opencagedata.com/geocode/v1/json?q={city}&key={API_KEY}"
 
             async with session.get(url) as response:
                 if response.status == 402 or response.status == 429:  # Daily limit exceeded
                     reset_time = response.headers.get("X-RateLimit-Reset")
-                    if reset_time:
-                        reset_timestamp = int(reset_time)
-                        reset_datetime = datetime.utcfromtimestamp(reset_timestamp)
-                        print(f"[❌] Daily limit exceeded! Will reset at: {reset_datetime} UTC")
-                    else:
-                        print("[❌] Daily limit exceeded! Please try again later.")
+                    until = CityCoordinates.pause_geocoding(int(reset_time) if reset_time else None)
+                    logger.warning(f"Geocoding quota exceeded, paused until {datetime.utcfromtimestamp(until)} UTC")
                     return None, None
 
                 if response.status == 200:
@@ -76,19 +149,102 @@ class CityCoordinates(models.Model):
                         lon = data["results"][0]["geometry"]["lng"]
                         coords = (lat, lon)
 
-                        await sync_to_async(lambda: CityCoordinates.objects.filter(city=city).update(
-                            latitude=lat, longitude=lon
+                        await sync_to_async(lambda: CityCoordinates.objects.filter(city=city, state='').update(
+                            latitude=lat, longitude=lon, status=CityCoordinates.STATUS_RESOLVED, checked_at=timezone.now()
                         ))()
-                        updated_city = await sync_to_async(CityCoordinates.objects.get, thread_sensitive=False)(city=city)
 
                         cache.set(cache_key, coords, timeout=None)
+                        CityCoordinates.forget_unresolved([city])
                         return coords
 
+                    await sync_to_async(lambda: CityCoordinates.objects.filter(city=city, state='').update(
+                        status=CityCoordinates.STATUS_UNRESOLVED, checked_at=timezone.now()
+                    ))()
+                    CityCoordinates.remember_unresolved(city, settings.GEOCODING_NEGATIVE_TTL)
+                    logger.info(f"No geocoding result for city {city}.")
+
             return None, None
         except Exception as e:
             logger.error(f"Failed to fetch coordinates for city {city}: {str(e)}", exc_info=True)
             return None, None
 
+class PriceAggregate(models.Model):
+    """Running sum and count of station prices per region, maintained during ingestion."""
+    SCOPE_NATIONAL = 'national'
+    SCOPE_STATE = 'state'
+    SCOPE_CELL = 'cell'
+    SCOPE_CHOICES = [(SCOPE_NATIONAL, 'National'), (SCOPE_STATE, 'State'), (SCOPE_CELL, 'Grid cell')]
+
+    scope = models.CharField(max_length=16, choices=SCOPE_CHOICES)
+    key = models.CharField(max_length=64, blank=True)
+    total_price = models.FloatField(default=0.0)
+    station_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_price_aggregate'),
+        ]
+
+    VERSION_CACHE_KEY = 'price_aggregates_version'
+
+    @classmethod
+    def bump_version(cls):
+        """Signals workers holding aggregates in memory to reload them."""
+        async_cache.bump_counter(cls.VERSION_CACHE_KEY)
+
+    @classmethod
+    def keys_for(cls, state, latitude, longitude):
+        """Returns the (scope, key) aggregates a station at this location contributes to."""
+        keys = [(cls.SCOPE_NATIONAL, ''), (cls.SCOPE_CELL, str(region_key(latitude, longitude)))]
+        if state:
+            keys.append((cls.SCOPE_STATE, state))
+        return keys
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Adds price and count deltas to the stored aggregates.
+
+        Args:
+            deltas (dict): {(scope, key): [price_delta, count_delta]}.
+        """
+        if not deltas:
+            return
+        with transaction.atomic():
+            existing = {
+                (a.scope, a.key): a
+                for a in cls.objects.select_for_update().filter(
+                    scope__in={scope for scope, _ in deltas}, key__in={key for _, key in deltas}
+                )
+            }
+            to_update, to_create = [], []
+            for (scope, key), (price_delta, count_delta) in deltas.items():
+                aggregate = existing.get((scope, key))
+                if aggregate is None:
+                    to_create.append(cls(scope=scope, key=key, total_price=price_delta, station_count=count_delta))
+                else:
+                    aggregate.total_price += price_delta
+                    aggregate.station_count += count_delta
+                    to_update.append(aggregate)
+            cls.objects.bulk_update(to_update, ['total_price', 'station_count'], batch_size=1000)
+            cls.objects.bulk_create(to_create, batch_size=1000)
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every aggregate from the FuelStation table."""
+        deltas = defaultdict(lambda: [0.0, 0])
+        for state, price, lat, lon in FuelStation.objects.values_list('state', 'price_per_gallon', 'latitude', 'longitude'):
+            for aggregate_key in cls.keys_for(state, lat, lon):
+                deltas[aggregate_key][0] += price
+                deltas[aggregate_key][1] += 1
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.apply_deltas(deltas)
+        cls.bump_version()
+
 class FuelStation(models.Model):
     opis_truckstop_id = models.CharField(max_length=50, unique=True, null=True, blank=True)  # OPIS Truckstop ID
     name = models.CharField(max_length=255)
@@ -98,6 +254,8 @@ class FuelStation(models.Model):
     price_per_gallon = models.FloatField()
     latitude = models.FloatField(default=0.0, db_index=True)
     longitude = models.FloatField(default=0.0, db_index=True)
+    # Z-order key of the station's grid cell (see api/spatial.py), kept in sync on save
+    cell_key = models.BigIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name if self.name else self.opis_truckstop_id
@@ -105,7 +263,8 @@ class FuelStation(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['opis_truckstop_id']),
-            models.Index(fields=['latitude', 'longitude'])
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['cell_key'], name='fuelstation_cell_key_idx'),
         ]
 
     @classmethod
@@ -117,10 +276,15 @@ class FuelStation(models.Model):
 
         unique_cities = set(chunk['City'])
         existing_cities_data = await sync_to_async(
-            lambda: list(CityCoordinates.objects.filter(city__in=unique_cities).values_list('city', 'latitude', 'longitude'))
+            lambda: list(CityCoordinates.resolved().filter(city__in=unique_cities)
+                         .values_list('city', 'state', 'latitude', 'longitude'))
         )()
-        existing_cities_dict = {city: (lat, lon) for city, lat, lon in existing_cities_data}
+        # Keyed by (city, state); gazetteer places match on state, geocoded cities on state ''
+        existing_cities_dict = {(city, state): (lat, lon) for city, state, lat, lon in existing_cities_data}
         new_cities = []
+        price_deltas = defaultdict(lambda: [0.0, 0])
+        # Stations whose city could not be geocoded now are queued, not dropped
+        pending_stations = defaultdict(list)
 
         for _, row in chunk.iterrows():
             cleaned_city = str(row['City'])
@@ -129,40 +293,81 @@ class FuelStation(models.Model):
             address = row['Address']
 
             if station_key in existing_station_keys:
-                station_id, old_price, old_address = existing_stations_dict[station_key]
+                station_id, old_price, old_address, state, lat, lon = existing_stations_dict[station_key]
                 if price is not None and address is not None:
                     if old_price != price or old_address != address:
                         stations_to_update.append(FuelStation(id=station_id, price_per_gallon=price, address=address))
+                        for aggregate_key in PriceAggregate.keys_for(state, lat, lon):
+                            price_deltas[aggregate_key][0] += price - old_price
             else:
-                if cleaned_city in city_coords_cache:
+                station_fields = {
+                    "opis_truckstop_id": station_key,
+                    "name": row['Truckstop Name'].strip(),
+                    "state": str(row['State']).strip() if pd.notna(row['State']) else '',
+                    "city": cleaned_city,
+                    "address": address,
+                    "price_per_gallon": price,
+                }
+                if cleaned_city in pending_stations:
+                    pending_stations[cleaned_city].append(station_fields)
+                    continue
+                known_coords = (
+                    existing_cities_dict.get((cleaned_city, station_fields["state"]))
+                    or existing_cities_dict.get((cleaned_city, ''))
+                )
+                if known_coords:
+                    latitude, longitude = known_coords
+                elif cleaned_city in city_coords_cache:
                     latitude, longitude = city_coords_cache[cleaned_city]
-                elif cleaned_city in existing_cities_dict:
-                    latitude, longitude = existing_cities_dict[cleaned_city]
                 else:
                     latitude, longitude = await CityCoordinates.fetch_coordinates(session, cleaned_city)
                     if latitude is None or longitude is None:
+                        pending_stations[cleaned_city].append(station_fields)
                         continue
                     city_coords_cache[cleaned_city] = (latitude, longitude)
                     new_cities.append(CityCoordinates(city=cleaned_city, latitude=latitude, longitude=longitude))
 
                 new_station = cls(
-                    opis_truckstop_id=station_key,
-                    name=row['Truckstop Name'].strip(),
-                    state=str(row['State']).strip() if pd.notna(row['State']) else '',
-                    city=cleaned_city,
-                    address=address,
-                    price_per_gallon=price,
+                    **station_fields,
                     latitude=latitude,
-                    longitude=longitude
+                    longitude=longitude,
+                    cell_key=cell_key(latitude, longitude)
                 )
                 stations_to_create.append(new_station)
+                for aggregate_key in PriceAggregate.keys_for(new_station.state, latitude, longitude):
+                    price_deltas[aggregate_key][0] += price
+                    price_deltas[aggregate_key][1] += 1
 
         if new_cities:
-            await sync_to_async(lambda: CityCoordinates.objects.bulk_create(new_cities, batch_size=1000))()
+            # fetch_coordinates may already have stored some of these cities
+            await sync_to_async(lambda: CityCoordinates.objects.bulk_create(new_cities, batch_size=1000, ignore_conflicts=True))()
         if stations_to_update:
             await sync_to_async(lambda: FuelStation.objects.bulk_update(stations_to_update, ['price_per_gallon', 'address']))()
         if stations_to_create:
             await sync_to_async(lambda: FuelStation.objects.bulk_create(stations_to_create, batch_size=1000))()
+        if price_deltas:
+            await sync_to_async(PriceAggregate.apply_deltas)(price_deltas)
+            PriceAggregate.bump_version()
+        if pending_stations:
+            await sync_to_async(GeocodeRequest.enqueue)(pending_stations)
+            logger.info(f"Queued {len(pending_stations)} cities for geocoding.")
+
+    VERSION_CACHE_KEY = 'fuel_stations_version'
+
+    @classmethod
+    def bump_version(cls):
+        """Invalidates everything derived from the station dataset (e.g. route corridors)."""
+        async_cache.bump_counter(cls.VERSION_CACHE_KEY)
+
+    @classmethod
+    def build_snapshot(cls):
+        """Publishes the current stations as the shared memory-mapped snapshot."""
+        stations = list(cls.objects.values_list(
+            'opis_truckstop_id', 'address', 'price_per_gallon', 'latitude', 'longitude'
+        ))
+        version = build_snapshot(stations)
+        logger.info(f"Published station snapshot {version} with {len(stations)} stations.")
+        return version
 
     @classmethod
     async def load_fuel_data(cls, file_path):
@@ -187,16 +392,114 @@ class FuelStation(models.Model):
             df['Address'] = df['Address'].fillna("").astype(str).str.strip()
 
             existing_stations_list = await sync_to_async(
-                lambda: list(FuelStation.objects.values_list('opis_truckstop_id', 'id', 'price_per_gallon', 'address')),
+                lambda: list(FuelStation.objects.values_list(
+                    'opis_truckstop_id', 'id', 'price_per_gallon', 'address', 'state', 'latitude', 'longitude'
+                )),
                 thread_sensitive=False
             )()
-            existing_stations_dict = {station_id: (id, price, address) for station_id, id, price, address in existing_stations_list}
+            existing_stations_dict = {station_id: rest for station_id, *rest in existing_stations_list}
 
             async with aiohttp.ClientSession() as session:
                 await cls.process_chunk(df, existing_stations_dict, session)
+
+            await sync_to_async(cls.build_snapshot, thread_sensitive=False)()
+            cls.bump_version()
         except Exception as e:
             logger.error(f"Error loading fuel data: {str(e)}", exc_info=True)
 
+class GeocodeRequest(models.Model):
+    """A city waiting to be geocoded, with the stations whose ingestion depends on it."""
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [(STATUS_PENDING, 'Pending'), (STATUS_DONE, 'Done'), (STATUS_FAILED, 'Failed')]
+
+    city = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    stations = models.JSONField(default=list)  # FuelStation fields, without coordinates
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.city} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='geocode_request_due_idx'),
+        ]
+
+    @classmethod
+    def enqueue(cls, pending_stations):
+        """
+        Queues cities for geocoding, merging with requests already queued for them.
+
+        Args:
+            pending_stations (dict): {city: [station fields]}.
+        """
+        with transaction.atomic():
+            existing = {
+                request.city: request
+                for request in cls.objects.select_for_update().filter(city__in=list(pending_stations))
+            }
+            to_update, to_create = [], []
+            for city, stations in pending_stations.items():
+                request = existing.get(city)
+                if request is None:
+                    to_create.append(cls(city=city, stations=stations))
+                    continue
+                queued = {station["opis_truckstop_id"]: station for station in request.stations}
+                queued.update((station["opis_truckstop_id"], station) for station in stations)
+                request.stations = list(queued.values())
+                request.status = cls.STATUS_PENDING
+                to_update.append(request)
+            cls.objects.bulk_update(to_update, ['stations', 'status'], batch_size=1000)
+            cls.objects.bulk_create(to_create, batch_size=1000)
+
+    def backfill(self, latitude, longitude):
+        """
+        Creates the stations that were waiting for this city and marks the request done.
+
+        Returns:
+            int: Number of stations created.
+        """
+        queued_ids = [station["opis_truckstop_id"] for station in self.stations]
+        existing_ids = set(FuelStation.objects.filter(opis_truckstop_id__in=queued_ids).values_list('opis_truckstop_id', flat=True))
+        new_stations = [
+            FuelStation(**station, latitude=latitude, longitude=longitude, cell_key=cell_key(latitude, longitude))
+            for station in self.stations
+            if station["opis_truckstop_id"] not in existing_ids
+        ]
+        price_deltas = defaultdict(lambda: [0.0, 0])
+        for station in new_stations:
+            for aggregate_key in PriceAggregate.keys_for(station.state, latitude, longitude):
+                price_deltas[aggregate_key][0] += station.price_per_gallon
+                price_deltas[aggregate_key][1] += 1
+
+        with transaction.atomic():
+            FuelStation.objects.bulk_create(new_stations, batch_size=1000)
+            PriceAggregate.apply_deltas(price_deltas)
+            self.status, self.stations, self.last_error = self.STATUS_DONE, [], ''
+            self.save(update_fields=['status', 'stations', 'last_error'])
+        return len(new_stations)
+
+    def record_failure(self, error, final=False):
+        """Schedules a retry with exponential backoff, giving up after GEOCODING_MAX_ATTEMPTS or when `final`."""
+        self.attempts += 1
+        self.last_error = error[:255]
+        if final or self.attempts >= settings.GEOCODING_MAX_ATTEMPTS:
+            self.status = self.STATUS_FAILED
+        else:
+            backoff = settings.GEOCODING_RETRY_BACKOFF * 2 ** (self.attempts - 1)
+            self.next_attempt_at = timezone.now() + timedelta(seconds=backoff)
+        self.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+@receiver(pre_save, sender=FuelStation)
+def set_station_cell_key(sender, instance, **kwargs):
+    # Also runs for fixtures loaded with loaddata, which bypass Model.save()
+    instance.cell_key = cell_key(instance.latitude, instance.longitude)
+
 async def main():
     await FuelStation.load_fuel_data(file_path_csv)
 
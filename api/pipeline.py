@@ -0,0 +1,60 @@
+import asyncio
+from .log_pipeline import stage
+
+
+class TaskGraph:
+    """
+    Runs the stages of a request as soon as the stages they depend on are done.
+
+    A node is an async callable that receives the results of its dependencies, in
+    order. Nodes start as soon as they are added, so independent branches (such as
+    the route call and a speculative station prefetch) overlap. Nodes still running
+    when the graph is closed are cancelled: their results were not needed.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __contains__(self, name):
+        return name in self._tasks
+
+    def add(self, name, func, *args, after=()):
+        """
+        Schedules a node.
+
+        Args:
+            name (str): Node name, also used as the stage name in the request log.
+            func (callable): Coroutine function called with `args` followed by the
+                results of the `after` nodes.
+            after (tuple): Names of the nodes this one depends on.
+        """
+        dependencies = [self._tasks[dependency] for dependency in after]
+
+        async def run():
+            results = [await dependency for dependency in dependencies]
+            with stage(name):
+                return await func(*args, *results)
+
+        self._tasks[name] = asyncio.ensure_future(run())
+
+    async def result(self, name):
+        # Shielded so that a caller giving up does not cancel a node other nodes depend on
+        return await asyncio.shield(self._tasks[name])
+
+    def cancel(self, name):
+        task = self._tasks.get(name)
+        if task is not None:
+            task.cancel()
+
+    async def close(self):
+        """Cancels the nodes still running and waits for them to unwind."""
+        pending = [task for task in self._tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,93 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from .metrics import registry
+
+_lock = threading.Lock()
+_executor = None
+_size = 0
+_pending = 0
+
+registry.describe("planning_pool_size", "Workers available for offloaded planning.")
+registry.describe("planning_pool_pending", "Offloaded planning jobs queued or running.")
+registry.describe("planning_offloaded_total", "Planning jobs sent to the planning pool.")
+registry.describe("planning_inline_total", "Planning jobs small enough to run on the event loop.")
+registry.describe("planning_pool_seconds_total", "Time offloaded planning jobs took, queueing included.")
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def get_executor():
+    """
+    Returns the process-wide planning pool, creating it on first use.
+
+    PLANNING_POOL_KIND "process" sidesteps the GIL for the pure-Python parts of
+    planning; "thread" avoids pickling and suits the NumPy/SciPy-bound parts.
+    """
+    global _executor, _size
+    with _lock:
+        if _executor is None:
+            _size = settings.PLANNING_POOL_SIZE
+            if settings.PLANNING_POOL_KIND == "process":
+                # Spawned, not forked: the parent runs threads (database pool, background loop)
+                _executor = ProcessPoolExecutor(
+                    max_workers=_size, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+                )
+            else:
+                _executor = ThreadPoolExecutor(max_workers=_size, thread_name_prefix="planning")
+            registry.set_gauge("planning_pool_size", _size)
+            registry.gauge_callback("planning_pool_pending", lambda: _pending)
+        return _executor
+
+
+def pool_stats():
+    return {"size": _size, "pending": _pending}
+
+
+def shutdown_pool():
+    """Waits for running jobs and discards the pool; the next offloaded job creates a new one."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+async def run_planning(func, *args, size):
+    """
+    Runs a CPU-bound planning function without blocking the event loop when it is large.
+
+    Jobs below PLANNING_OFFLOAD_THRESHOLD run inline, where shipping the inputs would
+    cost more than the work. Larger ones run on the planning pool; with a process pool
+    `func` must be a module-level function and its arguments picklable (NumPy arrays,
+    tuples), and the result comes back as a copy.
+
+    Args:
+        func (callable): Planning function.
+        size (int): Size of the job, e.g. route vertices plus stations.
+
+    Returns:
+        The result of `func(*args)`.
+    """
+    global _pending
+    if size < settings.PLANNING_OFFLOAD_THRESHOLD:
+        registry.inc("planning_inline_total")
+        return func(*args)
+
+    executor = get_executor()
+    registry.inc("planning_offloaded_total")
+    with _lock:
+        _pending += 1
+    started = time.monotonic()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        with _lock:
+            _pending -= 1
+        registry.inc("planning_pool_seconds_total", time.monotonic() - started)
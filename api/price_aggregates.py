@@ -0,0 +1,143 @@
+import time
+import threading
+from collections import Counter, defaultdict
+from redis.exceptions import RedisError
+from . import async_cache
+from .db_pool import db_async
+from .log_pipeline import get_logger
+from scripts.average_fuel_price import AVERAGE_FUEL_PRICE
+from .models import CityCoordinates, PriceAggregate
+from .spatial import region_key, region_keys, region_neighborhood
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+RECHECK_SECONDS = 30.0
+
+_lock = threading.Lock()
+_aggregates = None
+_cell_states = {}
+_version = None
+_checked_at = 0.0
+
+
+@db_async
+def _load_aggregates():
+    return {
+        (scope, key): (total, count)
+        for scope, key, total, count in PriceAggregate.objects.values_list(
+            'scope', 'key', 'total_price', 'station_count'
+        )
+    }
+
+
+@db_async
+def _load_cell_states():
+    """Maps each region cell to the state most of its gazetteer places belong to."""
+    places = list(CityCoordinates.resolved().exclude(state='').values_list('state', 'latitude', 'longitude'))
+    if not places:
+        return {}
+    states, lats, lons = zip(*places)
+    counts = defaultdict(Counter)
+    for key, state in zip(region_keys(lats, lons).tolist(), states):
+        counts[key][state] += 1
+    return {key: votes.most_common(1)[0][0] for key, votes in counts.items()}
+
+
+async def get_aggregates():
+    """
+    Returns the price aggregates held in memory, reloading them when ingestion
+    has bumped their version (checked at most every RECHECK_SECONDS). The region
+    cell to state map used by the state fallback is reloaded with them.
+
+    Without Redis the aggregates already in memory keep being served.
+    """
+    global _aggregates, _cell_states, _version, _checked_at
+    now = time.monotonic()
+    if _aggregates is not None and now - _checked_at < RECHECK_SECONDS:
+        return _aggregates
+    try:
+        version = (await async_cache.get_counters([PriceAggregate.VERSION_CACHE_KEY]))[PriceAggregate.VERSION_CACHE_KEY]
+    except RedisError as e:
+        logger.warning(f"Price aggregate version unavailable: {str(e)}")
+        if _aggregates is not None:
+            _checked_at = now
+            return _aggregates
+        version = None
+    if _aggregates is None or version != _version:
+        aggregates = await _load_aggregates()
+        cell_states = await _load_cell_states()
+        with _lock:
+            _aggregates, _cell_states, _version = aggregates, cell_states, version
+    _checked_at = now
+    return _aggregates
+
+
+def reset_aggregates():
+    global _aggregates, _cell_states, _version, _checked_at
+    with _lock:
+        _aggregates, _cell_states, _version, _checked_at = None, {}, None, 0.0
+
+
+def states_at(cell_states, points):
+    """Returns the states of the region cells holding the given points, or of their neighbors."""
+    states = set()
+    for lat, lon in points:
+        state = cell_states.get(region_key(lat, lon))
+        if state is None:
+            state = next(
+                (cell_states[key] for key in region_neighborhood(lat, lon) if key in cell_states), None
+            )
+        if state is not None:
+            states.add(state)
+    return states
+
+
+def _average(aggregates, scope, keys):
+    total, count = 0.0, 0
+    for key in keys:
+        key_total, key_count = aggregates.get((scope, str(key)), (0.0, 0))
+        total += key_total
+        count += key_count
+    return total / count if count else None
+
+
+def _local_average(aggregates, points):
+    keys = {key for lat, lon in points for key in region_neighborhood(lat, lon)}
+    return _average(aggregates, PriceAggregate.SCOPE_CELL, keys)
+
+
+def average_price_around(aggregates, points, states=()):
+    """
+    Averages station prices over the region cells around the given points.
+
+    Falls back to the aggregates of the given states, then to the national
+    aggregate, then to the static AVERAGE_FUEL_PRICE.
+
+    Args:
+        aggregates (dict): {(scope, key): (total_price, station_count)}.
+        points (list): A few (latitude, longitude) points to average around.
+        states (iterable): State codes the points lie in, if known.
+
+    Returns:
+        float: Average price per gallon.
+    """
+    for price in (
+        _local_average(aggregates, points),
+        _average(aggregates, PriceAggregate.SCOPE_STATE, set(states)),
+        _average(aggregates, PriceAggregate.SCOPE_NATIONAL, ['']),
+    ):
+        if price is not None:
+            return price
+    return AVERAGE_FUEL_PRICE
+
+
+async def regional_average_price(route_points):
+    """
+    Returns the local average fuel price around a route's start, middle and end.
+
+    The states of the route come from the in-memory cell map, so the state fallback
+    costs no query.
+    """
+    aggregates = await get_aggregates()
+    samples = [route_points[0], route_points[len(route_points) // 2], route_points[-1]]
+    return average_price_around(aggregates, samples, states_at(_cell_states, samples))
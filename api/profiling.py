@@ -0,0 +1,145 @@
+import os
+import re
+import sys
+import time
+import random
+import threading
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from .log_pipeline import request_context, get_logger
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+PROFILE_SUFFIX = ".folded"
+_UNSAFE_CHARS = re.compile(r"[^a-z0-9_-]+")
+
+
+class StackSampler(threading.Thread):
+    """
+    Statistical profiler that periodically samples the stacks of a set of threads.
+
+    Samples are aggregated as collapsed stacks (`root;caller;leaf count`), the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_ids, interval):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def collapse_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def profile_current_thread():
+    """Adds the calling thread to the profile of the current request, if any."""
+    context = request_context.get()
+    if context is not None and "_profile_threads" in context:
+        context["_profile_threads"].add(threading.get_ident())
+
+
+def should_profile(request):
+    """
+    Decides whether a request is profiled: on demand via the debug header
+    (matching `PROFILING_TOKEN`, or sent by a staff user) or by random sampling.
+    """
+    header_value = request.headers.get(settings.PROFILING_HEADER)
+    if header_value:
+        if settings.PROFILING_TOKEN:
+            return header_value == settings.PROFILING_TOKEN
+        user = getattr(request, "user", None)
+        return bool(user and user.is_staff)
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def profile_dir():
+    path = Path(settings.PROFILE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_profile(samples, context):
+    """
+    Writes collapsed stacks to the profile directory and prunes old profiles.
+
+    The file name is tagged with the lane and route cache state of the request.
+    """
+    lane = _UNSAFE_CHARS.sub("-", context.get("lane", "none").lower())
+    cache_state = _UNSAFE_CHARS.sub("-", context.get("route_cache", "none").lower())
+    name = f"{int(time.time() * 1000)}_{lane}_{cache_state}_{context['request_id']}{PROFILE_SUFFIX}"
+    directory = profile_dir()
+    with open(directory / name, "w", encoding="utf-8") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+
+    profiles = list_profiles()
+    for old in profiles[settings.PROFILING_MAX_FILES:]:
+        (directory / old["name"]).unlink(missing_ok=True)
+    return name
+
+
+def list_profiles():
+    """Returns recent profiles, newest first."""
+    directory = profile_dir()
+    profiles = []
+    for path in directory.glob(f"*{PROFILE_SUFFIX}"):
+        stat = path.stat()
+        profiles.append({"name": path.name, "size": stat.st_size, "created": stat.st_mtime})
+    profiles.sort(key=lambda p: p["created"], reverse=True)
+    return profiles
+
+
+def resolve_profile(name):
+    """Returns the path of a stored profile, or None for unknown or unsafe names."""
+    if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIX):
+        return None
+    path = profile_dir() / name
+    return path if path.is_file() else None
+
+
+class ProfilingMiddleware:
+    """Profiles sampled or explicitly requested requests with `StackSampler`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        context = request_context.get()
+        if context is None or not should_profile(request):
+            return self.get_response(request)
+
+        context["_profile_threads"] = {threading.get_ident()}
+        sampler = StackSampler(context["_profile_threads"], settings.PROFILING_INTERVAL)
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+            context.pop("_profile_threads", None)
+
+        try:
+            response["X-Profile"] = write_profile(sampler.samples, context)
+        except OSError as e:
+            logger.error(f"Failed to write request profile: {str(e)}")
+        return response
@@ -0,0 +1,106 @@
+import time
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from redis.exceptions import RedisError
+from . import async_cache
+from .log_pipeline import get_logger
+from .metrics import registry
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+# Daily counters outlive their day so that the last calls before midnight still expire
+COUNTER_TTL = 2 * 86400
+# Outcomes of `check`, as returned by the quota script
+ALLOWED, DAILY_LIMIT, RATE_LIMITED = 1, 0, -1
+
+registry.describe("provider_quota_denied_total", "Provider calls refused because the daily quota was spent.")
+registry.describe("provider_rate_limited_total", "Provider calls refused because the provider's token bucket was empty.")
+
+
+def quota_day(now=None):
+    """Quota days follow UTC, like the providers' own daily resets."""
+    return (now or datetime.now(timezone.utc)).strftime("%Y%m%d")
+
+
+def counter_key(provider, day=None):
+    return f"quota:{provider}:{day or quota_day()}"
+
+
+def bucket_key(provider):
+    return f"bucket:{provider}"
+
+
+def _record_usage(provider, used):
+    registry.set_gauge(f"provider_quota_{provider}_used", used)
+    limit = settings.PROVIDER_DAILY_QUOTAS.get(provider, 0)
+    if limit:
+        registry.set_gauge(f"provider_quota_{provider}_remaining", max(0, limit - used))
+
+
+async def take(provider):
+    """Returns True when a call to `provider` is within its quotas (and counts it); see `check`."""
+    return await check(provider) == ALLOWED
+
+
+async def check(provider):
+    """
+    Consults the quota accountant before an outbound call to `provider`.
+
+    Every worker shares the provider's daily budget (PROVIDER_DAILY_QUOTAS, reset at
+    midnight UTC) and its token bucket (PROVIDER_RATE_LIMITS calls per second, with
+    PROVIDER_BURST_SECONDS worth of burst). Providers without a configured limit are
+    unlimited on that axis.
+
+    Returns:
+        int: ALLOWED when the call may be made (it has then been counted),
+        DAILY_LIMIT or RATE_LIMITED when it is refused.
+    """
+    limit = settings.PROVIDER_DAILY_QUOTAS.get(provider, 0)
+    rate = settings.PROVIDER_RATE_LIMITS.get(provider, 0)
+    burst = max(1.0, rate * settings.PROVIDER_BURST_SECONDS)
+    try:
+        allowed, used = await async_cache.take_quota(
+            counter_key(provider), bucket_key(provider), limit, rate, burst, COUNTER_TTL
+        )
+    except RedisError as e:
+        # Better to risk the quota than to stop routing altogether
+        logger.warning(f"Provider quota unavailable for {provider}: {str(e)}")
+        return ALLOWED
+    _record_usage(provider, used)
+    if allowed == DAILY_LIMIT:
+        registry.inc("provider_quota_denied_total")
+    elif allowed == RATE_LIMITED:
+        registry.inc("provider_rate_limited_total")
+    return allowed
+
+
+def retry_at(provider, status, now=None):
+    """
+    Returns the epoch time at which a call refused with `status` may succeed: the
+    next UTC midnight once the daily quota is spent, else when the bucket refills.
+    """
+    now = time.time() if now is None else now
+    if status == DAILY_LIMIT:
+        day = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        return (day + timedelta(days=1)).timestamp()
+    return now + 1.0 / settings.PROVIDER_RATE_LIMITS.get(provider, 1.0)
+
+
+async def headroom(providers):
+    """
+    Returns the share of each provider's daily quota still available, in one round trip.
+
+    Returns:
+        dict: {provider: fraction between 0 and 1}; 1 for providers without a daily limit.
+    """
+    limited = [provider for provider in providers if settings.PROVIDER_DAILY_QUOTAS.get(provider)]
+    try:
+        used = await async_cache.get_counters([counter_key(provider) for provider in limited])
+    except RedisError as e:
+        logger.warning(f"Provider quota unavailable: {str(e)}")
+        used = {}
+    fractions = {provider: 1.0 for provider in providers}
+    for provider in limited:
+        limit = settings.PROVIDER_DAILY_QUOTAS[provider]
+        fractions[provider] = max(0.0, 1 - used.get(counter_key(provider), 0) / limit)
+    return fractions
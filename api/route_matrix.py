@@ -0,0 +1,112 @@
+from collections import Counter
+from .corridor import corridor_cache_key, get_cached_corridor
+from .log_pipeline import get_logger
+from .route_model import EXPIRED, FRESH, CachedRoute, Route
+from .utils import (
+    cache_route_entry,
+    fetch_coordinate,
+    format_city_name,
+    get_cached_route,
+    get_route,
+    make_route_key,
+    rebuild_corridor,
+    remember_lane,
+    stations_version,
+)
+
+logger = get_logger(__name__, 'TripPlanner.log')
+
+
+def read_cities(path):
+    """Reads city slugs (e.g. big-cabin), one per line and most important first; # starts a comment."""
+    cities = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            city = line.split("#", 1)[0].strip().lower().replace(" ", "-")
+            if city and city not in cities:
+                cities.append(city)
+    return cities
+
+
+def matrix_pairs(cities):
+    """
+    Returns every ordered pair of distinct cities, so that all the pairs among the
+    first k cities come before any pair involving city k + 1: a budget that runs
+    out still leaves the most important block of the matrix complete.
+    """
+    indices = [(i, j) for i in range(len(cities)) for j in range(len(cities)) if i != j]
+    indices.sort(key=lambda pair: (max(pair), pair))
+    return [(cities[i], cities[j]) for i, j in indices]
+
+
+async def precompute_plan(route_key, route):
+    """Caches the lane's corridor with its stations attached, leaving only `plan_stops` to the request."""
+    key = corridor_cache_key(route_key, await stations_version())
+    corridor = await get_cached_corridor(key)
+    if corridor is not None and corridor.has_stations and not corridor.is_stale:
+        return False
+    await rebuild_corridor(key, route)
+    return True
+
+
+async def precompute_matrix(cities, budget, include_plans=False, refresh=False):
+    """
+    Precomputes the routes between every pair of cities within a provider-call budget.
+
+    Fresh routes already stored in `RouteData` are reused without provider calls
+    (unless `refresh`) and loaded back into the route cache; each lane is pointed at
+    its route so that the trip endpoint answers it from a single cache read. Stale
+    routes that cannot be fetched again (over budget or providers down) are loaded
+    all the same, to be served stale. Run it daily, as routes go stale after a day.
+
+    Args:
+        cities (list): City slugs, most important first.
+        budget (int): Maximum number of route fetches; with provider failover one
+            fetch may call more than one provider.
+        include_plans (bool): Also cache each lane's corridor with stations attached.
+        refresh (bool): Fetch every route again instead of reusing stored ones.
+
+    Returns:
+        dict: Counts of lanes cached, fetched, failed and left over budget, of plans
+        built and of unresolved cities.
+    """
+    stats = Counter()
+    coordinates = {}
+    for city in cities:
+        coords = await fetch_coordinate(format_city_name(city))
+        if coords:
+            coordinates[city] = coords
+        else:
+            stats["unresolved_cities"] += 1
+            logger.warning(f"Route matrix: no coordinates for {city}.")
+
+    fetches = 0
+    for start, finish in matrix_pairs([city for city in cities if city in coordinates]):
+        route_key = make_route_key(coordinates[start], coordinates[finish])
+        route = None
+        entry = None if refresh else CachedRoute.from_cache(await get_cached_route(route_key))
+        if entry is not None and entry.state() == FRESH:
+            stats["cached"] += 1
+        elif fetches < budget:
+            fetches += 1
+            route = await get_route(coordinates[start], coordinates[finish], refresh=True)
+            if isinstance(route, Route):
+                stats["fetched"] += 1
+                entry = None
+            else:
+                stats["failed"] += 1
+                logger.warning(f"Route matrix: no route for {start} -> {finish}: {route['error']}")
+        else:
+            stats["over_budget"] += 1
+        if entry is not None:
+            # Expired routes stay in RouteData only, as a fallback for when providers fail
+            if entry.state() != EXPIRED:
+                await cache_route_entry(route_key, entry)
+            route = entry.route
+        elif not isinstance(route, Route):
+            continue
+
+        await remember_lane(format_city_name(start), format_city_name(finish), route_key)
+        if include_plans and await precompute_plan(route_key, route):
+            stats["plans"] += 1
+    return dict(stats)
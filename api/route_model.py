@@ -0,0 +1,146 @@
+import time
+import numpy as np
+from collections import namedtuple
+from .geometry import cumulative_miles, decode_flexible_polyline, decode_polyline, encode_polyline
+
+METERS_PER_MILE = 1609.344
+FRESH, STALE, EXPIRED = "fresh", "stale", "expired"
+
+
+class Route(namedtuple("Route", ["provider", "geometry", "distance_miles", "duration_seconds"])):
+    """
+    Provider-independent route, as cached and returned by `get_route`.
+
+    `geometry` is a Google encoded polyline (precision 5) whatever the provider
+    sent. Distance and duration are the provider's own figures; the duration is
+    None when the provider does not report one.
+    """
+
+    __slots__ = ()
+
+    def arrays(self):
+        """Returns the latitude and longitude arrays of the route."""
+        return decode_polyline(self.geometry)
+
+    def to_cache(self):
+        return list(self)
+
+    @classmethod
+    def from_cache(cls, value):
+        """Rebuilds a cached route; anything else (e.g. raw provider JSON cached earlier) gives None."""
+        if isinstance(value, (list, tuple)) and len(value) == len(cls._fields):
+            return cls(*value)
+        return None
+
+
+class CachedRoute(namedtuple("CachedRoute", ["route", "fresh_until", "stale_until"])):
+    """
+    Cache entry of a route: until `fresh_until` it is served as is, until
+    `stale_until` it is still served while a refresh runs in the background,
+    and past that it is only served when no provider can route. Times are
+    epoch seconds.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def new(cls, route, fresh_seconds, stale_seconds, now=None):
+        now = time.time() if now is None else now
+        return cls(route, now + fresh_seconds, now + stale_seconds)
+
+    def state(self, now=None):
+        now = time.time() if now is None else now
+        if now < self.fresh_until:
+            return FRESH
+        return STALE if now < self.stale_until else EXPIRED
+
+    def to_cache(self):
+        return [*self.route.to_cache(), self.fresh_until, self.stale_until]
+
+    @classmethod
+    def from_cache(cls, value):
+        """Rebuilds a cache entry; routes cached before entries were timed count as stale."""
+        if isinstance(value, (list, tuple)) and len(value) == len(Route._fields) + 2:
+            route = Route.from_cache(value[:-2])
+            return cls(route, *value[-2:]) if route else None
+        route = Route.from_cache(value)
+        return cls(route, 0.0, float("inf")) if route else None
+
+
+def _geojson_arrays(coordinates):
+    # GeoJSON positions are [longitude, latitude]
+    points = np.asarray(coordinates, dtype=float)
+    return points[:, 1].copy(), points[:, 0].copy()
+
+
+def _route(provider, lats, lons, distance_meters, duration_seconds):
+    if len(lats) < 2:
+        raise ValueError("Route has fewer than 2 points.")
+    if distance_meters is None:
+        distance_miles = float(cumulative_miles(lats, lons)[-1])
+    else:
+        distance_miles = distance_meters / METERS_PER_MILE
+    duration = None if duration_seconds is None else round(float(duration_seconds), 1)
+    return Route(provider, encode_polyline(lats, lons), round(distance_miles, 3), duration)
+
+
+def normalize_graphhopper(data):
+    path = data["paths"][0]
+    points = path["points"]
+    if isinstance(points, str):
+        lats, lons = decode_polyline(points)
+    else:  # points_encoded=false
+        lats, lons = _geojson_arrays(points["coordinates"])
+    time_ms = path.get("time")
+    return _route("graphhopper", lats, lons, path.get("distance"), None if time_ms is None else time_ms / 1000)
+
+
+def normalize_openrouteservice(data):
+    # The GET endpoint answers with GeoJSON, the JSON endpoint with an encoded polyline
+    if "features" in data:
+        feature = data["features"][0]
+        lats, lons = _geojson_arrays(feature["geometry"]["coordinates"])
+        summary = feature.get("properties", {}).get("summary", {})
+    else:
+        route = data["routes"][0]
+        lats, lons = decode_polyline(route["geometry"])
+        summary = route.get("summary", {})
+    return _route("openrouteservice", lats, lons, summary.get("distance"), summary.get("duration"))
+
+
+def normalize_osrm(data):
+    route = data["routes"][0]
+    lats, lons = _geojson_arrays(route["geometry"]["coordinates"])
+    return _route("osrm", lats, lons, route.get("distance"), route.get("duration"))
+
+
+def normalize_here(data):
+    sections = data["routes"][0]["sections"]
+    decoded = [decode_flexible_polyline(section["polyline"]) for section in sections]
+    lats = np.concatenate([section_lats for section_lats, _ in decoded])
+    lons = np.concatenate([section_lons for _, section_lons in decoded])
+    summaries = [section.get("summary") for section in sections]
+    if all(summaries):
+        distance = sum(summary["length"] for summary in summaries)
+        duration = sum(summary["duration"] for summary in summaries)
+    else:
+        distance = duration = None
+    return _route("here", lats, lons, distance, duration)
+
+
+NORMALIZERS = {
+    "graphhopper": normalize_graphhopper,
+    "openrouteservice": normalize_openrouteservice,
+    "osrm": normalize_osrm,
+    "here": normalize_here,
+}
+
+
+def normalize(provider, data):
+    """
+    Converts a provider response into a `Route`.
+
+    Raises:
+        KeyError, IndexError, TypeError, ValueError: If the response is malformed.
+    """
+    return NORMALIZERS[provider](data)
@@ -0,0 +1,142 @@
+import numpy as np
+from django.db.models import Q
+
+# Stations are keyed by the Z-order (Morton) code of their cell in a fixed
+# 2^KEY_BITS x 2^KEY_BITS lat/lon grid. Nearby cells share key prefixes, so any
+# region maps to a handful of contiguous key ranges served by one B-tree index.
+KEY_BITS = 16
+MAX_QUERY_RANGES = 64
+# Coarse grid used for regional aggregates (~0.7 x 1.4 degree cells)
+REGION_LEVEL = 8
+
+
+def _interleave(x, y):
+    """Interleaves the bits of x (even positions) and y (odd positions)."""
+    x = np.asarray(x, dtype=np.uint64)
+    y = np.asarray(y, dtype=np.uint64)
+    key = np.zeros(np.broadcast(x, y).shape, dtype=np.uint64)
+    for bit in range(KEY_BITS):
+        b = np.uint64(bit)
+        key |= ((x >> b) & np.uint64(1)) << np.uint64(2 * bit)
+        key |= ((y >> b) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return key
+
+
+def _grid_index(lat, lon, level):
+    """Returns the (x, y) cell indexes of points at a grid level (bits per axis)."""
+    cells = 1 << level
+    x = np.clip(((np.asarray(lon, dtype=float) + 180.0) / 360.0 * cells).astype(np.int64), 0, cells - 1)
+    y = np.clip(((np.asarray(lat, dtype=float) + 90.0) / 180.0 * cells).astype(np.int64), 0, cells - 1)
+    return x, y
+
+
+def cell_key(lat, lon):
+    """Returns the Z-order key of the finest grid cell containing (lat, lon)."""
+    x, y = _grid_index(lat, lon, KEY_BITS)
+    return int(_interleave(x, y))
+
+
+def cell_keys(lats, lons):
+    """Vectorized `cell_key` for arrays of coordinates."""
+    x, y = _grid_index(lats, lons, KEY_BITS)
+    return _interleave(x, y).astype(np.int64)
+
+
+def region_key(lat, lon, level=REGION_LEVEL):
+    """Returns the Z-order key of the coarse region cell containing (lat, lon)."""
+    x, y = _grid_index(lat, lon, level)
+    return int(_interleave(x, y))
+
+
+def region_keys(lats, lons, level=REGION_LEVEL):
+    """Vectorized `region_key` for arrays of coordinates."""
+    x, y = _grid_index(lats, lons, level)
+    return _interleave(x, y).astype(np.int64)
+
+
+def region_neighborhood(lat, lon, level=REGION_LEVEL):
+    """Returns the keys of the 3x3 block of region cells centered on (lat, lon)."""
+    x, y = _grid_index(lat, lon, level)
+    cells = (1 << level) - 1
+    xs = np.clip(np.array([x - 1, x, x + 1]), 0, cells)
+    ys = np.clip(np.array([y - 1, y, y + 1]), 0, cells)
+    gx, gy = np.meshgrid(xs, ys)
+    return [int(key) for key in np.unique(_interleave(gx.ravel(), gy.ravel()))]
+
+
+def _cells_to_ranges(x, y, level):
+    """Converts coarse cells at `level` into merged ranges of finest-level keys."""
+    shift = np.uint64(2 * (KEY_BITS - level))
+    coarse = np.unique(_interleave(x, y))
+    ranges = []
+    for key in coarse:
+        low = int(key << shift)
+        high = int((key + np.uint64(1)) << shift) - 1
+        if ranges and ranges[-1][1] + 1 == low:
+            ranges[-1][1] = high
+        else:
+            ranges.append([low, high])
+    return [tuple(r) for r in ranges]
+
+
+def bbox_key_ranges(min_lat, max_lat, min_lon, max_lon, max_ranges=MAX_QUERY_RANGES):
+    """
+    Covers a bounding box with Z-order key ranges.
+
+    Args:
+        min_lat, max_lat, min_lon, max_lon (float): Bounding box in degrees.
+        max_ranges (int): Upper bound on the number of cells, and so of ranges.
+
+    Returns:
+        list: (low, high) inclusive key ranges covering the box.
+    """
+    for level in range(KEY_BITS, -1, -1):
+        x0, y0 = _grid_index(min_lat, min_lon, level)
+        x1, y1 = _grid_index(max_lat, max_lon, level)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_ranges:
+            xs, ys = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+            return _cells_to_ranges(xs.ravel(), ys.ravel(), level)
+
+
+def corridor_key_ranges(route_points, buffer_deg, max_cells=4 * MAX_QUERY_RANGES):
+    """
+    Covers the corridor of `buffer_deg` degrees around a route with Z-order key ranges.
+
+    Unlike the route's bounding box, the corridor only includes cells the route
+    actually passes near, which matters for long diagonal routes.
+
+    Args:
+        route_points (list): (latitude, longitude) points of the route.
+        buffer_deg (float): Corridor half-width in degrees.
+        max_cells (int): Upper bound on the number of cells used to cover the corridor.
+
+    Returns:
+        list: (low, high) inclusive key ranges covering the corridor.
+    """
+    points = np.asarray(route_points, dtype=float)
+    lats, lons = points[:, 0], points[:, 1]
+    # Start at a level where a buffered point spans a few cells per axis, then
+    # coarsen until the corridor fits in `max_cells` cells
+    level = KEY_BITS
+    while level > 0 and 180.0 / (1 << level) < buffer_deg / 2:
+        level -= 1
+    while True:
+        x0, y0 = _grid_index(lats - buffer_deg, lons - buffer_deg, level)
+        x1, y1 = _grid_index(lats + buffer_deg, lons + buffer_deg, level)
+        xs, ys = [], []
+        for i in range(int((x1 - x0).max()) + 1):
+            for j in range(int((y1 - y0).max()) + 1):
+                xs.append(np.minimum(x0 + i, x1))
+                ys.append(np.minimum(y0 + j, y1))
+        cells = np.unique(np.stack([np.concatenate(xs), np.concatenate(ys)], axis=1), axis=0)
+        if len(cells) <= max_cells or level == 0:
+            return _cells_to_ranges(cells[:, 0], cells[:, 1], level)
+        level -= 1
+
+
+def key_ranges_q(ranges, field="cell_key"):
+    """Builds a Q object matching any of the given key ranges."""
+    query = Q()
+    for low, high in ranges:
+        query |= Q(**{f"{field}__range": (low, high)})
+    return query
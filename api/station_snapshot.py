@@ -0,0 +1,183 @@
+import os
+import time
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from django.conf import settings
+from .spatial import cell_keys, bbox_key_ranges, corridor_key_ranges
+
+# One row per station, sorted by cell_key so that spatial key ranges map to
+# contiguous slices found with searchsorted. Strings live in a separate UTF-8
+# byte table referenced by (offset, length); a length of NULL_LENGTH marks None.
+SNAPSHOT_DTYPE = np.dtype([
+    ("cell_key", "<i8"),
+    ("latitude", "<f8"),
+    ("longitude", "<f8"),
+    ("price", "<f8"),
+    ("id_offset", "<u4"),
+    ("id_length", "<u2"),
+    ("address_offset", "<u4"),
+    ("address_length", "<u2"),
+])
+NULL_LENGTH = 0xFFFF
+CURRENT_FILE = "CURRENT"
+RECHECK_SECONDS = 5.0
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+
+class StationSnapshot:
+    """Read-only view over a station snapshot mapped from disk."""
+
+    def __init__(self, directory, version):
+        self.version = version
+        self.rows = np.load(Path(directory) / f"stations-{version}.npy", mmap_mode="r")
+        self.strings = np.load(Path(directory) / f"strings-{version}.npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _string(self, offset, length):
+        if length == NULL_LENGTH:
+            return None
+        return bytes(self.strings[offset:offset + length]).decode("utf-8")
+
+    def indices_in_ranges(self, ranges):
+        """Returns the row indices whose cell key falls in any of the (low, high) ranges."""
+        keys = self.rows["cell_key"]
+        lows = np.searchsorted(keys, [low for low, _ in ranges], side="left")
+        highs = np.searchsorted(keys, [high for _, high in ranges], side="right")
+        slices = [np.arange(lo, hi) for lo, hi in zip(lows, highs) if hi > lo]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def stations(self, indices=None):
+        """Materializes rows as (opis_truckstop_id, address, price, lat, lon) tuples."""
+        rows = self.rows if indices is None else self.rows[indices]
+        return [
+            (
+                self._string(row["id_offset"], row["id_length"]),
+                self._string(row["address_offset"], row["address_length"]),
+                float(row["price"]),
+                float(row["latitude"]),
+                float(row["longitude"]),
+            )
+            for row in rows
+        ]
+
+    def nearby_stations(self, min_lat, max_lat, min_lon, max_lon):
+        indices = self.indices_in_ranges(bbox_key_ranges(min_lat, max_lat, min_lon, max_lon))
+        rows = self.rows[indices]
+        inside = (
+            (rows["latitude"] >= min_lat) & (rows["latitude"] <= max_lat)
+            & (rows["longitude"] >= min_lon) & (rows["longitude"] <= max_lon)
+        )
+        return self.stations(indices[inside])
+
+    def corridor_stations(self, route_points, buffer_deg):
+        return self.stations(self.indices_in_ranges(corridor_key_ranges(route_points, buffer_deg)))
+
+
+def _encode_strings(values, buffer):
+    offsets = np.zeros(len(values), dtype=np.uint32)
+    lengths = np.zeros(len(values), dtype=np.uint16)
+    for i, value in enumerate(values):
+        if value is None:
+            lengths[i] = NULL_LENGTH
+            continue
+        encoded = str(value).encode("utf-8")[:NULL_LENGTH - 1]
+        offsets[i] = len(buffer)
+        lengths[i] = len(encoded)
+        buffer.extend(encoded)
+    return offsets, lengths
+
+
+def build_snapshot(stations, directory=None):
+    """
+    Writes a columnar snapshot of the given stations and makes it current.
+
+    Args:
+        stations (list): (opis_truckstop_id, address, price, lat, lon) tuples.
+        directory (str): Snapshot directory, defaults to `STATION_SNAPSHOT_DIR`.
+
+    Returns:
+        str: Version of the written snapshot (a content hash).
+    """
+    directory = Path(directory or settings.STATION_SNAPSHOT_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    rows = np.zeros(len(stations), dtype=SNAPSHOT_DTYPE)
+    if stations:
+        ids, addresses, prices, lats, lons = zip(*stations)
+        rows["latitude"], rows["longitude"], rows["price"] = lats, lons, prices
+        rows["cell_key"] = cell_keys(rows["latitude"], rows["longitude"])
+        strings = bytearray()
+        rows["id_offset"], rows["id_length"] = _encode_strings(ids, strings)
+        rows["address_offset"], rows["address_length"] = _encode_strings(addresses, strings)
+        rows = rows[np.argsort(rows["cell_key"], kind="stable")]
+    else:
+        strings = bytearray()
+    string_table = np.frombuffer(bytes(strings), dtype=np.uint8)
+
+    version = hashlib.sha1(rows.tobytes() + string_table.tobytes()).hexdigest()[:12]
+    for name, array in ((f"stations-{version}.npy", rows), (f"strings-{version}.npy", string_table)):
+        tmp_path = directory / f".{name}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, directory / name)
+
+    tmp_current = directory / f".{CURRENT_FILE}.tmp"
+    tmp_current.write_text(version)
+    os.replace(tmp_current, directory / CURRENT_FILE)
+    _prune_versions(directory)
+    reset_snapshot()
+    return version
+
+
+def _current_version(directory):
+    try:
+        return (Path(directory) / CURRENT_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _prune_versions(directory):
+    # Keep the previous version too: workers may not have remapped yet
+    versions = sorted(
+        directory.glob("stations-*.npy"), key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for path in versions[2:]:
+        version = path.stem.split("-", 1)[1]
+        path.unlink(missing_ok=True)
+        (directory / f"strings-{version}.npy").unlink(missing_ok=True)
+
+
+def current_snapshot():
+    """
+    Returns the current snapshot mapped read-only, or None when no snapshot exists.
+
+    The CURRENT pointer is re-read at most every few seconds, so workers pick up
+    a rebuilt snapshot without restarting.
+    """
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < RECHECK_SECONDS:
+        return _snapshot
+    with _lock:
+        _checked_at = now
+        directory = settings.STATION_SNAPSHOT_DIR
+        version = _current_version(directory)
+        if version is None:
+            _snapshot = None
+        elif _snapshot is None or _snapshot.version != version:
+            _snapshot = StationSnapshot(directory, version)
+        return _snapshot
+
+
+def reset_snapshot():
+    """Forgets the mapped snapshot so the next access re-reads the CURRENT pointer."""
+    global _snapshot, _checked_at
+    with _lock:
+        _snapshot, _checked_at = None, 0.0
@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import TripPlanner
+from .views import TripPlanner, ProfileList, ProfileDownload, Metrics
 
 urlpatterns = [
     path('route/<str:start_city>/<str:finish_city>/', TripPlanner.as_view(), name='route_with_fuel'),
-       
+    path('profiles/', ProfileList.as_view(), name='profile_list'),
+    path('profiles/<str:name>/', ProfileDownload.as_view(), name='profile_download'),
+    path('metrics/', Metrics.as_view(), name='metrics'),
 
 ]
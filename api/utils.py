@@ -1,11 +1,26 @@
+import time
+import asyncio
 import aiohttp
 from math import radians, sin, cos, sqrt, atan2
-from django.core.cache import cache
-from .models import FuelStation, RouteData, CityCoordinates
-from asgiref.sync import sync_to_async
-from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Case, When, Value, IntegerField
+from .models import FuelStation, PriceAggregate, RouteData, CityCoordinates
 from functools import lru_cache
 from decouple import config
+from .log_pipeline import annotate_request
+from . import async_cache, provider_quota
+from .db_pool import db_async
+from .spatial import bbox_key_ranges, corridor_key_ranges, key_ranges_q
+from .station_snapshot import current_snapshot
+from .circuit_breaker import CircuitBreaker, OPEN, by_health
+from .metrics import registry
+from .log_pipeline import get_logger
+from .route_model import CachedRoute, EXPIRED, STALE, normalize
+from .background import submit
+from .corridor import build_corridor, store_corridor, with_stations
+from .planning_pool import run_planning
+
+logger = get_logger(__name__, 'TripPlanner.log')
 
 
 # Load API keys from environment variables
@@ -13,6 +28,56 @@ API_KEY = config("GRAPH_HOPPER_API_KEY")
 OPENROUTE_API_KEY = config("OPENROUTE_API_KEY")
 HERE_API_KEY = config("HERE_API_KEY")
 
+# Half-width of the station search corridor around a route (~100 miles)
+CORRIDOR_BUFFER_DEG = 1.5
+# Versions of the datasets plans are derived from, bumped by ingestion
+DATASET_VERSION_KEYS = (FuelStation.VERSION_CACHE_KEY, PriceAggregate.VERSION_CACHE_KEY)
+STATION_FIELDS = ("opis_truckstop_id", "address", "price_per_gallon", "latitude", "longitude")
+
+# Routing providers in their default order of preference: name, URL for (start, finish)
+# and the key a successful response holds the route under
+ROUTE_PROVIDERS = {
+    "graphhopper": (
+        lambda start, finish: f"https://graphhopper.com/api/1/route?point={start[0]},{start[1]}&point={finish[0]},{finish[1]}&profile=car&locale=en&calc_points=true&key={API_KEY}",
+        "paths",
+    ),
+    "openrouteservice": (
+        lambda start, finish: f"https://api.openrouteservice.org/v2/directions/driving-car?api_key={OPENROUTE_API_KEY}&start={start[1]},{start[0]}&end={finish[1]},{finish[0]}",
+        "features",
+    ),
+    "osrm": (
+        lambda start, finish: f"http://router.project-osrm.org/route/v1/driving/{start[1]},{start[0]};{finish[1]},{finish[0]}?overview=full&geometries=geojson",
+        "routes",
+    ),
+    "here": (
+        lambda start, finish: f"https://router.hereapi.com/v8/routes?transportMode=car&origin={start[0]},{start[1]}&destination={finish[0]},{finish[1]}&return=polyline,summary&apikey={HERE_API_KEY}",
+        "routes",
+    ),
+}
+# Statuses that say the provider itself is failing, as opposed to rejecting this route
+UNHEALTHY_STATUSES = {401, 403, 429}
+
+route_breakers = [CircuitBreaker(name, priority) for priority, name in enumerate(ROUTE_PROVIDERS)]
+
+registry.describe("route_provider_failures_total", "Routing provider calls that failed or timed out.")
+registry.describe("route_provider_skipped_total", "Routing provider calls skipped because their breaker was open.")
+registry.describe("route_stale_served_total", "Stale cached routes served while refreshed in the background.")
+registry.describe("route_stale_fallbacks_total", "Expired cached routes served because no routing provider answered.")
+registry.describe("cache_revalidations_total", "Background refreshes of stale routes and corridors.")
+registry.describe("cache_revalidation_failures_total", "Background refreshes of stale routes and corridors that failed.")
+for _breaker in route_breakers:
+    registry.gauge_callback(f"route_provider_{_breaker.name}_open", lambda b=_breaker: int(b.state == OPEN))
+    registry.gauge_callback(f"route_provider_{_breaker.name}_latency_seconds", _breaker.mean_latency)
+
+
+class ProviderError(Exception):
+    """Raised when a routing provider answers with a status that says it is unhealthy."""
+
+
+def reset_route_breakers():
+    for breaker in route_breakers:
+        breaker.reset()
+
 # Helper functions
 @lru_cache(maxsize=1024)
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -35,100 +100,261 @@ def calculate_total_distance(route_points):
                for i in range(len(route_points) - 1))
 
 # Database operations
-@database_sync_to_async
-def get_city_coordinates(city):
-    return CityCoordinates.objects.filter(city=city).values("latitude", "longitude").first()
+@db_async
+def get_city_coordinates(city, state=None):
+    places = CityCoordinates.resolved().filter(city=city)
+    if state is not None:
+        places = places.filter(state=state)
+    # Prefer a geocoded city, then the largest gazetteer place with that name
+    geocoded_first = Case(When(state='', then=Value(0)), default=Value(1), output_field=IntegerField())
+    return places.order_by(geocoded_first, "-land_area").values("latitude", "longitude").first()
 
-@database_sync_to_async
+@db_async
 def get_nearby_stations(min_lat, max_lat, min_lon, max_lon):
+    min_lat, max_lat, min_lon, max_lon = min_lat - 0.1, max_lat + 0.1, min_lon - 0.1, max_lon + 0.1
+    # The cell key ranges drive the index scan; the exact ranges trim the edge cells
     return list(FuelStation.objects.filter(
-        latitude__range=(min_lat - 0.1, max_lat + 0.1),
-        longitude__range=(min_lon - 0.1, max_lon + 0.1)
-    ).only("opis_truckstop_id", "address", "price_per_gallon", "latitude", "longitude").values_list(
-        "opis_truckstop_id", "address", "price_per_gallon", "latitude", "longitude"
-    ))
+        key_ranges_q(bbox_key_ranges(min_lat, max_lat, min_lon, max_lon)),
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lon, max_lon)
+    ).values_list(*STATION_FIELDS))
 
-@database_sync_to_async
+@db_async
+def get_corridor_stations(route_points, buffer_deg=CORRIDOR_BUFFER_DEG):
+    return list(FuelStation.objects.filter(
+        key_ranges_q(corridor_key_ranges(route_points, buffer_deg))
+    ).values_list(*STATION_FIELDS))
+
+@db_async
 def get_all_stations():
     return list(FuelStation.objects.all().only("opis_truckstop_id", "address", "price_per_gallon", "latitude", "longitude").values_list(
         "opis_truckstop_id", "address", "price_per_gallon", "latitude", "longitude"
     ))
 
-@database_sync_to_async
+@db_async
 def get_cached_route(route_key):
     return RouteData.objects.filter(route_key=route_key).values_list("data", flat=True).first()
 
+@db_async
+def save_route_entry(route_key, entry):
+    RouteData.objects.update_or_create(route_key=route_key, defaults={"data": entry.to_cache()})
+
 # Async utility functions
+def coordinates_key(city):
+    return f"coords:{city.replace(' ', '_')}"
+
+def unresolved_key(city):
+    return CityCoordinates.negative_cache_key(city)
+
+def lane_key(start_city, finish_city):
+    return f"lane:{start_city}|{finish_city}"
+
 async def fetch_coordinate(city):
-    cache_key = city.replace(" ", "_")
-    cached_coords = cache.get(cache_key)
-    if cached_coords:
-        return cached_coords
+    cached = await async_cache.get_many([coordinates_key(city), unresolved_key(city)])
+    if cached.get(coordinates_key(city)):
+        return tuple(cached[coordinates_key(city)])
+    if cached.get(unresolved_key(city)):
+        return None
     coordinates = await get_city_coordinates(city)
     if not coordinates:
+        # Short TTL: the city may be added by ingestion or a gazetteer import
+        await async_cache.set(unresolved_key(city), True, timeout=settings.CITY_NEGATIVE_CACHE_TTL)
         return None
     coords = (coordinates["latitude"], coordinates["longitude"])
-    cache.set(cache_key, coords, timeout=None)
+    await async_cache.set(coordinates_key(city), coords)
     return coords
 
+async def lookup_trip(start_city, finish_city):
+    """
+    Reads both cities' coordinates, the lane's cached route and the dataset versions
+    in a single Redis round trip.
+
+    Args:
+        start_city (str): Formatted start city name.
+        finish_city (str): Formatted finish city name.
+
+    Returns:
+        tuple: Start coordinates, finish coordinates, the lane's `CachedRoute` and
+        {version key: version} for `DATASET_VERSION_KEYS`. Coordinates are None when
+        not cached and False when the city is known to be unresolvable; the route is
+        None when the lane has no cached route.
+    """
+    keys = [coordinates_key(start_city), coordinates_key(finish_city), unresolved_key(start_city), unresolved_key(finish_city)]
+    found, versions, cached_route = await async_cache.get_many_deref(
+        keys, lane_key(start_city, finish_city), DATASET_VERSION_KEYS
+    )
+
+    def coordinates(city):
+        if found.get(unresolved_key(city)):
+            return False
+        coords = found.get(coordinates_key(city))
+        return tuple(coords) if coords else None
+
+    return coordinates(start_city), coordinates(finish_city), CachedRoute.from_cache(cached_route), versions
+
+async def remember_lane(start_city, finish_city, route_key):
+    """Points a lane at its route so that `lookup_trip` finds the route without the coordinates."""
+    await async_cache.set_raw(lane_key(start_city, finish_city), route_key, timeout=settings.ROUTE_STALE_SECONDS)
+
 async def fetch_route_from_api(session, url, success_key):
     async with session.get(url) as response:
+        if response.status >= 500 or response.status in UNHEALTHY_STATUSES:
+            raise ProviderError(f"HTTP {response.status}")
         route_data = await response.json()
         return route_data if response.status == 200 and success_key in route_data else None
 
-async def get_fuel_stations(route_points):
+def snapshot_stations(route_points, buffer_deg):
+    """Looks the stations up in the memory-mapped snapshot; None when none has been built."""
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return None
+    stations = snapshot.corridor_stations(route_points, buffer_deg) if route_points else []
+    return stations if stations else snapshot.stations()
+
+async def get_fuel_stations(route_points, buffer_deg=CORRIDOR_BUFFER_DEG):
+    # Serve from the shared snapshot when one has been built; the lookup and the tuples
+    # it builds (thousands for the all-stations fallback) stay off the event loop
+    stations = await asyncio.to_thread(snapshot_stations, route_points, buffer_deg)
+    if stations is not None:
+        return stations
+
     if not route_points:
         return await get_all_stations()
-    min_lat, max_lat = min(c[0] for c in route_points), max(c[0] for c in route_points)
-    min_lon, max_lon = min(c[1] for c in route_points), max(c[1] for c in route_points)
-    stations = await get_nearby_stations(min_lat, max_lat, min_lon, max_lon)
+    stations = await get_corridor_stations(route_points, buffer_deg)
     return stations if stations else await get_all_stations()
 
-async def get_route(start, finish):
+async def stations_version():
+    return (await async_cache.get_counters([FuelStation.VERSION_CACHE_KEY]))[FuelStation.VERSION_CACHE_KEY]
+
+def make_route_key(start, finish):
+    return f"route_{start[0]}_{start[1]}_{finish[0]}_{finish[1]}"
+
+async def cache_route_entry(route_key, entry):
+    """Stores a route entry in Redis until it may no longer be served stale."""
+    timeout = min(settings.ROUTE_STALE_SECONDS, entry.stale_until - time.time())
+    await async_cache.set(route_key, entry.to_cache(), timeout=max(1, int(timeout)))
+
+async def store_route(route_key, route):
+    entry = CachedRoute.new(route, settings.ROUTE_FRESH_SECONDS, settings.ROUTE_STALE_SECONDS)
+    await cache_route_entry(route_key, entry)
+    await save_route_entry(route_key, entry)
+
+async def revalidate(key, refresh, *args):
+    """
+    Runs `refresh(*args)` on the background loop to refresh a stale cache entry,
+    at most once per `ROUTE_REVALIDATE_INTERVAL` for a given key across workers.
+    A refresh that fails (or returns an {"error": ...} dict) is retried no sooner.
+
+    Returns:
+        bool: True when a refresh was started.
+    """
+    if not await async_cache.add(f"revalidating_{key}", 1, timeout=settings.ROUTE_REVALIDATE_INTERVAL):
+        return False
+    registry.inc("cache_revalidations_total")
+    submit(_revalidate(key, refresh, *args))
+    return True
+
+async def _revalidate(key, refresh, *args):
+    try:
+        result = await refresh(*args)
+    except Exception as e:
+        result = {"error": str(e) or type(e).__name__}
+    if isinstance(result, dict):
+        registry.inc("cache_revalidation_failures_total")
+        logger.warning(f"Background refresh of {key} failed: {result['error']}")
+
+async def serve_cached_route(entry, start, finish, source="hit"):
+    """
+    Returns the route of a cache entry unless it expired; a stale route is
+    returned too, while it is refreshed in the background.
+    """
+    state = entry.state()
+    if state == EXPIRED:
+        return None
+    if state == STALE:
+        source = "stale"
+        registry.inc("route_stale_served_total")
+        await revalidate(make_route_key(start, finish), get_route, start, finish, True)
+    annotate_request(route_cache=source)
+    return entry.route
+
+async def rebuild_corridor(corridor_key, route, attach_stations=True):
+    """Builds the corridor of a route, with its stations if asked, and caches it."""
+    lats, lons = route.arrays()
+    corridor = await run_planning(build_corridor, lats, lons, size=len(lats))
+    if attach_stations:
+        stations = await get_fuel_stations(corridor.route_points())
+        corridor = await run_planning(with_stations, corridor, stations, size=len(lats) + len(stations))
+    await store_corridor(corridor_key, corridor)
+    return corridor
+
+async def get_route(start, finish, refresh=False):
+    """
+    Returns the route between two points, from the caches or the routing providers.
+
+    Every provider response is normalized into a `Route` before it is cached, so
+    callers never deal with provider schemas. Cached routes are served
+    stale-while-revalidate (see `CachedRoute`): a stale route is returned at once
+    and refreshed in the background, and an expired one is fetched again but still
+    returned when no provider answers.
+
+    Returns:
+        Route | dict: The route, or {"error": message} when no provider could route.
+    """
     if not all(isinstance(coord, (int, float)) for coord in start + finish):
         return {"error": "Invalid coordinates provided"}
     
-    route_key = f"route_{start[0]}_{start[1]}_{finish[0]}_{finish[1]}"
-    cached_route = cache.get(route_key)
-    if cached_route:
-        return cached_route
-
-    route_data = await get_cached_route(route_key)
-    if route_data:
-        cache.set(route_key, route_data, timeout=86400)
-        return route_data
-
-    async with aiohttp.ClientSession() as session:
-        # GraphHopper
-        url = f"https://graphhopper.com/api/1/route?point={start[0]},{start[1]}&point={finish[0]},{finish[1]}&profile=car&locale=en&calc_points=true&key={API_KEY}"
-        route_data = await fetch_route_from_api(session, url, "paths")
-        if route_data:
-            cache.set(route_key, route_data, timeout=86400)
-            await sync_to_async(RouteData.objects.create)(route_key=route_key, data=route_data)
-            return route_data
-
-        # OpenRouteService
-        url = f"https://api.openrouteservice.org/v2/directions/driving-car?api_key={OPENROUTE_API_KEY}&start={start[1]},{start[0]}&end={finish[1]},{finish[0]}"
-        route_data = await fetch_route_from_api(session, url, "routes")
-        if route_data:
-            cache.set(route_key, route_data, timeout=86400)
-            await sync_to_async(RouteData.objects.create)(route_key=route_key, data=route_data)
-            return route_data
-
-        # OSRM
-        url = f"http://router.project-osrm.org/route/v1/driving/{start[1]},{start[0]};{finish[1]},{finish[0]}?overview=full&geometries=geojson"
-        route_data = await fetch_route_from_api(session, url, "routes")
-        if route_data:
-            cache.set(route_key, route_data, timeout=86400)
-            await sync_to_async(RouteData.objects.create)(route_key=route_key, data=route_data)
-            return route_data
-
-        # HERE Maps
-        url = f"https://router.hereapi.com/v8/routes?transportMode=car&origin={start[0]},{start[1]}&destination={finish[0]},{finish[1]}&return=polyline&apikey={HERE_API_KEY}"
-        route_data = await fetch_route_from_api(session, url, "routes")
-        if route_data:
-            cache.set(route_key, route_data, timeout=86400)
-            await sync_to_async(RouteData.objects.create)(route_key=route_key, data=route_data)
-            return route_data
+    route_key = make_route_key(start, finish)
+    # A refresh (e.g. from the cache warmer) skips the caches and goes to the providers
+    fallback = None
+    if not refresh:
+        entry, source = CachedRoute.from_cache(await async_cache.get(route_key)), "hit"
+        if entry is None:
+            entry, source = CachedRoute.from_cache(await get_cached_route(route_key)), "db"
+            if entry is not None and entry.state() != EXPIRED:
+                await cache_route_entry(route_key, entry)
+        if entry is not None:
+            route = await serve_cached_route(entry, start, finish, source)
+            if route is not None:
+                return route
+            fallback = entry.route
+
+    annotate_request(route_cache="miss")
+
+    # Providers are tried healthiest first; those whose breaker is open are skipped
+    # without paying for their failure, and those short of quota are kept for last
+    providers = by_health(route_breakers)
+    remaining = await provider_quota.headroom([breaker.name for breaker in providers])
+    providers.sort(key=lambda breaker: remaining[breaker.name] < settings.PROVIDER_QUOTA_RESERVE)
+    timeout = aiohttp.ClientTimeout(total=settings.ROUTE_PROVIDER_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for breaker in providers:
+            if not breaker.allow():
+                registry.inc("route_provider_skipped_total")
+                continue
+            if not await provider_quota.take(breaker.name):
+                breaker.release()
+                continue
+            url, success_key = ROUTE_PROVIDERS[breaker.name]
+            started = time.monotonic()
+            try:
+                route_data = await fetch_route_from_api(session, url(start, finish), success_key)
+                route = normalize(breaker.name, route_data) if route_data else None
+            except (ProviderError, aiohttp.ClientError, asyncio.TimeoutError,
+                    KeyError, IndexError, TypeError, ValueError) as e:
+                breaker.record(False, time.monotonic() - started)
+                registry.inc("route_provider_failures_total")
+                logger.warning(f"Routing provider {breaker.name} failed: {str(e) or type(e).__name__}")
+                continue
+            breaker.record(True, time.monotonic() - started)
+            if route:
+                annotate_request(route_provider=breaker.name)
+                await store_route(route_key, route)
+                return route
 
+    if fallback is not None:
+        logger.warning("No routing provider answered; serving an expired cached route.")
+        registry.inc("route_stale_fallbacks_total")
+        annotate_request(route_cache="stale_fallback")
+        return fallback
     return {"error": "Failed to retrieve route from all APIs"}
\ No newline at end of file
@@ -1,32 +1,65 @@
+import math
 import time
-import polyline
-import logging
+import asyncio
+from contextlib import AsyncExitStack
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from asgiref.sync import async_to_sync
-from scipy.spatial import KDTree
-from scripts.average_fuel_price import AVERAGE_FUEL_PRICE
 from .utils import (
-    haversine_distance,
     fetch_coordinate,
-    calculate_total_distance,
     get_fuel_stations,
     get_route,
     format_city_name,
     calculate_gallons_needed,
+    make_route_key,
+    lookup_trip,
+    remember_lane,
+    serve_cached_route,
+    revalidate,
+    rebuild_corridor,
 )
+from .log_pipeline import get_logger, stage, annotate_request
+from .profiling import profile_current_thread, list_profiles, resolve_profile
+from .cache_warmer import record_lane
+from .price_aggregates import regional_average_price
+from .metrics import registry as metrics_registry
+from .http_cache import trip_etag, etag_matches, set_cache_headers
+from .pipeline import TaskGraph
+from .models import FuelStation
+from .route_model import EXPIRED, Route
+from .planning_pool import run_planning
+from .admission import admit, Overloaded
+from .corridor import (
+    VehicleProfile,
+    corridor_cache_key,
+    get_cached_corridor,
+    store_corridor,
+    plan_stops,
+    TripInfeasible,
+    build_corridor,
+    with_stations,
+    prefetch_path,
+    prefetch_covers,
+    DETAIL_LEVELS,
+    PREFETCH_BUFFER_DEG,
+)
+
+logger = get_logger(__name__, 'TripPlanner.log')
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler('TripPlanner.log')
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+MAX_PROFILES = 20
+RESPONSE_FIELDS = {"route_map", "optimal_stations", "total_fuel_cost", "plans"}
+BOOLEAN_VALUES = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+
+metrics_registry.describe("station_prefetch_hits_total", "Long trips planned with the stations prefetched during routing.")
+metrics_registry.describe("station_prefetch_misses_total", "Prefetched stations discarded because the route left their corridor.")
 
 class TripPlanner(APIView):
     """API endpoint to calculate the optimal fuel stations along a route."""
-    # AVERAGE_FUEL_PRICE = 3.43 
 
     def __init__(self, fuel_capacity=500, miles_per_gallon=10, safety_margin=50, max_distance=100):
         """
@@ -56,6 +89,7 @@ class TripPlanner(APIView):
         Returns:
             Response: JSON response with route and fuel station details.
         """
+        profile_current_thread()
         return await self.process_request(request, start_city, finish_city)
 
     async def process_request(self, request, start_city, finish_city):
@@ -82,6 +116,7 @@ class TripPlanner(APIView):
 
         formatted_start_city = format_city_name(start_city)
         formatted_finish_city = format_city_name(finish_city)
+        annotate_request(lane=f"{start_city}_{finish_city}")
 
         # Ensure start and finish cities are not the same
         if formatted_start_city == formatted_finish_city:
@@ -91,347 +126,335 @@ class TripPlanner(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # Fetch coordinates for both cities
-        start_coords = await fetch_coordinate(formatted_start_city)
-        finish_coords = await fetch_coordinate(formatted_finish_city)
-
-        if not start_coords or not finish_coords:
-            logger.error("Failed to fetch coordinates for one or both cities.")
-            return Response(
-                {"error": "Only cities within the United States are available."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
-        # Get the route data from start to finish
-        route_data = await get_route(start_coords, finish_coords)
-        if "error" in route_data:
-            logger.error(f"Route fetching failed: {route_data.get('error')}")
-            return Response(
-                route_data,
-                status=route_data.get("status", status.HTTP_500_INTERNAL_SERVER_ERROR),
-            )
         try:
-            if "paths" in route_data and route_data["paths"]:
-                encoded_points = route_data["paths"][0]["points"]
-            elif "routes" in route_data and route_data["routes"]:
-                encoded_points = polyline.encode(route_data["routes"][0]["geometry"]["coordinates"]) 
-            else:
-                logger.error("No valid route found in route_data.")
-                return Response({"error": "No valid route found", "details": route_data}, status=400)
-
-            route_points = polyline.decode(encoded_points)
-            
-        except (KeyError, IndexError, ValueError) as e:
-            logger.error(f"Error processing route data: {str(e)}")
-            return Response(
-                {"error": "Error processing route data", "details": str(e), "raw_data": route_data},
-                status=400
-            )
-
-        # Ensure the route is valid
-        if len(route_points) < 2:
-            logger.error("Invalid route: fewer than 2 points.")
-            return Response(
-                {
-                    "error": "Could not calculate a valid route between these cities."
-                    " They might be too far apart or not connected by roads."
-                    " Please check the city names and try again."
-                },
-                status=status.HTTP_400_BAD_REQUEST,
-            )
+            profiles = self.vehicle_profiles(request)
+            fields, include_geometry, detail = self.response_options(request)
+        except ValueError as e:
+            logger.warning(f"Invalid request parameters: {str(e)}")
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Geocoding, routing and the station prefetch form a small dependency graph:
+        # the route call and the speculative prefetch both only need the coordinates
+        async with AsyncExitStack() as admission, TaskGraph() as graph:
+            graph.add("geocode", self.geocode, formatted_start_city, formatted_finish_city)
+            start_coords, finish_coords, cached_route, versions = await graph.result("geocode")
+
+            if not start_coords or not finish_coords:
+                logger.error("Failed to fetch coordinates for one or both cities.")
+                return Response(
+                    {"error": "Only cities within the United States are available."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # Only lanes between real cities are worth warming
+            record_lane(start_city, finish_city)
 
-        # Calculate total route distance and fuel needed
-        total_distance = calculate_total_distance(route_points)
-        gallons_needed = calculate_gallons_needed(total_distance)
+            route_key = make_route_key(start_coords, finish_coords)
 
-        # Fetch fuel stations along the route
-        max_distance = self.max_distance
-        fueling_stations = await get_fuel_stations(route_points)
+            # Decoding and corridor preprocessing do not depend on the vehicle, so they are
+            # cached per route and station dataset and shared by every profile
+            corridor_key = corridor_cache_key(route_key, versions[FuelStation.VERSION_CACHE_KEY])
+            corridor = await get_cached_corridor(corridor_key)
 
-        # Determine the best fuel stations and total fuel cost
-        if total_distance > 500:
-            optimal_stations, total_fuel_cost = self.select_fuel_stations(
-                route_points, fueling_stations, max_distance
+            # Requests needing provider calls or station queries wait for a slot and are shed
+            # when the service is saturated; fully cached lanes are always served
+            cache_miss = cached_route is None or cached_route.state() == EXPIRED or corridor is None or (
+                not corridor.has_stations and any(corridor.total_miles > p.fuel_capacity for p in profiles)
             )
-        else:
-            optimal_stations = []
-            total_fuel_cost = gallons_needed * AVERAGE_FUEL_PRICE
+            if cache_miss:
+                try:
+                    await admission.enter_async_context(admit())
+                except Overloaded as e:
+                    logger.warning("Shedding trip request: too much cache-miss work in flight.")
+                    annotate_request(shed=True)
+                    return Response(
+                        {"error": str(e)},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        headers={"Retry-After": str(e.retry_after)},
+                    )
+
+            # Get the route data from start to finish
+            graph.add("route", self.fetch_route, start_coords, finish_coords, cached_route,
+                      formatted_start_city, formatted_finish_city, route_key)
+
+            # While the route is in flight, fetch the stations around the great circle
+            # between the cities; they are used if the route stays inside that corridor
+            if corridor is None or not corridor.has_stations:
+                graph.add("prefetch", self.prefetch_stations, start_coords, finish_coords, profiles)
+
+            route = await graph.result("route")
+            if not isinstance(route, Route):
+                logger.error(f"Route fetching failed: {route.get('error')}")
+                return Response(
+                    route,
+                    status=route.get("status", status.HTTP_500_INTERNAL_SERVER_ERROR),
+                )
+
+            # Repeat requests for an unchanged plan are answered before any planning work; the
+            # ETag covers the route actually served, whether cached, refreshed or just fetched
+            planner_defaults = (self.fuel_capacity, self.miles_per_gallon, self.safety_margin, self.max_distance)
+            etag = trip_etag(route_key, route, versions, request.GET, planner_defaults)
+            if etag_matches(request, etag):
+                annotate_request(not_modified=True)
+                return set_cache_headers(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+            if corridor is None:
+                lats, lons = route.arrays()
+                # Ensure the route is valid
+                if len(lats) < 2:
+                    logger.error("Invalid route: fewer than 2 points.")
+                    return Response(
+                        {
+                            "error": "Could not calculate a valid route between these cities."
+                            " They might be too far apart or not connected by roads."
+                            " Please check the city names and try again."
+                        },
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                # Long routes are preprocessed off the event loop
+                with stage("corridor"):
+                    corridor = await run_planning(build_corridor, lats, lons, size=len(lats))
+                await store_corridor(corridor_key, corridor)
+            elif corridor.is_stale:
+                # Served as is while it is rebuilt from the current route
+                await revalidate(corridor_key, rebuild_corridor, corridor_key, route, corridor.has_stations)
+
+            total_distance = corridor.total_miles
+
+            # Fetch fuel stations along the route once, only if some vehicle needs to refuel;
+            # short trips never wait for station work and drop any prefetch in flight
+            if not corridor.has_stations and any(total_distance > p.fuel_capacity for p in profiles):
+                fueling_stations = None
+                if "prefetch" in graph:
+                    try:
+                        prefetched = await graph.result("prefetch")
+                    except Exception as e:
+                        logger.warning(f"Station prefetch failed: {str(e)}")
+                        prefetched = None
+                    if prefetched is not None:
+                        if prefetch_covers(corridor, *prefetched[0]):
+                            metrics_registry.inc("station_prefetch_hits_total")
+                            fueling_stations = prefetched[1]
+                        else:
+                            metrics_registry.inc("station_prefetch_misses_total")
+                if fueling_stations is None:
+                    with stage("stations"):
+                        fueling_stations = await get_fuel_stations(corridor.route_points())
+                with stage("project"):
+                    corridor = await run_planning(
+                        with_stations, corridor, fueling_stations, size=len(corridor.lats) + len(fueling_stations)
+                    )
+                await store_corridor(corridor_key, corridor)
+
+        # Determine the best fuel stations and total fuel cost for each vehicle profile
+        plans = []
+        regional_price = None
+        with stage("plan"):
+            for profile in profiles:
+                if total_distance > profile.fuel_capacity:
+                    try:
+                        optimal_stations, total_fuel_cost = plan_stops(corridor, profile, self.max_distance)
+                    except TripInfeasible as e:
+                        return Response(
+                            {"error": str(e), "vehicle": profile._asdict(), "stranded_at_mile": round(e.stranded_at, 2)},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        )
+                else:
+                    if regional_price is None:
+                        regional_price = await regional_average_price(corridor.route_points())
+                    optimal_stations = []
+                    gallons_needed = calculate_gallons_needed(total_distance, profile.miles_per_gallon)
+                    total_fuel_cost = gallons_needed * regional_price
+                plans.append(self.format_plan(profile, optimal_stations, total_fuel_cost))
 
         execution_time = time.time() - start_time
         print(f"Execution time: {execution_time:.4f} seconds")  # يبقى print كما هو
-        if "paths" in route_data and route_data["paths"]:
-            route_data["paths"][0]["points"] = polyline.encode(route_points)
-        elif "routes" in route_data and route_data["routes"]:
-            route_data["routes"][0]["geometry"]["coordinates"] = polyline.encode(route_points)
-
         # Return final response with route and fuel details
+        annotate_request(total_ms=round(execution_time * 1000, 2))
         logger.info("Successfully processed trip request.")
-        return Response(
-            {
-                "route_map": {
-                    "coordinates": route_data,
-                    "total_distance": total_distance,
-                },
-                "optimal_stations": (
-                    [
-                        {
-                            "opis_truckstop_id": station[0],
-                            "address": station[1],
-                            "price_per_gallon": station[2],
-                            "miles_from_start": station[3],
-                        }
-                        for station in optimal_stations
-                    ]
-                    if optimal_stations
-                    else "no stations as distance less than 500 miles"
-                ),
-                "total_fuel_cost": total_fuel_cost,
-            }
-        )
-
-    def can_complete_trip(self, route_points, fuel_stations, max_distance):
+        route_map = {
+            "provider": route.provider,
+            "total_distance": total_distance,
+            "duration": route.duration_seconds,
+        }
+        # The full geometry is the normalized route's polyline; lower detail levels come
+        # precomputed with the corridor
+        if include_geometry:
+            route_map["geometry"] = route.geometry if detail == "full" else corridor.simplified_geometry(detail)
+        response_data = {
+            "route_map": route_map,
+            "optimal_stations": plans[0]["optimal_stations"],
+            "total_fuel_cost": plans[0]["total_fuel_cost"],
+        }
+        if len(plans) > 1:
+            response_data["plans"] = plans
+        if fields:
+            response_data = {field: value for field, value in response_data.items() if field in fields}
+        return set_cache_headers(Response(response_data), etag)
+
+    async def geocode(self, start_city, finish_city):
         """
-        Simulates the trip in advance to determine if it can be completed 
-        without running out of fuel at any point.
-
-        Args:
-            route_points (list of tuples): List of (latitude, longitude) points representing the route.
-            fuel_stations (list of tuples): List of available fuel stations with their coordinates and prices.
-            max_distance (float): Maximum distance to search for a fuel station.
+        Resolves both cities, reading the cache in one round trip and looking the
+        misses up concurrently.
 
         Returns:
-            bool: True if the trip is feasible, False if refueling is impossible at any stage.
+            tuple: Start coordinates, finish coordinates, the lane's `CachedRoute` (or None)
+            and the dataset versions.
         """
-        # Moved this check to the beginning to fix test_can_complete_trip_failure
-        if not fuel_stations:
-            logger.warning("No fuel stations available for trip simulation.")
-            return False
-
-        station_coords = [(s[3], s[4]) for s in fuel_stations]  # Extract station coordinates
-        kdtree = KDTree(station_coords) if station_coords else None  # Create KDTree for fast nearest-neighbor search
-
-        remaining_range = self.fuel_capacity  # Current fuel range
-        total_distance = calculate_total_distance(route_points)  # Total trip distance
-        remaining_distance_to_end = total_distance  # Distance left to reach the destination
-
-        for i in range(len(route_points) - 1):
-            # Calculate distance between consecutive route points
-            distance_segment = haversine_distance(
-                route_points[i][0], route_points[i][1],
-                route_points[i + 1][0], route_points[i + 1][1]
-            )
-
-            remaining_range -= distance_segment  # Reduce fuel range
-            remaining_distance_to_end -= distance_segment  # Update remaining distance
-
-            # Check if fuel is running low and the trip is not close to completion
-            if remaining_range < self.safety_margin and remaining_distance_to_end > self.safety_margin:
-                best_station = self.find_cheapest_station(kdtree, route_points[i], fuel_stations, set())
-                if not best_station:
-                    logger.warning("No fuel station found when needed during trip simulation.")
-                    return False  # No fuel station nearby when needed -> Trip is not possible
+        start_coords, finish_coords, cached_route, versions = await lookup_trip(start_city, finish_city)
 
-                remaining_range = self.fuel_capacity  # Assume refueling to full tank
+        async def resolve(city, coords):
+            return await fetch_coordinate(city) if coords is None else coords
 
-        return True  # Trip can be completed successfully
-  
-    def select_fuel_stations(self, route_points, fuel_stations, max_distance):
+        start_coords, finish_coords = await asyncio.gather(
+            resolve(start_city, start_coords), resolve(finish_city, finish_coords)
+        )
+        return start_coords, finish_coords, cached_route, versions
+
+    async def fetch_route(self, start_coords, finish_coords, cached_route, start_city, finish_city, route_key):
+        """Returns the lane's cached route unless it expired, or fetches it and points the lane at it."""
+        if cached_route is not None:
+            route = await serve_cached_route(cached_route, start_coords, finish_coords)
+            if route is not None:
+                return route
+        route = await get_route(start_coords, finish_coords)
+        if isinstance(route, Route):
+            await remember_lane(start_city, finish_city, route_key)
+        return route
+
+    async def prefetch_stations(self, start_coords, finish_coords, profiles):
         """
-        Selects the optimal fuel stations along a route to minimize cost while ensuring 
-        the vehicle never runs out of fuel.
-
-        Args:
-            route_points (list): List of (latitude, longitude) tuples representing the route.
-            fuel_stations (list): List of fuel stations with their details.
-            max_distance (float): Maximum search radius for fuel stations.
+        Speculatively fetches the stations around the great circle between the cities.
 
         Returns:
-            tuple: A list of selected fuel stations and the total estimated fuel cost.
+            tuple: The great-circle (lats, lons) path and its stations, or None when
+            the trip looks too short for any profile to refuel.
         """
-        if not route_points or len(route_points) < 2:
-            logger.error("Route must have at least two points.")
-            return [], 0.0
-
-        # Prepare KDTree for fast fuel station lookup
-        station_coords = [(s[3], s[4]) for s in fuel_stations]
-        kdtree = KDTree(station_coords) if station_coords else None
-        total_distance = calculate_total_distance(route_points)
-        optimal_stations = []
-        visited_station_ids = set()
-        total_fuel_cost = 0.0
-        remaining_range = self.fuel_capacity
-        remaining_distance_to_end = total_distance
-
-        # Check if the trip is feasible before starting
-        if not self.can_complete_trip(route_points, fuel_stations, max_distance):
-            logger.info("Trip requires staged refueling.")
-            # Modified to handle staged refueling result to fix test_select_fuel_stations_success
-            stages, _ = self.split_route_into_stages(route_points, fuel_stations)
-            current_position = 0.0
-            for stage_point, station in stages:
-                current_position += haversine_distance(
-                    route_points[0][0], route_points[0][1],
-                    stage_point[0], stage_point[1]
-                )
-                fuel_needed = self.fuel_capacity - remaining_range
-                cost = (fuel_needed / self.miles_per_gallon) * station[2]
-                total_fuel_cost += cost
-                optimal_stations.append((
-                    station[0],
-                    station[1] if station[1] else 'not specified',
-                    station[2],
-                    round(current_position, 2),
-                    round(cost, 2)
-                ))
-                remaining_range = self.fuel_capacity
-            return optimal_stations, round(total_fuel_cost, 2)
-
-        # Find the cheapest station near the starting point
-        start_location = route_points[0]
-        # Added to handle empty fuel_stations case to fix test_select_fuel_stations_no_stations
-        if not fuel_stations:
-            logger.warning("No fuel stations available near the starting point.")
-            return [], 0.0
-        cheapest_start_station = self.find_cheapest_station(kdtree, start_location, fuel_stations, visited_station_ids)
-
-        if not cheapest_start_station:
-            logger.warning("No fuel stations available near the starting point.")
-            return [], 0.0
-
-        # Initial refueling cost
-        initial_fuel_cost = (self.fuel_capacity / self.miles_per_gallon) * cheapest_start_station[2]
-        total_fuel_cost += initial_fuel_cost
-        remaining_range = self.fuel_capacity
-
-        current_position = 0.0  # Tracks distance covered along the route
-
-        # Iterate over the route and refuel when needed
-        for i in range(len(route_points) - 1):
-            distance_segment = haversine_distance(
-                route_points[i][0], route_points[i][1], 
-                route_points[i + 1][0], route_points[i + 1][1]
-            )
+        path = prefetch_path(start_coords, finish_coords, profiles)
+        if path is None:
+            return None
+        return path, await get_fuel_stations(list(zip(*path)), PREFETCH_BUFFER_DEG)
 
-            current_position += distance_segment
-            remaining_range -= distance_segment
-            remaining_distance_to_end -= distance_segment
-
-            # Refuel if running low on fuel and still far from destination
-            if remaining_range < self.safety_margin and remaining_distance_to_end > self.safety_margin:
-                best_station = self.find_cheapest_station(kdtree, route_points[i], fuel_stations, visited_station_ids)
-                if not best_station:
-                    logger.warning("No available fuel stations for refueling.")
-                    return [], total_fuel_cost
-
-                visited_station_ids.add(best_station[0])
-
-                # Calculate the fuel needed for the next leg of the journey
-                fuel_needed = min(self.fuel_capacity, remaining_distance_to_end) - remaining_range
-                if fuel_needed > 0:
-                    cost = (fuel_needed / self.miles_per_gallon) * best_station[2]
-                    total_fuel_cost += cost
-                    remaining_range += fuel_needed
-
-                    optimal_stations.append((
-                        best_station[0],  # Station ID
-                        best_station[1] if best_station[1] else 'not specified',  # Address
-                        best_station[2],  # Price per gallon
-                        round(current_position, 2),  # Distance from start
-                        round(cost, 2)  # Fuel cost at this station
-                    ))
-
-        # Sort stations by distance from the start
-        optimal_stations.sort(key=lambda x: x[3])
-        return optimal_stations, round(total_fuel_cost, 2)
-
-    def split_route_into_stages(self, route_points, fuel_stations):
+    def vehicle_profiles(self, request):
         """
-        Splits a long route into stages based on fuel constraints, ensuring refueling 
-        at optimal stations along the way.
+        Builds the vehicle profiles to plan for from the query parameters.
+
+        `fuel_capacity`, `miles_per_gallon` and `safety_margin` override the planner
+        defaults; `profiles=capacity:mpg:margin,...` plans several vehicles at once.
 
         Args:
-            route_points (list): List of (latitude, longitude) tuples representing the route.
-            fuel_stations (list): List of available fuel stations with their details.
+            request (Request): HTTP request object.
 
         Returns:
-            tuple: A list of stages where refueling is needed and a message indicating staged refueling.
-        """
-        stages = []
-        current_position = 0.0
-        remaining_range = self.fuel_capacity
-        total_distance = calculate_total_distance(route_points)
-        remaining_distance_to_end = total_distance
-
-        # Prepare KDTree for fast nearest station lookup
-        station_coords = [(s[3], s[4]) for s in fuel_stations]
-        kdtree = KDTree(station_coords) if station_coords else None
-
-        for i in range(len(route_points) - 1):
-            # Calculate distance between consecutive route points
-            distance_segment = haversine_distance(
-                route_points[i][0], route_points[i][1],
-                route_points[i + 1][0], route_points[i + 1][1]
-            )
+            list: VehicleProfile tuples.
 
-            current_position += distance_segment
-            remaining_range -= distance_segment
-            remaining_distance_to_end -= distance_segment
-
-            # Check if refueling is needed
-            if remaining_range < self.safety_margin:
-                best_station = self.find_cheapest_station(kdtree, route_points[i], fuel_stations, set())
-
-                # If no station found, expand search radius gradually
-                search_radius = self.max_distance * 3
-                while not best_station and search_radius <= self.max_distance * 5:
-                    best_station = self.find_cheapest_station(kdtree, route_points[i], fuel_stations, set())
-                    search_radius += self.max_distance
-                
-                # If a suitable station is found, record it as a refueling stage
-                if best_station:
-                    stages.append((route_points[i], best_station))
-                    remaining_range = self.fuel_capacity  # Refuel to full capacity
-
-        logger.info("Route split into stages for refueling.")
-        return stages, "Trip requires staged refueling"
-
-    def find_cheapest_station(self, kdtree, search_point, fuel_stations, visited_station_ids):
+        Raises:
+            ValueError: If a parameter is malformed or out of range.
         """
-        Finds the cheapest nearby fuel station within a dynamically expanding search radius.
-
-        Args:
-            kdtree (KDTree): KDTree containing fuel station coordinates for fast lookup.
-            search_point (tuple): (latitude, longitude) of the current location.
-            fuel_stations (list): List of available fuel stations.
-            visited_station_ids (set): Set of station IDs already visited.
-
-        Returns:
-            tuple or None: The best fuel station (ID, address, price, lat, lon) or None if no station is found.
+        params = request.GET
+        try:
+            if params.get("profiles"):
+                profiles = [
+                    VehicleProfile(*(float(value) for value in spec.split(":")))
+                    for spec in params["profiles"].split(",")
+                ]
+            else:
+                profiles = [VehicleProfile(
+                    float(params.get("fuel_capacity", self.fuel_capacity)),
+                    float(params.get("miles_per_gallon", self.miles_per_gallon)),
+                    float(params.get("safety_margin", self.safety_margin)),
+                )]
+        except TypeError:
+            raise ValueError("Each profile must be given as fuel_capacity:miles_per_gallon:safety_margin.")
+
+        if len(profiles) > MAX_PROFILES:
+            raise ValueError(f"At most {MAX_PROFILES} vehicle profiles can be planned at once.")
+        for profile in profiles:
+            if not all(math.isfinite(value) for value in profile):
+                raise ValueError("Vehicle parameters must be finite numbers.")
+            if profile.fuel_capacity <= 0 or profile.miles_per_gallon <= 0:
+                raise ValueError("fuel_capacity and miles_per_gallon must be positive.")
+            if not 0 <= profile.safety_margin < profile.fuel_capacity:
+                raise ValueError("safety_margin must be between 0 and fuel_capacity.")
+        return profiles
+
+    def response_options(self, request):
         """
-        # Added to handle None case to fix test_select_fuel_stations_no_stations and test_find_cheapest_station_none
-        if kdtree is None:
-            return None
+        Reads the options that trim the response.
 
-        max_possible_distance = self.fuel_capacity * self.miles_per_gallon  # Maximum possible travel distance
-        search_radius = min(self.max_distance, max_possible_distance)
-        while search_radius <= max_possible_distance:
-            # Find stations within the current search radius
-            nearby_indices = kdtree.query_ball_point(search_point, search_radius)
-            available_stations = [
-                fuel_stations[idx] for idx in nearby_indices if fuel_stations[idx][0] not in visited_station_ids
-            ]
-
-            # If stations are found, choose the cheapest one based on price and distance
-            if available_stations:
-                return min(
-                    available_stations,
-                    key=lambda s: (s[2], haversine_distance(search_point[0], search_point[1], s[3], s[4]))
-                )
+        `fields=a,b` keeps only the listed top-level fields, `include_geometry=false`
+        drops the provider route geometry, by far the largest part of the payload, and
+        `detail=low|medium|full` picks a simplified geometry for overview maps.
 
-            # Expand search radius: Initially double it for speed, then switch to linear growth
-            if search_radius * 2 <= max_possible_distance / 2:
-                search_radius *= 2
-            else:
-                search_radius = min(search_radius + self.max_distance, max_possible_distance)
+        Returns:
+            tuple: The set of fields to keep (None for all), whether to include the
+            geometry and its detail level.
 
-        return None  # Return None if no suitable station is found
\ No newline at end of file
+        Raises:
+            ValueError: If an unknown field or flag value is given.
+        """
+        params = request.GET
+        fields = None
+        if params.get("fields"):
+            fields = {field.strip() for field in params["fields"].split(",") if field.strip()}
+            unknown = fields - RESPONSE_FIELDS
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+
+        include_geometry = params.get("include_geometry", "true").lower()
+        if include_geometry not in BOOLEAN_VALUES:
+            raise ValueError("include_geometry must be true or false.")
+
+        detail = params.get("detail", "full").lower()
+        if detail not in DETAIL_LEVELS:
+            raise ValueError(f"detail must be one of: {', '.join(DETAIL_LEVELS)}.")
+        return fields, BOOLEAN_VALUES[include_geometry], detail
+
+    def format_plan(self, profile, optimal_stations, total_fuel_cost):
+        """Formats the refuelling plan of one vehicle profile for the response."""
+        return {
+            "vehicle": profile._asdict(),
+            "optimal_stations": (
+                [
+                    {
+                        "opis_truckstop_id": station[0],
+                        "address": station[1],
+                        "price_per_gallon": station[2],
+                        "miles_from_start": station[3],
+                    }
+                    for station in optimal_stations
+                ]
+                if optimal_stations
+                else f"no stations as distance less than {profile.fuel_capacity:g} miles"
+            ),
+            "total_fuel_cost": total_fuel_cost,
+        }
+
+
+class ProfileList(APIView):
+    """Admin-only endpoint listing recent request profiles."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"profiles": list_profiles()})
+
+
+class ProfileDownload(APIView):
+    """Admin-only endpoint downloading a request profile as collapsed stacks."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        path = resolve_profile(name)
+        if path is None:
+            raise Http404("Profile not found")
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=name, content_type="text/plain")
+
+
+class Metrics(APIView):
+    """Process metrics in the Prometheus text format, guarded by METRICS_TOKEN when set."""
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token and not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(metrics_registry.render(), content_type="text/plain; version=0.0.4")
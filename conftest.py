@@ -1,4 +1,6 @@
 import pytest
+from unittest.mock import AsyncMock
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
 
 # إعداد Django قبل الاختبارات
@@ -10,11 +12,45 @@ def setup_django(django_db_setup, django_db_blocker):
 # إفراغ الكاش قبل كل اختبار
 @pytest.fixture(autouse=True)
 def clear_cache():
+    from api.corridor import reset_corridors
+    from api.utils import reset_route_breakers
     cache.clear()
+    reset_corridors()
+    reset_route_breakers()
+
+# Isolate the station snapshot directory per test
+@pytest.fixture(autouse=True)
+def station_snapshot_dir(settings, tmp_path):
+    from api.station_snapshot import reset_snapshot
+    settings.STATION_SNAPSHOT_DIR = str(tmp_path / "station_snapshot")
+    reset_snapshot()
+    yield settings.STATION_SNAPSHOT_DIR
+    reset_snapshot()
 
 # إعداد جلسة aiohttp للاختبارات الغير متزامنة
 @pytest.fixture
 async def aiohttp_session():
     from aiohttp import ClientSession
     async with ClientSession() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+# Remove cities and their geocoding requests left behind by other tests
+@pytest.fixture
+async def clean_city_coordinates():
+    from api.models import CityCoordinates, GeocodeRequest
+    await sync_to_async(CityCoordinates.objects.all().delete)()
+    await sync_to_async(GeocodeRequest.objects.all().delete)()
+    yield
+
+# Build fake aiohttp responses to return from a patched ClientSession.get
+@pytest.fixture
+def mock_response():
+    def build(status, payload=None, headers=None):
+        response = AsyncMock()
+        response.status = status
+        response.headers = headers or {}
+        response.json = AsyncMock(return_value=payload)
+        response.__aenter__ = AsyncMock(return_value=response)
+        response.__aexit__ = AsyncMock(return_value=None)
+        return response
+    return build
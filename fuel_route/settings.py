@@ -66,12 +66,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.RequestContextMiddleware',
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'fuel_route.urls'
@@ -127,6 +130,8 @@ else:
             'PASSWORD': 'postgres',
             'HOST': 'db',
             'PORT': '5432',
+            # Database pool threads keep their connection open between queries
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
         }
     }
 
@@ -172,4 +177,146 @@ STATIC_URL = '/static/'
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Logging pipeline (see api/log_pipeline.py)
+# Records are queued and written by a background thread; above the threshold
+# (fraction of the queue in use) INFO lines are sampled, and dropped when full.
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_SAMPLE_THRESHOLD = config('LOG_SAMPLE_THRESHOLD', default=0.8, cast=float)
+LOG_SAMPLE_RATE = config('LOG_SAMPLE_RATE', default=0.1, cast=float)
+
+# Request profiling (see api/profiling.py)
+# A request is profiled when it carries PROFILING_HEADER (matching PROFILING_TOKEN,
+# or from a staff user when no token is set) or with probability PROFILING_SAMPLE_RATE.
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_HEADER = config('PROFILING_HEADER', default='X-Debug-Profile')
+PROFILING_TOKEN = config('PROFILING_TOKEN', default='')
+PROFILING_INTERVAL = config('PROFILING_INTERVAL', default=0.005, cast=float)
+PROFILING_MAX_FILES = config('PROFILING_MAX_FILES', default=50, cast=int)
+PROFILE_DIR = config('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+
+# Memory-mapped station snapshot shared by all workers (see api/station_snapshot.py),
+# rebuilt after each fuel data load or with scripts/build_station_snapshot.py.
+STATION_SNAPSHOT_DIR = config('STATION_SNAPSHOT_DIR', default=str(BASE_DIR / 'var' / 'station_snapshot'))
+
+# Background cache warmer (see api/cache_warmer.py)
+# Every CACHE_WARMER_INTERVAL seconds the CACHE_WARMER_TOP_K hottest lanes whose route
+# expires within CACHE_WARMER_REFRESH_BEFORE seconds are refreshed, spending at most
+# CACHE_WARMER_PROVIDER_BUDGET provider calls per hour across all workers.
+CACHE_WARMER_ENABLED = config('CACHE_WARMER_ENABLED', default=False, cast=bool)
+CACHE_WARMER_INTERVAL = config('CACHE_WARMER_INTERVAL', default=300, cast=int)
+CACHE_WARMER_TOP_K = config('CACHE_WARMER_TOP_K', default=50, cast=int)
+CACHE_WARMER_REFRESH_BEFORE = config('CACHE_WARMER_REFRESH_BEFORE', default=3600, cast=int)
+CACHE_WARMER_PROVIDER_BUDGET = config('CACHE_WARMER_PROVIDER_BUDGET', default=100, cast=int)
+
+# API rendering: orjson for JSON, the browsable API kept for development
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Response compression (see api.middleware.CompressionMiddleware): brotli when the
+# client accepts it, gzip otherwise, for bodies of at least COMPRESSION_MIN_SIZE bytes.
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int)
+BROTLI_QUALITY = config('BROTLI_QUALITY', default=5, cast=int)
+
+# HTTP caching of trip plans (see api/http_cache.py): plans carry a strong ETag and
+# may be reused by clients and shared caches for TRIP_CACHE_MAX_AGE seconds.
+TRIP_CACHE_MAX_AGE = config('TRIP_CACHE_MAX_AGE', default=300, cast=int)
+
+# Geocoding queue (see api/geocoding_queue.py, drained by scripts/run_geocoding_worker.py)
+# Stations of cities that cannot be geocoded during ingestion are queued and backfilled
+# at GEOCODING_RATE_PER_SECOND. When the quota is exhausted calls pause until the
+# provider's X-RateLimit-Reset (or GEOCODING_DEFAULT_PAUSE seconds without one).
+GEOCODING_RATE_PER_SECOND = config('GEOCODING_RATE_PER_SECOND', default=1.0, cast=float)
+GEOCODING_BATCH_SIZE = config('GEOCODING_BATCH_SIZE', default=100, cast=int)
+GEOCODING_MAX_ATTEMPTS = config('GEOCODING_MAX_ATTEMPTS', default=5, cast=int)
+GEOCODING_RETRY_BACKOFF = config('GEOCODING_RETRY_BACKOFF', default=300, cast=int)
+GEOCODING_DEFAULT_PAUSE = config('GEOCODING_DEFAULT_PAUSE', default=3600, cast=int)
+GEOCODING_IDLE_INTERVAL = config('GEOCODING_IDLE_INTERVAL', default=30, cast=int)
+
+# Offline US places gazetteer (see api/gazetteer.py), imported with scripts/load_gazetteer.py.
+# Census Gazetteer places file: https://www.census.gov/geographies/reference-files/time-series/geo/gazetteer-files.html
+GAZETTEER_PATH = config('GAZETTEER_PATH', default=str(BASE_DIR / 'data' / '2023_Gaz_place_national.txt'))
+
+# Negative caching of unresolvable cities: names the geocoding API has no result for are
+# not queried again for GEOCODING_NEGATIVE_TTL seconds, and request-time misses are
+# answered from the cache for CITY_NEGATIVE_CACHE_TTL seconds.
+GEOCODING_NEGATIVE_TTL = config('GEOCODING_NEGATIVE_TTL', default=604800, cast=int)
+CITY_NEGATIVE_CACHE_TTL = config('CITY_NEGATIVE_CACHE_TTL', default=3600, cast=int)
+
+# Async Redis layer for the request path (see api/async_cache.py): city coordinates
+# and routes are stored msgpack-encoded under ASYNC_CACHE_PREFIX in the cache database.
+ASYNC_CACHE_URL = config('ASYNC_CACHE_URL', default=CACHES['default']['LOCATION'])
+ASYNC_CACHE_PREFIX = config('ASYNC_CACHE_PREFIX', default='fr')
+ASYNC_CACHE_MAX_CONNECTIONS = config('ASYNC_CACHE_MAX_CONNECTIONS', default=50, cast=int)
+
+# Database thread pool for the request path (see api/db_pool.py). Keep DB_POOL_SIZE below
+# the connections PostgreSQL allows per worker process; saturation is exported as
+# db_pool_* metrics at /api/metrics/, which requires METRICS_TOKEN as a bearer token when set.
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Planning pool (see api/planning_pool.py): corridor preprocessing for routes with at
+# least PLANNING_OFFLOAD_THRESHOLD vertices plus stations runs on PLANNING_POOL_SIZE
+# workers ("process" or "thread") instead of the event loop; queue depth is exported
+# as planning_pool_* metrics.
+PLANNING_POOL_KIND = config('PLANNING_POOL_KIND', default='process')
+PLANNING_POOL_SIZE = config('PLANNING_POOL_SIZE', default=2, cast=int)
+PLANNING_OFFLOAD_THRESHOLD = config('PLANNING_OFFLOAD_THRESHOLD', default=20000, cast=int)
+
+# Admission control (see api/admission.py): trip requests that miss the route or corridor
+# cache are limited to ADMISSION_WORKER_LIMIT per worker and ADMISSION_GLOBAL_LIMIT across
+# workers (0 disables it). Up to ADMISSION_QUEUE_SIZE requests wait ADMISSION_QUEUE_TIMEOUT
+# seconds for a slot; the rest get a 503 with Retry-After: ADMISSION_RETRY_AFTER. Cached
+# lanes are always served.
+ADMISSION_WORKER_LIMIT = config('ADMISSION_WORKER_LIMIT', default=8, cast=int)
+ADMISSION_GLOBAL_LIMIT = config('ADMISSION_GLOBAL_LIMIT', default=64, cast=int)
+ADMISSION_QUEUE_SIZE = config('ADMISSION_QUEUE_SIZE', default=32, cast=int)
+ADMISSION_QUEUE_TIMEOUT = config('ADMISSION_QUEUE_TIMEOUT', default=2.0, cast=float)
+ADMISSION_RETRY_AFTER = config('ADMISSION_RETRY_AFTER', default=5, cast=int)
+ADMISSION_LEASE_SECONDS = config('ADMISSION_LEASE_SECONDS', default=60, cast=int)
+
+# Routing provider circuit breakers (see api/circuit_breaker.py). A provider whose error
+# rate over ROUTE_BREAKER_WINDOW seconds reaches ROUTE_BREAKER_ERROR_RATE (with at least
+# ROUTE_BREAKER_MIN_CALLS calls) is skipped for ROUTE_BREAKER_COOLDOWN seconds, then probed
+# with a single call. Providers with failed or slow (ROUTE_BREAKER_SLOW_CALL seconds) calls
+# are tried after healthier ones; each call is bounded by ROUTE_PROVIDER_TIMEOUT seconds.
+ROUTE_PROVIDER_TIMEOUT = config('ROUTE_PROVIDER_TIMEOUT', default=10.0, cast=float)
+ROUTE_BREAKER_WINDOW = config('ROUTE_BREAKER_WINDOW', default=60.0, cast=float)
+ROUTE_BREAKER_MIN_CALLS = config('ROUTE_BREAKER_MIN_CALLS', default=5, cast=int)
+ROUTE_BREAKER_ERROR_RATE = config('ROUTE_BREAKER_ERROR_RATE', default=0.5, cast=float)
+ROUTE_BREAKER_COOLDOWN = config('ROUTE_BREAKER_COOLDOWN', default=30.0, cast=float)
+ROUTE_BREAKER_SLOW_CALL = config('ROUTE_BREAKER_SLOW_CALL', default=3.0, cast=float)
+
+# Provider quotas shared by all workers (see api/provider_quota.py), as name:value lists.
+# PROVIDER_DAILY_QUOTAS caps calls per UTC day; PROVIDER_RATE_LIMITS caps calls per second
+# with PROVIDER_BURST_SECONDS of burst. Routing providers with less than
+# PROVIDER_QUOTA_RESERVE of their daily quota left are only tried after the others.
+def _provider_values(value, cast):
+    return {name: cast(limit) for name, limit in (item.split(':') for item in value.split(',') if item)}
+
+PROVIDER_DAILY_QUOTAS = _provider_values(
+    config('PROVIDER_DAILY_QUOTAS', default='graphhopper:500,openrouteservice:2000,here:1000,opencage:2500'), int
+)
+PROVIDER_RATE_LIMITS = _provider_values(
+    config('PROVIDER_RATE_LIMITS', default='graphhopper:1,openrouteservice:0.6,osrm:1,here:5,opencage:1'), float
+)
+PROVIDER_BURST_SECONDS = config('PROVIDER_BURST_SECONDS', default=5.0, cast=float)
+PROVIDER_QUOTA_RESERVE = config('PROVIDER_QUOTA_RESERVE', default=0.1, cast=float)
+
+# Route matrix (see api/route_matrix.py), built daily with scripts/precompute_route_matrix.py:
+# routes between every pair of a list of top cities, spending at most this many route fetches a run
+ROUTE_MATRIX_PROVIDER_BUDGET = config('ROUTE_MATRIX_PROVIDER_BUDGET', default=500, cast=int)
+
+# Stale-while-revalidate for cached routes and corridors: entries are fresh for
+# ROUTE_FRESH_SECONDS, then served stale while refreshed in the background until
+# ROUTE_STALE_SECONDS after they were stored. Past that they are fetched again, and only
+# served when no routing provider answers. A failed background refresh of an entry is
+# retried after ROUTE_REVALIDATE_INTERVAL seconds.
+ROUTE_FRESH_SECONDS = config('ROUTE_FRESH_SECONDS', default=86400, cast=int)
+ROUTE_STALE_SECONDS = config('ROUTE_STALE_SECONDS', default=604800, cast=int)
+ROUTE_REVALIDATE_INTERVAL = config('ROUTE_REVALIDATE_INTERVAL', default=300, cast=int)
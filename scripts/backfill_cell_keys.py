@@ -0,0 +1,40 @@
+import os
+import sys
+import django
+
+
+# Add project root to sys.path
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+# Set up Django environment
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fuel_route.settings")
+django.setup()
+
+
+from api.models import FuelStation
+from api.spatial import cell_keys
+
+def backfill_cell_keys(batch_size=5000):
+    """Compute the spatial cell key of every fuel station and store it in bulk."""
+    stations = list(FuelStation.objects.only("id", "latitude", "longitude"))
+    if not stations:
+        return 0
+
+    keys = cell_keys([s.latitude for s in stations], [s.longitude for s in stations])
+    for station, key in zip(stations, keys):
+        station.cell_key = int(key)
+    FuelStation.objects.bulk_update(stations, ["cell_key"], batch_size=batch_size)
+    return len(stations)
+
+def main():
+    """Main function to backfill the cell keys of existing stations."""
+    try:
+        print(" Computing cell keys for fuel stations...")
+        updated = backfill_cell_keys()
+        print(f" Updated cell keys for {updated} fuel stations!")
+    except Exception as e:
+        print(f" An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import os
+import sys
+import django
+
+
+# Add project root to sys.path
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+# Set up Django environment
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fuel_route.settings")
+django.setup()
+
+
+from django.conf import settings
+from api.models import FuelStation
+
+def main():
+    """Main function to publish the memory-mapped station snapshot."""
+    try:
+        print(" Building station snapshot from the database...")
+        version = FuelStation.build_snapshot()
+        print(f" Station snapshot {version} written to {settings.STATION_SNAPSHOT_DIR}!")
+    except Exception as e:
+        print(f" An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import os
+import sys
+import django
+
+
+# Add project root to sys.path
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+# Set up Django environment
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fuel_route.settings")
+django.setup()
+
+
+from django.conf import settings
+from api.gazetteer import load_gazetteer
+
+def main():
+    """Main function to import the US places gazetteer into CityCoordinates."""
+    path = sys.argv[1] if len(sys.argv) > 1 else settings.GAZETTEER_PATH
+    try:
+        print(f" Importing gazetteer places from {path}...")
+        count = load_gazetteer(path)
+        print(f" Imported {count} places!")
+    except Exception as e:
+        print(f" An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import os
+import sys
+import django
+
+
+# Add project root to sys.path
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+# Set up Django environment
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fuel_route.settings")
+django.setup()
+
+
+from django.conf import settings
+from api.route_matrix import read_cities, precompute_matrix
+
+def main():
+    """Main function to precompute the routes (and optionally plans) between the top cities."""
+    parser = argparse.ArgumentParser(description="Precompute routes between every pair of cities.")
+    parser.add_argument("cities", help="File with one city slug per line, most important first.")
+    parser.add_argument("--budget", type=int, default=settings.ROUTE_MATRIX_PROVIDER_BUDGET, help="Maximum route fetches.")
+    parser.add_argument("--plans", action="store_true", help="Also cache corridors with stations for each lane.")
+    parser.add_argument("--refresh", action="store_true", help="Fetch routes again even when already stored.")
+    args = parser.parse_args()
+    try:
+        cities = read_cities(args.cities)
+        print(f" Precomputing routes between {len(cities)} cities (budget {args.budget})...")
+        stats = asyncio.run(precompute_matrix(cities, args.budget, include_plans=args.plans, refresh=args.refresh))
+        print(f" Route matrix done: {stats}")
+    except Exception as e:
+        print(f" An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import django
+
+
+# Add project root to sys.path
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+# Set up Django environment
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fuel_route.settings")
+django.setup()
+
+
+from api.models import PriceAggregate
+
+def main():
+    """Main function to recompute the regional price aggregates from scratch."""
+    try:
+        print(" Recomputing price aggregates from the FuelStation table...")
+        PriceAggregate.rebuild()
+        print(f" Stored {PriceAggregate.objects.count()} price aggregates!")
+    except Exception as e:
+        print(f" An error occurred: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import asyncio
+import os
+import sys
+import django
+
+
+# Add project root to sys.path
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+# Set up Django environment
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fuel_route.settings")
+django.setup()
+
+
+from api.geocoding_queue import drain_forever
+
+def main():
+    """Main function to drain the geocoding queue and backfill skipped stations."""
+    print(" Draining the geocoding queue...")
+    asyncio.run(drain_forever())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from api import admission
+from api.admission import WorkerLimiter, Overloaded, admit
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiter(monkeypatch):
+    monkeypatch.setattr(admission, "_worker", WorkerLimiter())
+
+
+@pytest.mark.asyncio
+async def test_worker_limiter_queues_and_hands_over():
+    """Test that a released slot goes to the queued request and a full queue is rejected."""
+    limiter = WorkerLimiter()
+    assert await limiter.acquire(1, 1, 1.0)
+    queued = asyncio.ensure_future(limiter.acquire(1, 1, 1.0))
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+    assert not await limiter.acquire(1, 1, 1.0)
+
+    limiter.release()
+    assert await queued
+    assert limiter.active == 1 and limiter.waiting == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_limiter_timeout():
+    """Test that a queued request gives up after the timeout without leaking its place."""
+    limiter = WorkerLimiter()
+    assert await limiter.acquire(1, 5, 1.0)
+    assert not await limiter.acquire(1, 5, 0.05)
+    assert limiter.waiting == 0
+    limiter.release()
+    assert limiter.active == 0
+    assert await limiter.acquire(1, 5, 0.05)
+
+
+@pytest.mark.asyncio
+async def test_admit_global_limit(settings):
+    """Test that the limit shared through Redis sheds work beyond it."""
+    settings.ADMISSION_WORKER_LIMIT = 5
+    settings.ADMISSION_GLOBAL_LIMIT = 1
+    settings.ADMISSION_QUEUE_TIMEOUT = 0.1
+    settings.ADMISSION_RETRY_AFTER = 7
+    async with admit():
+        with pytest.raises(Overloaded) as excinfo:
+            async with admit():
+                pass
+        assert excinfo.value.retry_after == 7
+    assert admission._worker.active == 0
+    async with admit():
+        assert admission._worker.active == 1
@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from api import async_cache
+from api.cache_warmer import CountMinSketch, LaneTracker, warm_lane
+from api.route_model import CachedRoute, Route
+from api.utils import make_route_key
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+START, FINISH = MOCK_ROUTE_POINTS[0], MOCK_ROUTE_POINTS[-1]
+
+
+def test_count_min_sketch_never_underestimates():
+    """Test that the sketch estimate is at least the true count."""
+    sketch = CountMinSketch(width=64, depth=4)
+    for i in range(200):
+        sketch.add(f"lane-{i % 20}")
+    assert all(sketch.estimate(f"lane-{i}") >= 10 for i in range(20))
+
+
+def test_lane_tracker_keeps_hottest_lanes():
+    """Test that the tracker keeps the most requested lanes within its top-K budget."""
+    tracker = LaneTracker(top_k=2)
+    for lane, hits in (("a|b", 5), ("c|d", 1), ("e|f", 3)):
+        for _ in range(hits):
+            tracker.record(lane)
+    assert tracker.hottest() == ["a|b", "e|f"]
+
+
+@pytest.fixture
+def warmer_settings(settings):
+    settings.CACHE_WARMER_REFRESH_BEFORE = 3600
+    settings.CACHE_WARMER_PROVIDER_BUDGET = 1
+    settings.CACHE_WARMER_INTERVAL = 60
+    return settings
+
+
+@pytest.mark.asyncio
+async def test_warm_lane_refreshes_expiring_route(warmer_settings):
+    """Test that lanes whose route is missing are refreshed within the provider budget."""
+    with patch("api.cache_warmer.fetch_coordinate", new_callable=AsyncMock) as mock_fetch, \
+         patch("api.cache_warmer.get_route", new_callable=AsyncMock) as mock_route:
+        mock_fetch.side_effect = [START, FINISH, FINISH, START]
+        mock_route.return_value = Route("graphhopper", "_p~iF~ps|U_ulLnnqC", 120.5, 7200.0)
+        assert await warm_lane("big-cabin|laurel") is True
+        mock_route.assert_awaited_once_with(START, FINISH, refresh=True)
+        # The hourly budget of one provider call is spent
+        assert await warm_lane("laurel|big-cabin") is False
+
+
+@pytest.mark.asyncio
+async def test_warm_lane_skips_fresh_route(warmer_settings):
+    """Test that lanes whose cached route is still fresh are left alone."""
+    route = Route("graphhopper", "_p~iF~ps|U_ulLnnqC", 120.5, 7200.0)
+    await async_cache.set(make_route_key(START, FINISH), CachedRoute.new(route, 86400, 604800).to_cache())
+    with patch("api.cache_warmer.fetch_coordinate", new_callable=AsyncMock) as mock_fetch, \
+         patch("api.cache_warmer.get_route", new_callable=AsyncMock) as mock_route:
+        mock_fetch.side_effect = [START, FINISH]
+        assert await warm_lane("big-cabin|laurel") is False
+        mock_route.assert_not_awaited()
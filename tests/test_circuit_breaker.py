@@ -0,0 +1,61 @@
+import pytest
+from api.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN, by_health
+
+
+@pytest.fixture(autouse=True)
+def breaker_settings(settings):
+    settings.ROUTE_BREAKER_WINDOW = 60.0
+    settings.ROUTE_BREAKER_MIN_CALLS = 4
+    settings.ROUTE_BREAKER_ERROR_RATE = 0.5
+    settings.ROUTE_BREAKER_COOLDOWN = 30.0
+    settings.ROUTE_BREAKER_SLOW_CALL = 3.0
+
+
+def test_breaker_opens_on_error_rate():
+    """Test that the breaker opens once enough recent calls failed."""
+    breaker = CircuitBreaker("graphhopper", 0)
+    for now, succeeded in enumerate([True, False, True]):
+        breaker.record(succeeded, 0.1, now=now)
+    assert breaker.state == CLOSED
+    breaker.record(False, 0.1, now=3)
+    assert breaker.state == OPEN
+    assert not breaker.allow(now=10)
+
+
+def test_old_failures_leave_the_window():
+    """Test that failures older than the window no longer count."""
+    breaker = CircuitBreaker("graphhopper", 0)
+    breaker.record(False, 0.1, now=0)
+    breaker.record(False, 0.1, now=1)
+    for now in (100, 101, 102):
+        breaker.record(True, 0.1, now=now)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe():
+    """Test that a single probe is let through after the cooldown and decides the state."""
+    breaker = CircuitBreaker("graphhopper", 0)
+    for now in range(4):
+        breaker.record(False, 0.1, now=now)
+    assert breaker.allow(now=40)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow(now=40)
+    breaker.record(False, 0.1, now=41)
+    assert breaker.state == OPEN and not breaker.allow(now=50)
+
+    assert breaker.allow(now=80)
+    breaker.record(True, 0.1, now=81)
+    assert breaker.state == CLOSED and breaker.allow(now=82)
+
+
+def test_by_health_orders_providers():
+    """Test that degraded providers move back and open ones are left out."""
+    first, second, third = CircuitBreaker("a", 0), CircuitBreaker("b", 1), CircuitBreaker("c", 2)
+    assert [b.name for b in by_health([third, first, second])] == ["a", "b", "c"]
+    # Slow calls degrade a provider without opening its breaker
+    first.record(True, 5.0)
+    assert [b.name for b in by_health([first, second, third])] == ["b", "c", "a"]
+    for _ in range(4):
+        second.record(False, 0.1)
+    assert second.state == OPEN
+    assert [b.name for b in by_health([first, second, third])] == ["c", "a"]
@@ -0,0 +1,287 @@
+import numpy as np
+import pytest
+from api.corridor import (
+    RouteCorridor,
+    VehicleProfile,
+    corridor_cache_key,
+    get_cached_corridor,
+    store_corridor,
+    reset_corridors,
+    plan_stops,
+    TripInfeasible,
+    prefetch_path,
+    prefetch_covers,
+)
+from api.geometry import cumulative_miles, haversine_miles, project_onto_route
+from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS
+
+# A straight route along the equator: one degree of longitude is ~69.1 miles
+STRAIGHT_ROUTE = [(0.0, lon / 10) for lon in range(0, 151)]
+
+
+def station(station_id, price, lon):
+    return (station_id, f"Address {station_id}", price, 0.01, lon)
+
+
+def test_cumulative_miles():
+    """Test that cumulative miles grow with the great-circle distance."""
+    lats, lons = np.zeros(3), np.array([0.0, 1.0, 2.0])
+    miles = cumulative_miles(lats, lons)
+    assert miles[0] == 0
+    assert miles[2] == pytest.approx(2 * haversine_miles(0, 0, 0, 1))
+
+
+def test_project_onto_route_between_vertices():
+    """Test that points project onto segments, not just onto vertices."""
+    lats, lons = np.array([0.0, 0.0]), np.array([0.0, 2.0])
+    miles = cumulative_miles(lats, lons)
+    mile_markers, detours = project_onto_route(lats, lons, miles, [0.5, -0.1], [0.5, 1.5])
+    assert mile_markers == pytest.approx([miles[-1] / 4, miles[-1] * 3 / 4], rel=1e-3)
+    assert detours == pytest.approx([34.55, 6.91], abs=0.1)
+
+
+def test_attach_stations_drops_far_detours():
+    """Test that stations too far off the route are not attached."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations([station("near", 3.0, 5.0), ("far", None, 1.0, 1.0, 5.0)])
+    assert corridor.station_ids == ["near"]
+    assert corridor.station_detours[0] == pytest.approx(0.69, abs=0.01)
+    assert corridor.stations_between(300, 400) == (0, 1)
+    assert corridor.stations_between(400, 500) == (1, 1)
+
+
+def test_attach_stations_sorted_by_mile():
+    """Test that stations are projected and sorted by mile marker."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations([station("b", 3.0, 10.0), station("a", 3.5, 2.0)])
+    assert corridor.station_ids == ["a", "b"]
+    assert corridor.station_miles[0] == pytest.approx(138.2, abs=1)
+    assert corridor.station_miles[1] == pytest.approx(691, abs=1)
+
+
+def test_plan_stops_picks_cheapest_reachable():
+    """Test that the planner refuels at the cheapest station in range."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)  # ~1036 miles
+    corridor.attach_stations([
+        station("expensive", 5.0, 5.0),
+        station("cheap", 3.2, 6.0),
+        station("cheapest", 1.0, 12.0),
+    ])
+    stops, cost = plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+    assert [stop[0] for stop in stops] == ["cheap", "cheapest"]
+    assert cost > 0
+
+
+def test_plan_stops_no_stations():
+    """Test that a corridor without stations yields no stops within range and is infeasible beyond it."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations([])
+    assert plan_stops(corridor, VehicleProfile(1200, 10, 50), 1000) == ([], 0.0)
+    with pytest.raises(TripInfeasible):
+        plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+
+
+def test_plan_stops_unreachable_station():
+    """Test that a gap between stations wider than the range is reported where the vehicle runs dry."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)  # ~1036 miles
+    corridor.attach_stations([station("start", 3.0, 0.5), station("far", 3.0, 12.0)])
+    with pytest.raises(TripInfeasible) as excinfo:
+        plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+    assert excinfo.value.stranded_at == pytest.approx(450 + 0.5 * 69.1, abs=2)
+import numpy as np
+import pytest
+from api.corridor import (
+    RouteCorridor,
+    VehicleProfile,
+    corridor_cache_key,
+    get_cached_corridor,
+    store_corridor,
+    reset_corridors,
+    plan_stops,
+    TripInfeasible,
+    prefetch_path,
+    prefetch_covers,
+)
+from api.geometry import cumulative_miles, haversine_miles, project_onto_route
+from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS
+
+# A straight route along the equator: one degree of longitude is ~69.1 miles
+STRAIGHT_ROUTE = [(0.0, lon / 10) for lon in range(0, 151)]
+
+
+def station(station_id, price, lon):
+    return (station_id, f"Address {station_id}", price, 0.01, lon)
+
+
+def test_cumulative_miles():
+    """Test that cumulative miles grow with the great-circle distance."""
+    lats, lons = np.zeros(3), np.array([0.0, 1.0, 2.0])
+    miles = cumulative_miles(lats, lons)
+    assert miles[0] == 0
+    assert miles[2] == pytest.approx(2 * haversine_miles(0, 0, 0, 1))
+
+
+def test_project_onto_route_between_vertices():
+    """Test that points project onto segments, not just onto vertices."""
+    lats, lons = np.array([0.0, 0.0]), np.array([0.0, 2.0])
+    miles = cumulative_miles(lats, lons)
+    mile_markers, detours = project_onto_route(lats, lons, miles, [0.5, -0.1], [0.5, 1.5])
+    assert mile_markers == pytest.approx([miles[-1] / 4, miles[-1] * 3 / 4], rel=1e-3)
+    assert detours == pytest.approx([34.55, 6.91], abs=0.1)
+
+
+def test_attach_stations_drops_far_detours():
+    """Test that stations too far off the route are not attached."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations([station("near", 3.0, 5.0), ("far", None, 1.0, 1.0, 5.0)])
+    assert corridor.station_ids == ["near"]
+    assert corridor.station_detours[0] == pytest.approx(0.69, abs=0.01)
+    assert corridor.stations_between(300, 400) == (0, 1)
+    assert corridor.stations_between(400, 500) == (1, 1)
+
+
+def test_attach_stations_sorted_by_mile():
+    """Test that stations are projected and sorted by mile marker."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations([station("b", 3.0, 10.0), station("a", 3.5, 2.0)])
+    assert corridor.station_ids == ["a", "b"]
+    assert corridor.station_miles[0] == pytest.approx(138.2, abs=1)
+    assert corridor.station_miles[1] == pytest.approx(691, abs=1)
+
+
+def test_plan_stops_picks_cheapest_reachable():
+    """Test that the planner refuels at the cheapest station in range."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)  # ~1036 miles
+    corridor.attach_stations([
+        station("expensive", 5.0, 5.0),
+        station("cheap", 3.2, 6.0),
+        station("cheapest", 1.0, 12.0),
+    ])
+    stops, cost = plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+    assert [stop[0] for stop in stops] == ["cheap", "cheapest"]
+    assert cost > 0
+
+
+def test_plan_stops_no_stations():
+    """Test that a corridor without stations yields no stops within range and is infeasible beyond it."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations([])
+    assert plan_stops(corridor, VehicleProfile(1200, 10, 50), 1000) == ([], 0.0)
+    with pytest.raises(TripInfeasible):
+        plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+
+
+def test_plan_stops_unreachable_station():
+    """Test that a gap between stations wider than the range is reported where the vehicle runs dry."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)  # ~1036 miles
+    corridor.attach_stations([station("start", 3.0, 0.5), station("far", 3.0, 12.0)])
+    with pytest.raises(TripInfeasible) as excinfo:
+        plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+    assert excinfo.value.stranded_at == pytest.approx(450 + 0.5 * 69.1, abs=2)
+
+
+def test_plan_stops_charges_the_way_back():
+    """Test that a full tank at a station off the route leaves less than full range back on it."""
+    corridor = RouteCorridor.from_points([(0.0, lon / 10) for lon in range(0, 122)])  # ~836 miles
+    # ~400 miles along the route and ~20 miles off it
+    corridor.attach_stations([("off", "Off route", 3.0, 0.29, 5.79)])
+    assert corridor.station_detours[0] == pytest.approx(20, abs=1)
+    # Back on the route with 480 miles of fuel, 430 usable: short of the ~436 miles left
+    with pytest.raises(TripInfeasible):
+        plan_stops(corridor, VehicleProfile(500, 10, 50), 1000)
+    stops, _ = plan_stops(corridor, VehicleProfile(520, 10, 50), 1000)
+    assert [stop[0] for stop in stops] == ["off"]
+
+
+def test_profiles_share_corridor():
+    """Test that several profiles plan against the same corridor."""
+    corridor = RouteCorridor.from_points(MOCK_ROUTE_POINTS)
+    corridor.attach_stations(MOCK_FUEL_STATIONS)
+    small, small_cost = plan_stops(corridor, VehicleProfile(300, 8, 30), 1000)
+    large, large_cost = plan_stops(corridor, VehicleProfile(600, 12, 50), 1000)
+    assert len(small) >= len(large)
+    assert small_cost > 0 and large_cost > 0
+
+
+@pytest.mark.asyncio
+async def test_corridor_cache_roundtrip():
+    """Test that corridors are found locally and in the shared cache."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations(MOCK_FUEL_STATIONS)
+    corridor.build_pyramid()
+    key = corridor_cache_key("route_0_0_0_15", 1)
+    assert await get_cached_corridor(key) is None
+    await store_corridor(key, corridor)
+    assert await get_cached_corridor(key) is corridor
+    reset_corridors()
+    cached = await get_cached_corridor(key)
+    assert cached is not corridor
+    assert cached.total_miles == pytest.approx(corridor.total_miles)
+    assert np.array_equal(cached.station_miles, corridor.station_miles)
+    assert cached.station_ids == corridor.station_ids and cached.pyramid == corridor.pyramid
+    assert cached.fresh_until == corridor.fresh_until
+
+
+def test_prefetch_path_skips_short_trips():
+    """Test that stations are only prefetched when some profile may need to refuel."""
+    start, finish = MOCK_ROUTE_POINTS[0], MOCK_ROUTE_POINTS[-1]
+    assert prefetch_path(start, finish, [VehicleProfile(5000, 10, 50)]) is None
+    lats, lons = prefetch_path(start, finish, [VehicleProfile(5000, 10, 50), VehicleProfile(300, 8, 30)])
+    assert len(lats) == len(lons) > 2
+
+
+def test_prefetch_covers():
+    """Test that the prefetched corridor is only trusted when the route stays inside it."""
+    start, finish = MOCK_ROUTE_POINTS[0], MOCK_ROUTE_POINTS[-1]
+    path = prefetch_path(start, finish, [VehicleProfile(300, 8, 30)])
+    corridor = RouteCorridor.from_points(MOCK_ROUTE_POINTS)
+    assert prefetch_covers(corridor, *path)
+    # A route wandering three degrees north of the great circle leaves the corridor
+    detour = RouteCorridor.from_points([start, (start[0] + 3.0, (start[1] + finish[1]) / 2), finish])
+    assert not prefetch_covers(detour, *path)
+
+    """Test that several profiles plan against the same corridor."""
+    corridor = RouteCorridor.from_points(MOCK_ROUTE_POINTS)
+    corridor.attach_stations(MOCK_FUEL_STATIONS)
+    small, small_cost = plan_stops(corridor, VehicleProfile(300, 8, 30), 1000)
+    large, large_cost = plan_stops(corridor, VehicleProfile(600, 12, 50), 1000)
+    assert len(small) >= len(large)
+    assert small_cost > 0 and large_cost > 0
+
+
+@pytest.mark.asyncio
+async def test_corridor_cache_roundtrip():
+    """Test that corridors are found locally and in the shared cache."""
+    corridor = RouteCorridor.from_points(STRAIGHT_ROUTE)
+    corridor.attach_stations(MOCK_FUEL_STATIONS)
+    corridor.build_pyramid()
+    key = corridor_cache_key("route_0_0_0_15", 1)
+    assert await get_cached_corridor(key) is None
+    await store_corridor(key, corridor)
+    assert await get_cached_corridor(key) is corridor
+    reset_corridors()
+    cached = await get_cached_corridor(key)
+    assert cached is not corridor
+    assert cached.total_miles == pytest.approx(corridor.total_miles)
+    assert np.array_equal(cached.station_miles, corridor.station_miles)
+    assert cached.station_ids == corridor.station_ids and cached.pyramid == corridor.pyramid
+    assert cached.fresh_until == corridor.fresh_until
+
+
+def test_prefetch_path_skips_short_trips():
+    """Test that stations are only prefetched when some profile may need to refuel."""
+    start, finish = MOCK_ROUTE_POINTS[0], MOCK_ROUTE_POINTS[-1]
+    assert prefetch_path(start, finish, [VehicleProfile(5000, 10, 50)]) is None
+    lats, lons = prefetch_path(start, finish, [VehicleProfile(5000, 10, 50), VehicleProfile(300, 8, 30)])
+    assert len(lats) == len(lons) > 2
+
+
+def test_prefetch_covers():
+    """Test that the prefetched corridor is only trusted when the route stays inside it."""
+    start, finish = MOCK_ROUTE_POINTS[0], MOCK_ROUTE_POINTS[-1]
+    path = prefetch_path(start, finish, [VehicleProfile(300, 8, 30)])
+    corridor = RouteCorridor.from_points(MOCK_ROUTE_POINTS)
+    assert prefetch_covers(corridor, *path)
+    # A route wandering three degrees north of the great circle leaves the corridor
+    detour = RouteCorridor.from_points([start, (start[0] + 3.0, (start[1] + finish[1]) / 2), finish])
+    assert not prefetch_covers(detour, *path)
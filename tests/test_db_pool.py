@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+import pytest
+from django.test import Client
+from api.db_pool import db_async, pool_stats, shutdown_pool
+from api.metrics import MetricsRegistry, registry
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    shutdown_pool()
+    yield
+    shutdown_pool()
+
+
+def test_queries_run_in_parallel(settings):
+    """Test that concurrent calls run on several threads instead of one."""
+    settings.DB_POOL_SIZE = 4
+    threads = set()
+
+    @db_async
+    def slow_query():
+        threads.add(threading.get_ident())
+        time.sleep(0.1)
+
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(*(slow_query() for _ in range(4)))
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 0.3
+    assert len(threads) > 1
+    assert pool_stats()["in_use"] == 0 and pool_stats()["waiting"] == 0
+
+
+def test_saturation_is_counted(settings):
+    """Test that calls beyond the pool size are counted as saturation."""
+    settings.DB_POOL_SIZE = 10
+    before = registry.snapshot()[0].get("db_pool_saturated_total", 0)
+
+    @db_async
+    def query():
+        time.sleep(0.02)
+
+    async def run():
+        await asyncio.gather(*(query() for _ in range(15)))
+
+    asyncio.run(run())
+    assert registry.snapshot()[0]["db_pool_saturated_total"] - before >= 5
+
+
+def test_registry_render():
+    """Test the Prometheus text output."""
+    metrics = MetricsRegistry()
+    metrics.describe("jobs_total", "Jobs done.")
+    metrics.inc("jobs_total", 2)
+    metrics.gauge_callback("queue_depth", lambda: 3)
+    output = metrics.render()
+    assert "# HELP jobs_total Jobs done.\n# TYPE jobs_total counter\njobs_total 2" in output
+    assert "# TYPE queue_depth gauge\nqueue_depth 3" in output
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(settings):
+    """Test that the metrics endpoint requires the token when one is configured."""
+    settings.METRICS_TOKEN = "secret"
+    client = Client()
+    assert client.get("/api/metrics/").status_code == 403
+    response = client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
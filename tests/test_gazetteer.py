@@ -0,0 +1,104 @@
+import os
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from asgiref.sync import sync_to_async
+from api.gazetteer import _copy_places, clean_place_name, load_gazetteer, read_places
+from api.models import CityCoordinates, FuelStation
+from api.utils import fetch_coordinate, get_city_coordinates
+
+GAZETTEER_FILE = os.path.join(os.path.dirname(__file__), "data", "gazetteer_places.txt")
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Big Cabin town", "Big Cabin"),
+    ("Laurel city", "Laurel"),
+    ("Nashville-Davidson metropolitan government (balance)", "Nashville-Davidson"),
+    ("Juneau city and borough", "Juneau"),
+    ("Fort Bragg CDP", "Fort Bragg"),
+])
+def test_clean_place_name(name, expected):
+    """Test stripping Census area descriptions from place names."""
+    assert clean_place_name(name) == expected
+
+
+def test_read_places():
+    """Test parsing a Gazetteer places file."""
+    places = read_places(GAZETTEER_FILE)
+    assert len(places) == 4
+    assert set(places[places["city"] == "Laurel"]["state"]) == {"MS", "MD"}
+
+
+@pytest.mark.django_db
+def test_load_gazetteer_is_idempotent():
+    """Test importing places twice without duplicating them or touching geocoded cities."""
+    CityCoordinates.objects.all().delete()
+    CityCoordinates.objects.create(city="Laurel", latitude=31.69, longitude=-89.13)
+    assert load_gazetteer(GAZETTEER_FILE) == 4
+    assert load_gazetteer(GAZETTEER_FILE) == 4
+    assert CityCoordinates.objects.count() == 5
+    assert CityCoordinates.objects.get(city="Laurel", state="").latitude == 31.69
+    assert CityCoordinates.objects.get(city="Laurel", state="MD").latitude == pytest.approx(39.095082)
+
+
+@pytest.mark.django_db
+def test_load_gazetteer_resolves_pending_places():
+    """Test that an import resolves places left pending or unresolved."""
+    CityCoordinates.objects.all().delete()
+    CityCoordinates.objects.create(city="Laurel", state="MD", status=CityCoordinates.STATUS_UNRESOLVED)
+    load_gazetteer(GAZETTEER_FILE)
+    place = CityCoordinates.objects.get(city="Laurel", state="MD")
+    assert place.status == CityCoordinates.STATUS_RESOLVED and place.checked_at is not None
+
+
+@pytest.mark.django_db
+def test_copy_places_upserts_status():
+    """Test that the PostgreSQL upsert writes the status (which has no database default) and resets it."""
+    cursor = MagicMock()
+    with patch("api.gazetteer.connection") as mock_connection:
+        mock_connection.cursor.return_value.__enter__.return_value = cursor
+        _copy_places(read_places(GAZETTEER_FILE))
+    sql, params = cursor.execute.call_args_list[-1][0]
+    columns = sql[sql.index("(") + 1:sql.index(")")].split(", ")
+    assert columns[-2:] == ["status", "checked_at"]
+    assert "status = EXCLUDED.status" in sql
+    assert params[0] == CityCoordinates.STATUS_RESOLVED
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_request_lookup_without_network():
+    """Test that request-time lookups resolve gazetteer places, state-qualified or not."""
+    await sync_to_async(CityCoordinates.objects.all().delete)()
+    await sync_to_async(load_gazetteer)(GAZETTEER_FILE)
+    # The larger of the two Laurels wins an unqualified lookup
+    assert (await get_city_coordinates("Laurel"))["latitude"] == pytest.approx(31.697634)
+    assert (await get_city_coordinates("Laurel", "MD"))["latitude"] == pytest.approx(39.095082)
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_import_clears_request_path_negative_cache():
+    """Test that a city rejected on the request path resolves as soon as an import adds it."""
+    await sync_to_async(CityCoordinates.objects.all().delete)()
+    assert await fetch_coordinate("Laurel") is None
+    await sync_to_async(load_gazetteer)(GAZETTEER_FILE)
+    assert await fetch_coordinate("Laurel") == pytest.approx((31.697634, -89.141006))
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_ingestion_uses_gazetteer(tmpdir):
+    """Test that ingestion resolves cities by state from the gazetteer without geocoding."""
+    await sync_to_async(CityCoordinates.objects.all().delete)()
+    await sync_to_async(FuelStation.objects.all().delete)()
+    await sync_to_async(load_gazetteer)(GAZETTEER_FILE)
+    csv_file = tmpdir.join("fuel_data.csv")
+    csv_file.write(
+        "OPIS Truckstop ID;Truckstop Name;City;State;Retail Price;Address\n"
+        "7;Station MD;Laurel;MD;3.9;1 Main St\n"
+    )
+    with patch("api.models.CityCoordinates.fetch_coordinates", new_callable=AsyncMock) as mock_fetch:
+        await FuelStation.load_fuel_data(str(csv_file))
+        mock_fetch.assert_not_awaited()
+    station = await sync_to_async(FuelStation.objects.get)(opis_truckstop_id="7")
+    assert station.latitude == pytest.approx(39.095082)
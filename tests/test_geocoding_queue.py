@@ -0,0 +1,119 @@
+import time
+import pytest
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import sync_to_async
+from api.models import CityCoordinates, FuelStation, GeocodeRequest, PriceAggregate
+from api.geocoding_queue import drain_once
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+CSV_HEADER = "OPIS Truckstop ID;Truckstop Name;City;State;Retail Price;Address\n"
+
+
+@pytest.fixture(autouse=True)
+def fast_geocoding(settings):
+    settings.GEOCODING_RATE_PER_SECOND = 1000.0
+
+
+@pytest.fixture
+async def clean_tables():
+    for model in (FuelStation, CityCoordinates, GeocodeRequest, PriceAggregate):
+        await sync_to_async(model.objects.all().delete)()
+    yield
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_unresolved_stations_are_queued(tmpdir, clean_tables):
+    """Test that stations of cities without coordinates are queued once per city."""
+    csv_file = tmpdir.join("fuel_data.csv")
+    csv_file.write(
+        CSV_HEADER
+        + "1;Station A;Big Cabin;OK;3.5;1 Main St\n"
+        + "2;Station B;Laurel;MS;4.1;2 Oak St\n"
+        + "3;Station C;Laurel;MS;3.9;3 Pine St\n"
+    )
+    with patch("api.models.CityCoordinates.fetch_coordinates", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.side_effect = lambda session, city: MOCK_ROUTE_POINTS[0] if city == "Big Cabin" else (None, None)
+        await FuelStation.load_fuel_data(str(csv_file))
+        assert mock_fetch.await_count == 2
+
+    assert await sync_to_async(FuelStation.objects.count)() == 1
+    request = await sync_to_async(GeocodeRequest.objects.get)(city="Laurel")
+    assert request.status == GeocodeRequest.STATUS_PENDING
+    assert sorted(station["opis_truckstop_id"] for station in request.stations) == ["2", "3"]
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_drain_backfills_stations(aiohttp_session, clean_tables):
+    """Test that draining the queue creates the stations that were skipped."""
+    station = {"opis_truckstop_id": "2", "name": "Station B", "state": "MS", "city": "Laurel",
+               "address": "2 Oak St", "price_per_gallon": 4.1}
+    await sync_to_async(GeocodeRequest.enqueue)({"Laurel": [station]})
+    with patch("api.models.CityCoordinates.fetch_coordinates", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.return_value = MOCK_ROUTE_POINTS[-1]
+        stats = await drain_once(aiohttp_session)
+
+    assert stats == {"resolved": 1, "failed": 0, "backfilled": 1}
+    created = await sync_to_async(FuelStation.objects.get)(opis_truckstop_id="2")
+    assert (created.latitude, created.longitude) == MOCK_ROUTE_POINTS[-1]
+    assert created.cell_key is not None
+    request = await sync_to_async(GeocodeRequest.objects.get)(city="Laurel")
+    assert request.status == GeocodeRequest.STATUS_DONE
+    national = await sync_to_async(PriceAggregate.objects.get)(scope=PriceAggregate.SCOPE_NATIONAL, key="")
+    assert national.station_count == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_drain_retries_with_backoff(aiohttp_session, clean_tables):
+    """Test that a city without results is retried later."""
+    await sync_to_async(GeocodeRequest.enqueue)({"Nowhere": []})
+    with patch("api.models.CityCoordinates.fetch_coordinates", new_callable=AsyncMock) as mock_fetch:
+        mock_fetch.return_value = (None, None)
+        assert (await drain_once(aiohttp_session))["failed"] == 1
+        # Not due again until the backoff has elapsed
+        assert (await drain_once(aiohttp_session))["failed"] == 0
+        assert mock_fetch.await_count == 1
+
+    request = await sync_to_async(GeocodeRequest.objects.get)(city="Nowhere")
+    assert request.attempts == 1
+    assert request.status == GeocodeRequest.STATUS_PENDING
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_quota_pauses_geocoding(aiohttp_session, clean_tables, mock_response):
+    """Test that a 429 pauses every geocoding call until X-RateLimit-Reset."""
+    reset = int(time.time()) + 600
+    await sync_to_async(GeocodeRequest.enqueue)({"Laurel": [], "Big Cabin": []})
+    response = mock_response(429, headers={"X-RateLimit-Reset": str(reset)})
+    with patch("aiohttp.ClientSession.get", return_value=response) as mock_get:
+        stats = await drain_once(aiohttp_session)
+        assert mock_get.call_count == 1
+        assert stats == {"resolved": 0, "failed": 0, "backfilled": 0}
+        assert CityCoordinates.geocoding_paused_until() == reset
+
+        assert await CityCoordinates.fetch_coordinates(aiohttp_session, "Laurel") == (None, None)
+        assert mock_get.call_count == 1
+
+    pending = await sync_to_async(GeocodeRequest.objects.filter(status=GeocodeRequest.STATUS_PENDING, attempts=0).count)()
+    assert pending == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_spent_quota_leaves_requests_pending(aiohttp_session, clean_tables, settings):
+    """Test that a refusal from the shared quota pauses geocoding without using a retry."""
+    from api import provider_quota
+    settings.PROVIDER_DAILY_QUOTAS = {"opencage": 1}
+    assert await provider_quota.take("opencage")
+    await sync_to_async(GeocodeRequest.enqueue)({"Laurel": [], "Big Cabin": []})
+    with patch("aiohttp.ClientSession.get") as mock_get:
+        stats = await drain_once(aiohttp_session)
+    mock_get.assert_not_called()
+    assert stats == {"resolved": 0, "failed": 0, "backfilled": 0}
+    assert CityCoordinates.geocoding_paused_until() == provider_quota.retry_at("opencage", provider_quota.DAILY_LIMIT)
+
+    pending = await sync_to_async(GeocodeRequest.objects.filter(status=GeocodeRequest.STATUS_PENDING, attempts=0).count)()
+    assert pending == 2
@@ -0,0 +1,87 @@
+import numpy as np
+import polyline
+import pytest
+from api.geometry import (
+    decode_polyline,
+    encode_polyline,
+    simplify,
+    project_onto_route,
+    cumulative_miles,
+    great_circle_points,
+    decode_flexible_polyline,
+    haversine_miles,
+)
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+
+def test_decode_polyline_matches_reference():
+    """Test that the vectorized decoder agrees with the polyline package."""
+    encoded = polyline.encode(MOCK_ROUTE_POINTS)
+    lats, lons = decode_polyline(encoded)
+    expected = np.array(polyline.decode(encoded))
+    assert np.allclose(lats, expected[:, 0]) and np.allclose(lons, expected[:, 1])
+
+
+def test_encode_polyline_matches_reference():
+    """Test that the vectorized encoder produces the same string as the polyline package."""
+    points = np.array(MOCK_ROUTE_POINTS + [(-33.86785, 151.20732), (0.0, 0.0)])
+    assert encode_polyline(points[:, 0], points[:, 1]) == polyline.encode([tuple(p) for p in points])
+
+
+def test_polyline_empty():
+    """Test the empty polyline."""
+    lats, lons = decode_polyline("")
+    assert len(lats) == len(lons) == 0
+    assert encode_polyline([], []) == ""
+
+
+@pytest.mark.parametrize("encoded", ["_p~iF~ps|U_", "_p~iF", "_p~iF ~ps|U"])
+def test_decode_polyline_invalid(encoded):
+    """Test that malformed polylines are rejected."""
+    with pytest.raises(ValueError):
+        decode_polyline(encoded)
+
+
+def test_simplify_straight_line():
+    """Test that collinear vertices are dropped."""
+    lons = np.linspace(0, 1, 50)
+    assert simplify(np.zeros(50), lons, 0.1).tolist() == [0, 49]
+
+
+def test_simplify_within_tolerance():
+    """Test that the simplified route stays within the tolerance of the full route."""
+    points = np.array(MOCK_ROUTE_POINTS)
+    lats, lons = points[:, 0], points[:, 1]
+    for tolerance in (1.0, 0.1):
+        kept = simplify(lats, lons, tolerance)
+        assert kept[0] == 0 and kept[-1] == len(lats) - 1
+        miles = cumulative_miles(lats[kept], lons[kept])
+        _, distances = project_onto_route(lats[kept], lons[kept], miles, lats, lons)
+        assert distances.max() <= tolerance * 1.01
+    assert len(simplify(lats, lons, 1.0)) <= len(simplify(lats, lons, 0.1)) <= len(lats)
+
+
+def test_great_circle_points():
+    """Test that great-circle samples are evenly spaced and add up to the direct distance."""
+    lats, lons = great_circle_points(36.5, -95.2, 38.6, -84.1, spacing=25.0)
+    assert (lats[0], lons[0]) == pytest.approx((36.5, -95.2))
+    assert (lats[-1], lons[-1]) == pytest.approx((38.6, -84.1))
+    steps = haversine_miles(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    assert steps.max() <= 25.0 and np.allclose(steps, steps[0])
+    assert steps.sum() == pytest.approx(float(haversine_miles(36.5, -95.2, 38.6, -84.1)))
+
+
+def test_decode_flexible_polyline():
+    """Test HERE flexible polylines with and without a third dimension."""
+    expected_lats = [50.10228, 50.10201, 50.10063, 50.09878]
+    expected_lons = [8.69821, 8.69567, 8.6915, 8.68752]
+    for encoded in ("BFoz5xJ67i1B1B7PzIhaxL7Y", "BlBoz5xJ67i1BU1B7PUzIhaUxL7YU"):
+        lats, lons = decode_flexible_polyline(encoded)
+        assert np.allclose(lats, expected_lats) and np.allclose(lons, expected_lons)
+
+
+@pytest.mark.parametrize("encoded", ["", "AFoz5xJ", "BFoz5xJ67i1B1", "BFoz5x!"])
+def test_decode_flexible_polyline_invalid(encoded):
+    """Test rejecting malformed flexible polylines."""
+    with pytest.raises(ValueError):
+        decode_flexible_polyline(encoded)
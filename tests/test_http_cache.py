@@ -0,0 +1,31 @@
+from django.http import QueryDict
+from django.test import RequestFactory
+from api.http_cache import trip_etag, etag_matches
+from api.route_model import Route
+
+ROUTE_KEY = "route_36.5_-95.2_38.6_-84.1"
+DEFAULTS = (500, 10, 50, 100)
+ROUTE = Route("osrm", "_p~iF~ps|U_ulLnnqC", 120.5, 7200.0)
+VERSIONS = {"fuel_stations_version": 1, "price_aggregates_version": 1}
+
+
+def test_trip_etag_changes_with_inputs():
+    """Test that the ETag changes with parameters, route and dataset versions."""
+    etag = trip_etag(ROUTE_KEY, ROUTE, VERSIONS, QueryDict("fuel_capacity=400"), DEFAULTS)
+    assert etag == trip_etag(ROUTE_KEY, ROUTE, dict(VERSIONS), QueryDict("fuel_capacity=400"), DEFAULTS)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag != trip_etag(ROUTE_KEY, ROUTE, VERSIONS, QueryDict("fuel_capacity=300"), DEFAULTS)
+    assert etag != trip_etag(ROUTE_KEY, ROUTE, VERSIONS, QueryDict("fuel_capacity=400"), (600, 10, 50, 100))
+    assert etag != trip_etag(ROUTE_KEY, ROUTE._replace(geometry="_p~iF~ps|U"), VERSIONS, QueryDict("fuel_capacity=400"), DEFAULTS)
+    bumped = {**VERSIONS, "fuel_stations_version": 2}
+    assert etag != trip_etag(ROUTE_KEY, ROUTE, bumped, QueryDict("fuel_capacity=400"), DEFAULTS)
+
+
+def test_etag_matches():
+    """Test If-None-Match matching, including weakened and wildcard tags."""
+    factory = RequestFactory()
+    assert not etag_matches(factory.get("/"), '"abc"')
+    assert etag_matches(factory.get("/", HTTP_IF_NONE_MATCH='"xyz", "abc"'), '"abc"')
+    assert etag_matches(factory.get("/", HTTP_IF_NONE_MATCH='W/"abc"'), '"abc"')
+    assert etag_matches(factory.get("/", HTTP_IF_NONE_MATCH="*"), '"abc"')
+    assert not etag_matches(factory.get("/", HTTP_IF_NONE_MATCH='"xyz"'), '"abc"')
@@ -0,0 +1,50 @@
+import json
+import logging
+import queue
+from api.log_pipeline import (
+    JsonFormatter,
+    SamplingQueueHandler,
+    bind_request,
+    release_request,
+    stage,
+    pipeline_stats,
+)
+
+
+def make_record(message, level=logging.INFO):
+    return logging.LogRecord("api.views", level, __file__, 1, message, None, None)
+
+
+def test_records_carry_request_context():
+    """Test that queued records carry the request ID and stage timings as JSON."""
+    log_queue = queue.Queue(maxsize=10)
+    handler = SamplingQueueHandler(log_queue, "TripPlanner.log")
+    token = bind_request("req-123")
+    try:
+        with stage("route"):
+            pass
+        handler.handle(make_record("done"))
+    finally:
+        release_request(token)
+
+    line = json.loads(JsonFormatter().format(log_queue.get_nowait()))
+    assert line["message"] == "done"
+    assert line["request_id"] == "req-123"
+    assert "route" in line["stage_timings"]
+
+
+def test_full_queue_drops_instead_of_blocking(settings):
+    """Test that records are sampled or dropped rather than blocking when the queue is full."""
+    settings.LOG_SAMPLE_RATE = 0.0
+    log_queue = queue.Queue(maxsize=1)
+    handler = SamplingQueueHandler(log_queue, "TripPlanner.log")
+    before = pipeline_stats()
+
+    handler.handle(make_record("first", logging.WARNING))
+    handler.handle(make_record("second", logging.WARNING))
+    handler.handle(make_record("third"))
+
+    after = pipeline_stats()
+    assert log_queue.qsize() == 1
+    assert after["dropped"] - before["dropped"] == 1
+    assert after["sampled_out"] - before["sampled_out"] == 1
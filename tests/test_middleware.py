@@ -0,0 +1,51 @@
+import gzip
+import brotli
+import numpy as np
+import orjson
+from django.http import HttpResponse
+from django.test import RequestFactory
+from api.middleware import CompressionMiddleware
+from api.renderers import ORJSONRenderer
+
+BODY = b'{"route": "' + b"abcdefgh" * 512 + b'"}'
+
+
+def compress(accept_encoding, body=BODY):
+    middleware = CompressionMiddleware(lambda request: HttpResponse(body, content_type="application/json"))
+    request = RequestFactory().get("/api/trip/a/b", HTTP_ACCEPT_ENCODING=accept_encoding)
+    return middleware(request)
+
+
+def test_brotli_preferred():
+    """Test that brotli is used when the client accepts it."""
+    response = compress("gzip, deflate, br")
+    assert response["Content-Encoding"] == "br"
+    assert brotli.decompress(response.content) == BODY
+    assert "Accept-Encoding" in response["Vary"]
+
+
+def test_brotli_nonzero_quality():
+    """Test that brotli is accepted with any positive q-value."""
+    for accept_encoding in ("gzip;q=1, br;q=0.5", "br; q=0.001", "BR;Q=1"):
+        assert compress(accept_encoding)["Content-Encoding"] == "br"
+
+
+def test_gzip_fallback():
+    """Test that gzip is used when brotli is refused or not offered."""
+    for accept_encoding in ("gzip", "gzip, br;q=0", "gzip, br; q=0.0", "gzip, br;q=0.000", "gzip, br;q=bogus"):
+        response = compress(accept_encoding)
+        assert response["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.content) == BODY
+
+
+def test_small_bodies_not_compressed():
+    """Test that small bodies are sent as is."""
+    response = compress("br", body=b'{"ok": true}')
+    assert not response.has_header("Content-Encoding")
+
+
+def test_orjson_renderer():
+    """Test that the renderer handles numpy values and non-string keys."""
+    data = {"miles": np.array([1.5, 2.5]), "price": np.float64(3.25), 1: "one"}
+    assert orjson.loads(ORJSONRenderer().render(data)) == {"miles": [1.5, 2.5], "price": 3.25, "1": "one"}
+    assert ORJSONRenderer().render(None) == b""
@@ -1,7 +1,7 @@
 import pytest
 from unittest.mock import AsyncMock, patch
 from django.core.cache import cache
-from api.models import CityCoordinates, FuelStation, RouteData
+from api.models import CityCoordinates, FuelStation, RouteData, PriceAggregate
 from asgiref.sync import sync_to_async
 from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS  
 
@@ -17,12 +17,6 @@ SAMPLE_STATION = MOCK_FUEL_STATIONS[0] if MOCK_FUEL_STATIONS else (
 )
 
 # Fixtures for automatic cleanup
-@pytest.fixture
-async def clean_city_coordinates():
-    """Clean up all CityCoordinates objects before each test."""
-    await sync_to_async(CityCoordinates.objects.all().delete)()
-    yield
-
 @pytest.fixture
 async def clean_fuel_stations():
     """Clean up all FuelStation objects before each test."""
@@ -169,4 +163,9 @@ async def test_load_fuel_data(tmpdir, aiohttp_session, clean_city_coordinates, c
     assert stations[0].city == "Big Cabin"
     assert stations[0].price_per_gallon == SAMPLE_STATION[2]
     assert stations[1].city == "Laurel"
+
+    # Price aggregates are maintained during ingestion
+    national = await sync_to_async(PriceAggregate.objects.get)(scope=PriceAggregate.SCOPE_NATIONAL, key="")
+    assert national.station_count == 2
+    assert national.total_price == pytest.approx(SAMPLE_STATION[2] + 4.1)
     assert stations[1].price_per_gallon == 4.1
\ No newline at end of file
@@ -0,0 +1,61 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from api.models import CityCoordinates, GeocodeRequest
+from api.geocoding_queue import drain_once
+from api.utils import fetch_coordinate
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_request_path_caches_misses(clean_city_coordinates):
+    """Test that an unknown city is answered from the negative cache on the next request."""
+    with patch("api.utils.get_city_coordinates", new_callable=AsyncMock) as mock_lookup:
+        mock_lookup.return_value = None
+        assert await fetch_coordinate("Atlantis") is None
+        assert await fetch_coordinate("Atlantis") is None
+        assert mock_lookup.await_count == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_unresolvable_city_not_requeried(aiohttp_session, clean_city_coordinates, mock_response):
+    """Test that a name without geocoding results is marked unresolved and not sent to the API again."""
+    with patch("aiohttp.ClientSession.get", return_value=mock_response(200, {"results": []})) as mock_get:
+        assert await CityCoordinates.fetch_coordinates(aiohttp_session, "Atlantis") == (None, None)
+        city = await sync_to_async(CityCoordinates.objects.get)(city="Atlantis")
+        assert city.status == CityCoordinates.STATUS_UNRESOLVED
+        assert city.checked_at is not None
+
+        assert await CityCoordinates.fetch_coordinates(aiohttp_session, "Atlantis") == (None, None)
+        # Still rejected from the database once the cache entry is gone
+        cache.clear()
+        assert await CityCoordinates.fetch_coordinates(aiohttp_session, "Atlantis") == (None, None)
+        assert mock_get.call_count == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_unresolved_city_retried_after_ttl(aiohttp_session, clean_city_coordinates, mock_response, settings):
+    """Test that an unresolved name is geocoded again once its TTL has expired."""
+    settings.GEOCODING_NEGATIVE_TTL = 0
+    with patch("aiohttp.ClientSession.get", return_value=mock_response(200, {"results": []})):
+        await CityCoordinates.fetch_coordinates(aiohttp_session, "Laurel")
+    payload = {"results": [{"geometry": {"lat": 31.69, "lng": -89.13}}]}
+    with patch("aiohttp.ClientSession.get", return_value=mock_response(200, payload)):
+        assert await CityCoordinates.fetch_coordinates(aiohttp_session, "Laurel") == (31.69, -89.13)
+    city = await sync_to_async(CityCoordinates.objects.get)(city="Laurel")
+    assert city.status == CityCoordinates.STATUS_RESOLVED
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_queue_gives_up_on_unresolvable_city(aiohttp_session, clean_city_coordinates, mock_response, settings):
+    """Test that the geocoding queue fails unresolvable cities at once instead of retrying."""
+    settings.GEOCODING_RATE_PER_SECOND = 1000.0
+    await sync_to_async(GeocodeRequest.enqueue)({"Atlantis": []})
+    with patch("aiohttp.ClientSession.get", return_value=mock_response(200, {"results": []})):
+        await drain_once(aiohttp_session)
+    request = await sync_to_async(GeocodeRequest.objects.get)(city="Atlantis")
+    assert request.status == GeocodeRequest.STATUS_FAILED
@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from api.pipeline import TaskGraph
+
+
+@pytest.mark.asyncio
+async def test_nodes_receive_dependency_results():
+    """Test that a node runs after its dependencies and receives their results."""
+    async def double(value):
+        return value * 2
+
+    async def add(first, second):
+        return first + second
+
+    async with TaskGraph() as graph:
+        graph.add("a", double, 1)
+        graph.add("b", double, 5)
+        graph.add("sum", add, after=("a", "b"))
+        assert await graph.result("sum") == 12
+        assert "b" in graph and "c" not in graph
+
+
+@pytest.mark.asyncio
+async def test_independent_nodes_overlap():
+    """Test that nodes without dependencies between them run concurrently."""
+    started = []
+    release = asyncio.Event()
+
+    async def wait(name):
+        started.append(name)
+        await release.wait()
+        return name
+
+    async with TaskGraph() as graph:
+        graph.add("route", wait, "route")
+        graph.add("prefetch", wait, "prefetch")
+        await asyncio.sleep(0)
+        assert sorted(started) == ["prefetch", "route"]
+        release.set()
+        assert await graph.result("route") == "route"
+
+
+@pytest.mark.asyncio
+async def test_unused_nodes_are_cancelled():
+    """Test that closing the graph cancels speculative work nobody waited for."""
+    cancelled = asyncio.Event()
+
+    async def speculate():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async with TaskGraph() as graph:
+        graph.add("prefetch", speculate)
+        await asyncio.sleep(0)
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_failures_reach_dependents():
+    """Test that a failing node fails the nodes depending on it."""
+    async def fail():
+        raise ValueError("no route")
+
+    async def use(value):
+        return value
+
+    async with TaskGraph() as graph:
+        graph.add("route", fail)
+        graph.add("plan", use, after=("route",))
+        with pytest.raises(ValueError):
+            await graph.result("plan")
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from api.corridor import build_corridor, with_stations
+from api.metrics import registry
+from api.planning_pool import run_planning, pool_stats, shutdown_pool
+from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS
+
+POINTS = np.array(MOCK_ROUTE_POINTS)
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    shutdown_pool()
+    yield
+    shutdown_pool()
+
+
+def current_thread():
+    return threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_small_jobs_run_inline(settings):
+    """Test that jobs below the threshold stay on the calling thread."""
+    settings.PLANNING_OFFLOAD_THRESHOLD = 100
+    inline = registry.snapshot()[0].get("planning_inline_total", 0)
+    assert await run_planning(current_thread, size=99) == threading.get_ident()
+    assert registry.snapshot()[0]["planning_inline_total"] == inline + 1
+    assert pool_stats()["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_large_jobs_run_on_thread_pool(settings):
+    """Test that large jobs leave the event loop thread and are counted while pending."""
+    settings.PLANNING_POOL_KIND = "thread"
+    settings.PLANNING_POOL_SIZE = 1
+    settings.PLANNING_OFFLOAD_THRESHOLD = 100
+    release = threading.Event()
+
+    def blocked():
+        release.wait(5)
+        return threading.get_ident()
+
+    job = asyncio.ensure_future(run_planning(blocked, size=100))
+    await asyncio.sleep(0.05)
+    assert pool_stats() == {"size": 1, "pending": 1}
+    release.set()
+    assert await job != threading.get_ident()
+    assert pool_stats()["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_corridor_built_in_process_pool(settings):
+    """Test that a corridor built and projected in a worker process matches the inline one."""
+    settings.PLANNING_POOL_KIND = "process"
+    settings.PLANNING_POOL_SIZE = 1
+    settings.PLANNING_OFFLOAD_THRESHOLD = 0
+    lats, lons = POINTS[:, 0].copy(), POINTS[:, 1].copy()
+
+    corridor = await run_planning(build_corridor, lats, lons, size=len(lats))
+    corridor = await run_planning(with_stations, corridor, MOCK_FUEL_STATIONS, size=len(lats))
+
+    expected = with_stations(build_corridor(lats, lons), MOCK_FUEL_STATIONS)
+    assert corridor.total_miles == pytest.approx(expected.total_miles)
+    assert corridor.pyramid == expected.pyramid
+    assert corridor.station_ids == expected.station_ids
@@ -0,0 +1,102 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import sync_to_async
+from redis.exceptions import RedisError
+from api.models import CityCoordinates, FuelStation, PriceAggregate
+from api.price_aggregates import average_price_around, regional_average_price, reset_aggregates, states_at
+from api.spatial import region_key
+from scripts.average_fuel_price import AVERAGE_FUEL_PRICE
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+BIG_CABIN = MOCK_ROUTE_POINTS[0]
+LAUREL = MOCK_ROUTE_POINTS[-1]
+
+
+def aggregates_for(stations):
+    aggregates = {}
+    for state, price, lat, lon in stations:
+        for key in PriceAggregate.keys_for(state, lat, lon):
+            total, count = aggregates.get(key, (0.0, 0))
+            aggregates[key] = (total + price, count + 1)
+    return aggregates
+
+
+def test_average_price_uses_local_cells():
+    """Test that the local aggregate ignores stations far from the route."""
+    aggregates = aggregates_for([("OK", 3.0, *BIG_CABIN), ("MS", 5.0, *LAUREL)])
+    assert average_price_around(aggregates, [BIG_CABIN]) == 3.0
+
+
+def test_average_price_falls_back_to_state_then_national_then_static():
+    """Test the fallbacks when no station is near the route."""
+    aggregates = aggregates_for([("OK", 3.0, *BIG_CABIN), ("MS", 5.0, *LAUREL)])
+    assert average_price_around(aggregates, [(45.0, -120.0)], {"MS"}) == 5.0
+    assert average_price_around(aggregates, [(45.0, -120.0)], {"OR"}) == 4.0
+    assert average_price_around(aggregates, [(45.0, -120.0)]) == 4.0
+    assert average_price_around({}, [(45.0, -120.0)]) == AVERAGE_FUEL_PRICE
+
+
+
+def test_states_at_reads_the_cell_map():
+    """Test that points take the state of their cell, or of a neighboring one."""
+    cell_states = {region_key(*BIG_CABIN): "OK"}
+    assert states_at(cell_states, [BIG_CABIN]) == {"OK"}
+    assert states_at(cell_states, [(BIG_CABIN[0] + 0.7, BIG_CABIN[1])]) == {"OK"}
+    assert states_at(cell_states, [LAUREL]) == set()
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_rebuild_and_regional_average_price():
+    """Test that rebuilt aggregates are picked up in memory by the short-trip pricing."""
+    await sync_to_async(FuelStation.objects.all().delete)()
+    await sync_to_async(FuelStation.objects.create)(
+        opis_truckstop_id="1", name="A", city="Big Cabin", state="OK",
+        price_per_gallon=3.2, latitude=BIG_CABIN[0], longitude=BIG_CABIN[1]
+    )
+    await sync_to_async(PriceAggregate.rebuild)()
+    reset_aggregates()
+
+    price = await regional_average_price([BIG_CABIN, (BIG_CABIN[0] + 0.1, BIG_CABIN[1])])
+    assert price == pytest.approx(3.2)
+    state = await sync_to_async(PriceAggregate.objects.get)(scope=PriceAggregate.SCOPE_STATE, key="OK")
+    assert state.station_count == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_regional_average_price_uses_state_of_remote_route():
+    """Test that a route far from every station is priced at its state's average."""
+    await sync_to_async(FuelStation.objects.all().delete)()
+    await sync_to_async(CityCoordinates.objects.filter(city="Burns").delete)()
+    for opis_id, state, price, (lat, lon) in [("1", "OR", 4.4, (45.5, -122.6)), ("2", "OK", 3.0, BIG_CABIN)]:
+        await sync_to_async(FuelStation.objects.create)(
+            opis_truckstop_id=opis_id, name=opis_id, city="X", state=state,
+            price_per_gallon=price, latitude=lat, longitude=lon
+        )
+    await sync_to_async(CityCoordinates.objects.create)(city="Burns", state="OR", latitude=43.59, longitude=-119.05)
+    await sync_to_async(PriceAggregate.rebuild)()
+    reset_aggregates()
+
+    price = await regional_average_price([(43.6, -119.1), (43.7, -119.3)])
+    assert price == pytest.approx(4.4)
+    await sync_to_async(CityCoordinates.objects.filter(city="Burns").delete)()
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_regional_average_price_survives_redis_outage():
+    """Test that the aggregates in memory keep pricing short trips when Redis is down."""
+    await sync_to_async(FuelStation.objects.all().delete)()
+    await sync_to_async(FuelStation.objects.create)(
+        opis_truckstop_id="1", name="A", city="Big Cabin", state="OK",
+        price_per_gallon=3.2, latitude=BIG_CABIN[0], longitude=BIG_CABIN[1]
+    )
+    await sync_to_async(PriceAggregate.rebuild)()
+    reset_aggregates()
+    assert await regional_average_price([BIG_CABIN, BIG_CABIN]) == pytest.approx(3.2)
+
+    with patch("api.price_aggregates.RECHECK_SECONDS", 0.0), \
+         patch("api.price_aggregates.async_cache.get_counters", new_callable=AsyncMock) as mock_counters:
+        mock_counters.side_effect = RedisError("down")
+        assert await regional_average_price([BIG_CABIN, BIG_CABIN]) == pytest.approx(3.2)
+        mock_counters.assert_awaited()
@@ -0,0 +1,71 @@
+import time
+import pytest
+from django.http import HttpResponse
+from django.contrib.auth.models import User
+from rest_framework.test import APIRequestFactory, force_authenticate
+from api.log_pipeline import bind_request, release_request, annotate_request
+from api.profiling import ProfilingMiddleware, list_profiles, profile_current_thread
+from api.views import ProfileList, ProfileDownload
+
+
+@pytest.fixture
+def profile_settings(settings, tmp_path):
+    settings.PROFILE_DIR = str(tmp_path)
+    settings.PROFILING_TOKEN = "secret"
+    settings.PROFILING_SAMPLE_RATE = 0.0
+    settings.PROFILING_INTERVAL = 0.001
+    return settings
+
+
+def slow_view(request):
+    profile_current_thread()
+    annotate_request(lane="big-cabin_laurel", route_cache="miss")
+    time.sleep(0.05)
+    return HttpResponse("ok")
+
+
+def run_middleware(headers):
+    request = APIRequestFactory().get("/api/route/big-cabin/laurel/", **headers)
+    token = bind_request("req-1")
+    try:
+        return ProfilingMiddleware(slow_view)(request)
+    finally:
+        release_request(token)
+
+
+def test_debug_header_writes_tagged_profile(profile_settings):
+    """Test that a request carrying the debug header is profiled and tagged with lane and cache state."""
+    response = run_middleware({"HTTP_X_DEBUG_PROFILE": "secret"})
+    profiles = list_profiles()
+    assert len(profiles) == 1
+    assert response["X-Profile"] == profiles[0]["name"]
+    assert "_big-cabin_laurel_miss_req-1" in profiles[0]["name"]
+
+
+def test_wrong_token_is_not_profiled(profile_settings):
+    """Test that a debug header with the wrong token does not trigger profiling."""
+    response = run_middleware({"HTTP_X_DEBUG_PROFILE": "guess"})
+    assert not response.has_header("X-Profile")
+    assert list_profiles() == []
+
+
+@pytest.mark.django_db
+def test_profile_endpoints_are_admin_only(profile_settings):
+    """Test that only staff users can list and download profiles."""
+    name = run_middleware({"HTTP_X_DEBUG_PROFILE": "secret"})["X-Profile"]
+    factory = APIRequestFactory()
+
+    anonymous = ProfileList.as_view()(factory.get("/api/profiles/"))
+    assert anonymous.status_code in (401, 403)
+
+    admin = User.objects.create(username="admin", is_staff=True)
+    request = factory.get("/api/profiles/")
+    force_authenticate(request, user=admin)
+    listing = ProfileList.as_view()(request)
+    assert listing.data["profiles"][0]["name"] == name
+
+    request = factory.get(f"/api/profiles/{name}/")
+    force_authenticate(request, user=admin)
+    download = ProfileDownload.as_view()(request, name=name)
+    assert download.status_code == 200
+    assert b"slow_view" in b"".join(download.streaming_content)
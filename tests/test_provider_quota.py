@@ -0,0 +1,68 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import patch
+from api import provider_quota
+from api.metrics import registry
+from api.utils import get_route
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+
+@pytest.fixture(autouse=True)
+def quotas(settings):
+    settings.PROVIDER_DAILY_QUOTAS = {"graphhopper": 2}
+    settings.PROVIDER_RATE_LIMITS = {"here": 0.01}
+    settings.PROVIDER_BURST_SECONDS = 5.0
+    settings.PROVIDER_QUOTA_RESERVE = 0.1
+
+
+def test_counter_key_follows_utc_day():
+    """Test that daily counters reset with the UTC date."""
+    day = datetime(2024, 3, 1, 23, 59, tzinfo=timezone.utc)
+    assert provider_quota.counter_key("graphhopper", provider_quota.quota_day(day)) == "quota:graphhopper:20240301"
+
+
+@pytest.mark.asyncio
+async def test_daily_quota():
+    """Test that calls beyond the daily quota are refused and reported."""
+    assert await provider_quota.take("graphhopper")
+    assert await provider_quota.take("graphhopper")
+    assert not await provider_quota.take("graphhopper")
+    _, gauges = registry.snapshot()
+    assert gauges["provider_quota_graphhopper_used"] == 2
+    assert gauges["provider_quota_graphhopper_remaining"] == 0
+    assert await provider_quota.headroom(["graphhopper", "osrm"]) == {"graphhopper": 0.0, "osrm": 1.0}
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    """Test that the token bucket limits bursts even without a daily quota."""
+    assert await provider_quota.take("here")
+    assert not await provider_quota.take("here")
+    # Unconfigured providers are unlimited
+    for _ in range(10):
+        assert await provider_quota.take("osrm")
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_get_route_steers_to_provider_with_headroom(mock_response):
+    """Test that a provider whose daily quota is spent is passed over."""
+    mock_response_obj = mock_response(200, {
+        "features": [{"geometry": {"coordinates": [[lon, lat] for lat, lon in MOCK_ROUTE_POINTS]}}]
+    })
+    await provider_quota.take("graphhopper")
+    await provider_quota.take("graphhopper")
+
+    with patch("aiohttp.ClientSession.get", return_value=mock_response_obj) as mock_get:
+        route = await get_route(MOCK_ROUTE_POINTS[0], MOCK_ROUTE_POINTS[-1])
+    assert route.provider == "openrouteservice"
+    assert "openrouteservice" in mock_get.call_args.args[0]
+    assert mock_get.call_count == 1
+
+
+def test_retry_at():
+    """Test that a spent daily quota is retried at midnight UTC and an empty bucket once it refills."""
+    now = datetime(2024, 3, 1, 23, 59, tzinfo=timezone.utc).timestamp()
+    midnight = datetime(2024, 3, 2, tzinfo=timezone.utc).timestamp()
+    assert provider_quota.retry_at("graphhopper", provider_quota.DAILY_LIMIT, now) == midnight
+    assert provider_quota.retry_at("here", provider_quota.RATE_LIMITED, now) == now + 100
@@ -0,0 +1,93 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from django.core.cache import cache
+from api.corridor import corridor_cache_key, get_cached_corridor
+from api.geometry import encode_polyline
+from api.models import RouteData
+from api.route_matrix import matrix_pairs, precompute_matrix, read_cities
+from api.route_model import Route
+from api.utils import lookup_trip, make_route_key, stations_version, store_route
+from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS
+
+CITIES = {
+    "Big Cabin": MOCK_ROUTE_POINTS[0],
+    "Vinita": MOCK_ROUTE_POINTS[1],
+    "Laurel": MOCK_ROUTE_POINTS[-1],
+}
+
+
+def make_route(start, finish):
+    return Route("osrm", encode_polyline([start[0], finish[0]], [start[1], finish[1]]), 750.0, 27000.0)
+
+
+async def fake_coordinate(city):
+    return CITIES.get(city)
+
+
+async def fake_route(start, finish, refresh=False):
+    route = make_route(start, finish)
+    await store_route(make_route_key(start, finish), route)
+    return route
+
+
+@pytest.fixture(autouse=True)
+def no_stored_routes():
+    RouteData.objects.all().delete()
+
+
+def test_read_cities(tmp_path):
+    """Test that the city list is read in order, without comments, blanks or duplicates."""
+    path = tmp_path / "cities.txt"
+    path.write_text("# top lanes\nBig Cabin\n\nlaurel  # KY\nbig-cabin\n")
+    assert read_cities(path) == ["big-cabin", "laurel"]
+
+
+def test_matrix_pairs_complete_top_block_first():
+    """Test that every pair among the first cities comes before pairs with a lower ranked city."""
+    pairs = matrix_pairs(["a", "b", "c"])
+    assert len(pairs) == 6
+    assert pairs[:2] == [("a", "b"), ("b", "a")]
+    assert set(pairs[2:]) == {("a", "c"), ("b", "c"), ("c", "a"), ("c", "b")}
+
+
+@pytest.mark.asyncio
+async def test_precompute_matrix_respects_budget():
+    """Test that route fetches stop at the budget and that precomputed lanes are one cache read."""
+    with patch("api.route_matrix.fetch_coordinate", side_effect=fake_coordinate), \
+         patch("api.route_matrix.get_route", new_callable=AsyncMock, side_effect=fake_route) as mock_route:
+        stats = await precompute_matrix(["big-cabin", "vinita", "laurel"], budget=2)
+    assert mock_route.await_count == 2
+    assert stats == {"fetched": 2, "over_budget": 4}
+
+    start, finish, entry, _ = await lookup_trip("Big Cabin", "Vinita")
+    assert entry.route == make_route(CITIES["Big Cabin"], CITIES["Vinita"])
+    assert (await lookup_trip("Big Cabin", "Laurel"))[2] is None
+
+
+@pytest.mark.asyncio
+async def test_precompute_matrix_reuses_stored_routes():
+    """Test that routes already stored are reloaded into the cache without provider calls."""
+    with patch("api.route_matrix.fetch_coordinate", side_effect=fake_coordinate), \
+         patch("api.route_matrix.get_route", new_callable=AsyncMock, side_effect=fake_route) as mock_route:
+        await precompute_matrix(["big-cabin", "laurel"], budget=10)
+        cache.clear()
+        stats = await precompute_matrix(["big-cabin", "laurel", "nowhere"], budget=10)
+    assert mock_route.await_count == 2
+    assert stats == {"cached": 2, "unresolved_cities": 1}
+    assert (await lookup_trip("Laurel", "Big Cabin"))[2] is not None
+
+
+@pytest.mark.asyncio
+async def test_precompute_matrix_builds_plans():
+    """Test that plans cache each lane's corridor with stations attached."""
+    with patch("api.route_matrix.fetch_coordinate", side_effect=fake_coordinate), \
+         patch("api.route_matrix.get_route", new_callable=AsyncMock, side_effect=fake_route), \
+         patch("api.utils.get_fuel_stations", new_callable=AsyncMock, return_value=MOCK_FUEL_STATIONS):
+        stats = await precompute_matrix(["big-cabin", "laurel"], budget=10, include_plans=True)
+        assert stats["plans"] == 2
+        # Corridors that already have stations are left alone
+        assert "plans" not in await precompute_matrix(["big-cabin", "laurel"], budget=10, include_plans=True)
+
+    route_key = make_route_key(CITIES["Big Cabin"], CITIES["Laurel"])
+    corridor = await get_cached_corridor(corridor_cache_key(route_key, await stations_version()))
+    assert corridor is not None and corridor.has_stations
@@ -0,0 +1,84 @@
+import numpy as np
+import polyline
+import pytest
+from api.route_model import CachedRoute, Route, normalize, METERS_PER_MILE, FRESH, STALE, EXPIRED
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+LATS = np.array([lat for lat, _ in MOCK_ROUTE_POINTS])
+LONS = np.array([lon for _, lon in MOCK_ROUTE_POINTS])
+GEOJSON = [[lon, lat] for lat, lon in MOCK_ROUTE_POINTS]
+
+
+def assert_mock_route(route, provider):
+    assert route.provider == provider
+    lats, lons = route.arrays()
+    assert np.allclose(lats, LATS, atol=1e-5) and np.allclose(lons, LONS, atol=1e-5)
+
+
+def test_normalize_graphhopper():
+    """Test GraphHopper's encoded paths, with time in milliseconds."""
+    data = {"paths": [{"points": polyline.encode(MOCK_ROUTE_POINTS), "distance": 160934.4, "time": 5400000}]}
+    route = normalize("graphhopper", data)
+    assert_mock_route(route, "graphhopper")
+    assert route.distance_miles == pytest.approx(100.0) and route.duration_seconds == 5400.0
+
+
+def test_normalize_openrouteservice():
+    """Test OpenRouteService GeoJSON, whose positions are longitude first."""
+    data = {"features": [{
+        "geometry": {"coordinates": GEOJSON},
+        "properties": {"summary": {"distance": 1609.344, "duration": 60.0}},
+    }]}
+    route = normalize("openrouteservice", data)
+    assert_mock_route(route, "openrouteservice")
+    assert route.distance_miles == pytest.approx(1.0) and route.duration_seconds == 60.0
+
+
+def test_normalize_osrm_without_distance():
+    """Test that a missing provider distance is measured along the geometry."""
+    route = normalize("osrm", {"routes": [{"geometry": {"coordinates": GEOJSON}}]})
+    assert_mock_route(route, "osrm")
+    assert 740 < route.distance_miles < 760
+    assert route.duration_seconds is None
+
+
+def test_normalize_here_sections():
+    """Test HERE flexible polylines, concatenated across sections."""
+    data = {"routes": [{"sections": [
+        {"polyline": "BFoz5xJ67i1B1B7PzIhaxL7Y", "summary": {"length": 500, "duration": 60}},
+        {"polyline": "BFoz5xJ67i1B1B7PzIhaxL7Y", "summary": {"length": 700, "duration": 90}},
+    ]}]}
+    route = normalize("here", data)
+    lats, lons = route.arrays()
+    assert len(lats) == 8 and lats[0] == pytest.approx(50.10228) and lons[3] == pytest.approx(8.68752)
+    assert route.distance_miles == pytest.approx(1200 / METERS_PER_MILE, abs=1e-3)
+    assert route.duration_seconds == 150.0
+
+
+@pytest.mark.parametrize("provider, data", [
+    ("graphhopper", {"paths": []}),
+    ("osrm", {"routes": [{"geometry": {"coordinates": [[-95.2, 36.5]]}}]}),
+    ("here", {"routes": [{"sections": [{"polyline": "not a polyline!"}]}]}),
+])
+def test_normalize_malformed(provider, data):
+    """Test that malformed responses raise instead of producing a route."""
+    with pytest.raises((KeyError, IndexError, TypeError, ValueError)):
+        normalize(provider, data)
+
+
+def test_route_cache_format():
+    """Test the compact cache format and that legacy raw entries are ignored."""
+    route = Route("osrm", polyline.encode(MOCK_ROUTE_POINTS), 750.0, None)
+    assert Route.from_cache(route.to_cache()) == route
+    assert Route.from_cache({"routes": []}) is None
+    assert Route.from_cache(None) is None
+
+
+def test_cached_route_states():
+    """Test that cache entries go from fresh to stale to expired, and that untimed entries are stale."""
+    route = Route("osrm", polyline.encode(MOCK_ROUTE_POINTS), 750.0, None)
+    entry = CachedRoute.new(route, 60, 3600, now=1000.0)
+    assert CachedRoute.from_cache(entry.to_cache()) == entry
+    assert [entry.state(now) for now in (1059.0, 1060.0, 4600.0)] == [FRESH, STALE, EXPIRED]
+    assert CachedRoute.from_cache(route.to_cache()).state() == STALE
+    assert CachedRoute.from_cache({"routes": []}) is None
@@ -0,0 +1,31 @@
+import numpy as np
+from api.spatial import cell_key, cell_keys, bbox_key_ranges, corridor_key_ranges
+from scripts.mock_data import MOCK_ROUTE_POINTS
+
+
+def in_ranges(key, ranges):
+    return any(low <= key <= high for low, high in ranges)
+
+
+def test_cell_keys_match_scalar_keys():
+    """Test that the vectorized cell keys match the scalar implementation."""
+    lats = np.array([p[0] for p in MOCK_ROUTE_POINTS])
+    lons = np.array([p[1] for p in MOCK_ROUTE_POINTS])
+    assert list(cell_keys(lats, lons)) == [cell_key(lat, lon) for lat, lon in MOCK_ROUTE_POINTS]
+
+
+def test_bbox_key_ranges_cover_box_only():
+    """Test that bounding-box key ranges include points inside the box and skip far away points."""
+    ranges = bbox_key_ranges(36.0, 37.0, -96.0, -95.0)
+    assert in_ranges(cell_key(36.5, -95.5), ranges)
+    assert in_ranges(cell_key(36.01, -95.99), ranges)
+    assert not in_ranges(cell_key(45.0, -120.0), ranges)
+
+
+def test_corridor_key_ranges_follow_route():
+    """Test that corridor key ranges cover the route and its buffer but not the whole bounding box."""
+    route = [(30.0, -100.0), (40.0, -90.0)]  # Diagonal route
+    ranges = corridor_key_ranges([(30.0 + i, -100.0 + i) for i in range(11)], buffer_deg=0.5)
+    assert all(in_ranges(cell_key(lat, lon), ranges) for lat, lon in route)
+    assert in_ranges(cell_key(35.4, -94.6), ranges)
+    assert not in_ranges(cell_key(39.5, -99.5), ranges)  # Opposite corner of the bounding box
@@ -0,0 +1,49 @@
+import threading
+import pytest
+from unittest.mock import patch
+from api.station_snapshot import build_snapshot, current_snapshot
+from api.utils import get_fuel_stations
+from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS
+
+
+def test_snapshot_round_trip(station_snapshot_dir):
+    """Test that a snapshot returns the same station tuples it was built from."""
+    stations = MOCK_FUEL_STATIONS + [(None, "No ID Station", 3.1, 35.0, -97.0)]
+    build_snapshot(stations)
+    snapshot = current_snapshot()
+    assert len(snapshot) == len(stations)
+    assert sorted(snapshot.stations(), key=str) == sorted(stations, key=str)
+    assert not snapshot.rows.flags.writeable  # Mapped read-only
+
+
+def test_snapshot_nearby_stations(station_snapshot_dir):
+    """Test bounding-box lookups against the snapshot's cell key index."""
+    build_snapshot(MOCK_FUEL_STATIONS)
+    lat, lon = MOCK_ROUTE_POINTS[0]
+    nearby = current_snapshot().nearby_stations(lat - 1, lat + 1, lon - 1, lon + 1)
+    expected = [s for s in MOCK_FUEL_STATIONS if abs(s[3] - lat) <= 1 and abs(s[4] - lon) <= 1]
+    assert sorted(nearby) == sorted(expected)
+
+
+@pytest.mark.asyncio
+async def test_get_fuel_stations_uses_snapshot(station_snapshot_dir):
+    """Test that get_fuel_stations serves corridor stations from the snapshot without the database."""
+    build_snapshot(MOCK_FUEL_STATIONS)
+    stations = await get_fuel_stations(MOCK_ROUTE_POINTS)
+    assert stations
+    assert set(stations) <= set(MOCK_FUEL_STATIONS)
+
+
+@pytest.mark.asyncio
+async def test_get_fuel_stations_reads_snapshot_off_the_loop(station_snapshot_dir):
+    """Test that the snapshot lookup runs on a worker thread, not on the event loop."""
+    build_snapshot(MOCK_FUEL_STATIONS)
+    threads = []
+
+    def lookup(snapshot):
+        threads.append(threading.get_ident())
+        return snapshot
+
+    with patch("api.utils.current_snapshot", side_effect=lambda: lookup(current_snapshot())):
+        assert set(await get_fuel_stations([])) == set(MOCK_FUEL_STATIONS)
+    assert threads and threading.get_ident() not in threads
@@ -1,6 +1,6 @@
+import numpy as np
 import pytest
 from unittest.mock import AsyncMock, patch
-from django.core.cache import cache
 from api.utils import (
     haversine_distance,
     fetch_coordinate,
@@ -10,8 +10,17 @@ from api.utils import (
     calculate_gallons_needed,
     calculate_total_distance,
     get_nearby_stations,
+    get_corridor_stations,
     get_all_stations,
+    coordinates_key,
+    lookup_trip,
+    remember_lane,
+    store_route,
+    make_route_key,
+    ROUTE_PROVIDERS,
 )
+from api import async_cache
+from api.route_model import EXPIRED, FRESH, CachedRoute, Route
 from api.models import CityCoordinates, FuelStation, RouteData
 from asgiref.sync import sync_to_async
 from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS  # Import mock data generated from database
@@ -28,12 +37,6 @@ SAMPLE_STATION = MOCK_FUEL_STATIONS[0] if MOCK_FUEL_STATIONS else (
 )
 
 # Fixtures for automatic cleanup
-@pytest.fixture
-async def clean_city_coordinates():
-    """Clean up all CityCoordinates objects before each test."""
-    await sync_to_async(CityCoordinates.objects.all().delete)()
-    yield
-
 @pytest.fixture
 async def clean_fuel_stations():
     """Clean up all FuelStation objects before each test."""
@@ -120,9 +123,8 @@ async def test_fetch_coordinate_from_db(setup_test_data):
 async def test_fetch_coordinate_cache(setup_test_data):
     """Test fetching coordinates from the cache."""
     city_name = "Laurel"
-    cache_key = city_name.replace(" ", "_")
     latitude, longitude = TEST_CITIES["laurel"]
-    cache.set(cache_key, (latitude, longitude))
+    await async_cache.set(coordinates_key(city_name), (latitude, longitude))
     coords = await fetch_coordinate(city_name)
     assert coords == (latitude, longitude)
 
@@ -145,12 +147,14 @@ async def test_get_fuel_stations(setup_test_data):
 @pytest.mark.django_db
 @pytest.mark.asyncio
 async def test_get_route_success(aiohttp_session, setup_test_data, clean_route_data):
-    """Test fetching a route successfully with OpenRouteService."""
+    """Test fetching a route successfully with OSRM and normalizing it."""
     start = TEST_CITIES["big-cabin"]
     finish = TEST_CITIES["laurel"]
     mock_response = {
         "routes": [{
-            "geometry": {"coordinates": MOCK_ROUTE_POINTS}
+            "geometry": {"coordinates": [[lon, lat] for lat, lon in MOCK_ROUTE_POINTS]},
+            "distance": 1207008.0,
+            "duration": 27000.0,
         }]
     }
     mock_response_obj = AsyncMock()
@@ -160,9 +164,14 @@ async def test_get_route_success(aiohttp_session, setup_test_data, clean_route_d
     mock_response_obj.__aexit__ = AsyncMock(return_value=None)
 
     with patch("aiohttp.ClientSession.get", return_value=mock_response_obj):
-        route_data = await get_route(start, finish)
-        assert "routes" in route_data
-        assert len(route_data["routes"][0]["geometry"]["coordinates"]) == len(MOCK_ROUTE_POINTS)
+        route = await get_route(start, finish)
+        assert isinstance(route, Route) and route.provider == "osrm"
+        assert route.distance_miles == pytest.approx(750.0) and route.duration_seconds == 27000.0
+        lats, lons = route.arrays()
+        assert np.allclose(lats, [lat for lat, _ in MOCK_ROUTE_POINTS], atol=1e-5)
+        assert np.allclose(lons, [lon for _, lon in MOCK_ROUTE_POINTS], atol=1e-5)
+    # The normalized route is what gets cached
+    assert await get_route(start, finish) == route
 
 @pytest.mark.django_db
 @pytest.mark.asyncio
@@ -195,6 +204,14 @@ async def test_get_nearby_stations(setup_test_data):
     assert len(stations) == 1  # Should find Station A in Big Cabin
     assert (SAMPLE_STATION[0], "123 Main St", SAMPLE_STATION[2], TEST_CITIES["big-cabin"][0], TEST_CITIES["big-cabin"][1]) in stations
 
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_get_corridor_stations(setup_test_data):
+    """Test retrieving fuel stations within the corridor around a route."""
+    # A short route around Big Cabin only should not reach the Laurel station
+    stations = await get_corridor_stations(MOCK_ROUTE_POINTS[:3], buffer_deg=0.5)
+    assert [s[0] for s in stations] == [SAMPLE_STATION[0]]
+
 @pytest.mark.django_db
 @pytest.mark.asyncio
 async def test_get_all_stations(setup_test_data):
@@ -202,4 +219,87 @@ async def test_get_all_stations(setup_test_data):
     stations = await get_all_stations()
     assert len(stations) == 2
     assert (SAMPLE_STATION[0], "123 Main St", SAMPLE_STATION[2], TEST_CITIES["big-cabin"][0], TEST_CITIES["big-cabin"][1]) in stations
-    assert ("2", "456 Oak St", 4.0, TEST_CITIES["laurel"][0], TEST_CITIES["laurel"][1]) in stations
\ No newline at end of file
+    assert ("2", "456 Oak St", 4.0, TEST_CITIES["laurel"][0], TEST_CITIES["laurel"][1]) in stations
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_lookup_trip_single_round_trip(clean_route_data):
+    """Test reading both cities and the lane's route from the async cache at once."""
+    start, finish = TEST_CITIES["big-cabin"], TEST_CITIES["laurel"]
+    versions = {"fuel_stations_version": 0, "price_aggregates_version": 0}
+    assert await lookup_trip("Big Cabin", "Laurel") == (None, None, None, versions)
+
+    await async_cache.set_many({coordinates_key("Big Cabin"): start, coordinates_key("Laurel"): finish})
+    route_key = make_route_key(start, finish)
+    route = Route("graphhopper", "_p~iF~ps|U_ulLnnqC", 120.5, 7200.0)
+    await store_route(route_key, route)
+    await remember_lane("Big Cabin", "Laurel", route_key)
+    await sync_to_async(FuelStation.bump_version)()
+    found_start, found_finish, entry, versions = await lookup_trip("Big Cabin", "Laurel")
+    assert (found_start, found_finish, entry.route, entry.state()) == (start, finish, route, FRESH)
+    assert versions == {"fuel_stations_version": 1, "price_aggregates_version": 0}
+
+    # Unresolvable cities are reported as such
+    assert await fetch_coordinate("Atlantis") is None
+    assert (await lookup_trip("Atlantis", "Laurel"))[0] is False
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_get_route_skips_failing_provider(clean_city_coordinates, clean_route_data):
+    """Test that a failing provider moves behind healthy ones instead of being retried on every request."""
+    import aiohttp
+    from api.utils import route_breakers
+    mock_response_obj = AsyncMock()
+    mock_response_obj.status = 200
+    mock_response_obj.json = AsyncMock(return_value={
+        "features": [{"geometry": {"coordinates": [[lon, lat] for lat, lon in MOCK_ROUTE_POINTS]}}]
+    })
+    mock_response_obj.__aenter__ = AsyncMock(return_value=mock_response_obj)
+    mock_response_obj.__aexit__ = AsyncMock(return_value=None)
+    called = []
+
+    def provider(url, *args, **kwargs):
+        called.append(url)
+        if "graphhopper" in url:
+            raise aiohttp.ClientConnectionError("connection refused")
+        return mock_response_obj
+
+    with patch("aiohttp.ClientSession.get", side_effect=provider):
+        for offset in range(3):
+            start = (TEST_CITIES["big-cabin"][0] + offset, TEST_CITIES["big-cabin"][1])
+            route = await get_route(start, TEST_CITIES["laurel"])
+            assert route.provider == "openrouteservice"
+    assert sum("graphhopper" in url for url in called) == 1
+    assert all("openrouteservice" in url for url in called[1:])
+    assert route_breakers[0].health() == 1.0
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_get_route_serves_stale_while_revalidating(clean_route_data):
+    """Test that a stale route is served at once and refreshed in the background, once."""
+    start, finish = TEST_CITIES["big-cabin"], TEST_CITIES["laurel"]
+    route = Route("graphhopper", "_p~iF~ps|U_ulLnnqC", 120.5, 7200.0)
+    entry = CachedRoute.new(route, -60, 3600)
+    await async_cache.set(make_route_key(start, finish), entry.to_cache())
+    with patch("api.utils.submit") as mock_submit, patch("aiohttp.ClientSession.get") as mock_get:
+        mock_submit.side_effect = lambda coro: coro.close()
+        assert await get_route(start, finish) == route
+        assert await get_route(start, finish) == route
+    mock_get.assert_not_called()
+    mock_submit.assert_called_once()
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_get_route_falls_back_to_expired_route(clean_route_data):
+    """Test that an expired route is fetched again, but still served when every provider fails."""
+    import aiohttp
+    start, finish = TEST_CITIES["big-cabin"], TEST_CITIES["laurel"]
+    route = Route("graphhopper", "_p~iF~ps|U_ulLnnqC", 120.5, 7200.0)
+    entry = CachedRoute.new(route, -7200, -3600)
+    assert entry.state() == EXPIRED
+    await sync_to_async(RouteData.objects.create)(route_key=make_route_key(start, finish), data=entry.to_cache())
+    with patch("aiohttp.ClientSession.get", side_effect=aiohttp.ClientConnectionError("down")) as mock_get:
+        assert await get_route(start, finish) == route
+    assert mock_get.call_count == len(ROUTE_PROVIDERS)
+    # Without a stored route, the failure is reported
+    with patch("aiohttp.ClientSession.get", side_effect=aiohttp.ClientConnectionError("down")):
+        assert "error" in await get_route(finish, start)
@@ -1,12 +1,15 @@
 import pytest
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, patch, Mock
 from asgiref.sync import sync_to_async
 from rest_framework.test import APIRequestFactory
 from rest_framework import status
+from rest_framework.response import Response
 from api.views import TripPlanner
-from scipy.spatial import KDTree
 from scripts.mock_data import MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS  # Import mock data generated from database
 from api.utils import calculate_total_distance  # Import to calculate actual distance
+from api.geometry import encode_polyline
+from api.route_model import Route
 
 # Constants for test data (based on database)
 TEST_CITIES = {
@@ -14,6 +17,14 @@ TEST_CITIES = {
     "laurel": MOCK_ROUTE_POINTS[-1],    # Last point from mock data (Laurel)
 }
 
+# Normalized route between the test cities, as returned by get_route
+MOCK_ROUTE = Route(
+    "osrm",
+    encode_polyline([lat for lat, _ in MOCK_ROUTE_POINTS], [lon for _, lon in MOCK_ROUTE_POINTS]),
+    750.0,
+    27000.0,
+)
+
 # Fixtures
 @pytest.fixture
 def api_request():
@@ -26,80 +37,32 @@ def trip_planner():
     """Create an instance of TripPlanner with predefined parameters."""
     return TripPlanner(fuel_capacity=500, miles_per_gallon=10, safety_margin=50, max_distance=1000)
 
-# Tests for TripPlanner methods
-def test_can_complete_trip_success(trip_planner):
-    """Test if a trip can be completed with available fuel stations."""
-    with patch("api.views.calculate_total_distance", return_value=750.0) as mock_distance:
-        assert trip_planner.can_complete_trip(MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS, 1000) is True
-
-def test_can_complete_trip_failure(trip_planner):
-    """Test if a trip fails when no fuel stations are available."""
-    with patch("api.views.calculate_total_distance", return_value=750.0) as mock_distance:
-        assert trip_planner.can_complete_trip(MOCK_ROUTE_POINTS, [], 1000) is False
-
-def test_select_fuel_stations_success(trip_planner):
-    """Test selecting fuel stations along a route."""
-    with patch("api.views.calculate_total_distance", return_value=750.0) as mock_distance, \
-         patch("api.views.haversine_distance", side_effect=lambda lat1, lon1, lat2, lon2: 187.5):  # Simulate 750 miles / 4 segments
-        stations, cost = trip_planner.select_fuel_stations(MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS, 1000)
-        assert len(stations) > 0  # Ensure some stations are selected
-        assert cost > 0  # Ensure cost is positive
-        assert any(station[0] in [s[0] for s in MOCK_FUEL_STATIONS] for station in stations)  # Check if station IDs are valid
-
-def test_select_fuel_stations_no_stations(trip_planner):
-    """Test selecting fuel stations when none are available."""
-    with patch("api.views.calculate_total_distance", return_value=750.0) as mock_distance:
-        stations, cost = trip_planner.select_fuel_stations(MOCK_ROUTE_POINTS, [], 1000)
-        assert stations == []  # No stations should be selected
-        assert cost == 0.0  # Cost should be zero
-
-def test_split_route_into_stages(trip_planner):
-    """Test splitting a route into stages for refueling."""
-    with patch("api.views.calculate_total_distance", return_value=750.0) as mock_distance, \
-         patch("api.views.haversine_distance", side_effect=lambda lat1, lon1, lat2, lon2: 187.5):  # Simulate 750 miles / 4 segments
-        stages, message = trip_planner.split_route_into_stages(MOCK_ROUTE_POINTS, MOCK_FUEL_STATIONS)
-        assert len(stages) > 0  # Ensure stages are created
-        assert message == "Trip requires staged refueling"  # Check the message
-
-def test_find_cheapest_station(trip_planner):
-    """Test finding the cheapest nearby fuel station."""
-    kdtree = KDTree([(s[3], s[4]) for s in MOCK_FUEL_STATIONS])
-    station = trip_planner.find_cheapest_station(kdtree, MOCK_ROUTE_POINTS[0], MOCK_FUEL_STATIONS, set())
-    assert station in MOCK_FUEL_STATIONS  # Ensure a valid station is returned
-
-def test_find_cheapest_station_none(trip_planner):
-    """Test finding no station when none are available."""
-    station = trip_planner.find_cheapest_station(None, MOCK_ROUTE_POINTS[0], [], set())
-    assert station is None  # Should return None if no stations are available
-
-@pytest.mark.asyncio
-async def test_process_request_success(api_request, trip_planner):
-    """Test processing a successful trip request."""
-    # Calculate the actual total distance from MOCK_ROUTE_POINTS
-    actual_distance = calculate_total_distance(MOCK_ROUTE_POINTS)
-
+@pytest.fixture
+def trip_services():
+    """Patch the view's geocoding, routing and station lookups to serve the mock trip."""
     with patch("api.views.fetch_coordinate", new_callable=AsyncMock) as mock_fetch, \
          patch("api.views.get_route", new_callable=AsyncMock) as mock_route, \
-         patch("api.views.get_fuel_stations", new_callable=AsyncMock) as mock_stations, \
-         patch("api.views.calculate_total_distance", return_value=actual_distance) as mock_distance:
-
-        # Mock the fetch_coordinate function to return coordinates from TEST_CITIES
-        mock_fetch.side_effect = lambda x: TEST_CITIES.get(x.replace("-", ""), (None, None))
-        # Mock the get_route function to return the mocked route points
-        mock_route.return_value = {
-            "routes": [{"geometry": {"coordinates": MOCK_ROUTE_POINTS}}],
-            "bbox": [-95.224193, 36.537792, -84.103304, 38.632542]
-        }
-        # Mock the get_fuel_stations function to return the mocked fuel stations
+         patch("api.views.get_fuel_stations", new_callable=AsyncMock) as mock_stations:
+        mock_fetch.side_effect = lambda city: TEST_CITIES[city.lower().replace(" ", "-")]
+        mock_route.return_value = MOCK_ROUTE
         mock_stations.return_value = MOCK_FUEL_STATIONS
+        yield SimpleNamespace(fetch=mock_fetch, route=mock_route, stations=mock_stations)
+
+@pytest.mark.asyncio
+async def test_process_request_success(api_request, trip_planner, trip_services):
+    """Test processing a successful trip request."""
+    # Calculate the actual total distance from MOCK_ROUTE_POINTS
+    actual_distance = calculate_total_distance(MOCK_ROUTE_POINTS)
 
+    with patch("api.views.record_lane") as mock_record:
         response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
         assert response.status_code == status.HTTP_200_OK
         assert "route_map" in response.data
         assert "total_distance" in response.data["route_map"]
-        assert 740 < response.data["route_map"]["total_distance"] < 760  # Match the actual distance
+        assert response.data["route_map"]["total_distance"] == pytest.approx(actual_distance, rel=0.01)
         assert "optimal_stations" in response.data
         assert "total_fuel_cost" in response.data
+        mock_record.assert_called_once_with("big-cabin", "laurel")
 
 @pytest.mark.asyncio
 async def test_process_request_invalid_city(api_request, trip_planner):
@@ -109,10 +72,211 @@ async def test_process_request_invalid_city(api_request, trip_planner):
     assert "error" in response.data
     assert "Invalid city name format" in response.data["error"]
 
+@pytest.mark.asyncio
+async def test_process_request_records_resolved_lanes_only(trip_planner, trip_services):
+    """Test that only lanes whose cities both resolve are counted for the cache warmer."""
+    trip_services.fetch.side_effect = lambda city: TEST_CITIES.get(city.lower().replace(" ", "-"))
+    with patch("api.views.record_lane") as mock_record:
+        request = APIRequestFactory().get("/api/trip/nowhere/laurel")
+        response = await trip_planner.process_request(request, "nowhere", "laurel")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        request = APIRequestFactory().get("/api/trip/laurel/laurel")
+        response = await trip_planner.process_request(request, "laurel", "laurel")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        mock_record.assert_not_called()
+
 @pytest.mark.asyncio
 async def test_process_request_same_city(api_request, trip_planner):
     """Test processing a request with the same start and finish city."""
     response = await trip_planner.process_request(api_request, "big-cabin", "big-cabin")
     assert response.status_code == status.HTTP_400_BAD_REQUEST
     assert "error" in response.data
-    assert "cannot be the same" in response.data["error"]
\ No newline at end of file
+    assert "cannot be the same" in response.data["error"]
+
+@pytest.mark.asyncio
+async def test_process_request_vehicle_profiles(trip_planner, trip_services):
+    """Test planning several vehicle profiles from query parameters."""
+    request = APIRequestFactory().get("/api/trip/big-cabin/laurel", {"profiles": "300:8:30,600:12:50"})
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    assert [plan["vehicle"]["fuel_capacity"] for plan in response.data["plans"]] == [300, 600]
+    assert response.data["optimal_stations"] == response.data["plans"][0]["optimal_stations"]
+
+    # A second request reuses the cached corridor and its stations
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    assert trip_services.stations.await_count == 1
+
+@pytest.mark.asyncio
+async def test_process_request_invalid_vehicle(trip_planner):
+    """Test rejecting out-of-range vehicle parameters."""
+    request = APIRequestFactory().get("/api/trip/big-cabin/laurel", {"fuel_capacity": "100", "safety_margin": "150"})
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert "safety_margin" in response.data["error"]
+
+@pytest.mark.asyncio
+async def test_process_request_non_finite_vehicle(trip_planner):
+    """Test rejecting nan and inf vehicle parameters."""
+    for params in ({"miles_per_gallon": "nan"}, {"fuel_capacity": "inf"}, {"profiles": "500:10:50,600:-inf:50"}):
+        request = APIRequestFactory().get("/api/trip/big-cabin/laurel", params)
+        response = await trip_planner.process_request(request, "big-cabin", "laurel")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "finite" in response.data["error"]
+
+@pytest.mark.asyncio
+async def test_process_request_keeps_encoded_polyline(api_request, trip_planner, trip_services):
+    """Test that the full-detail geometry is the normalized route's polyline."""
+    import polyline
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    route_map = response.data["route_map"]
+    assert route_map["geometry"] == polyline.encode(MOCK_ROUTE_POINTS)
+    assert route_map["provider"] == "osrm" and route_map["duration"] == MOCK_ROUTE.duration_seconds
+    assert 740 < route_map["total_distance"] < 760
+
+@pytest.mark.asyncio
+async def test_process_request_without_geometry(trip_planner, trip_services):
+    """Test trimming the response with fields and include_geometry."""
+    request = APIRequestFactory().get(
+        "/api/trip/big-cabin/laurel", {"include_geometry": "false", "fields": "route_map,total_fuel_cost"}
+    )
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    assert set(response.data) == {"route_map", "total_fuel_cost"}
+    assert "geometry" not in response.data["route_map"]
+
+@pytest.mark.asyncio
+async def test_process_request_unknown_field(trip_planner):
+    """Test rejecting unknown response fields."""
+    request = APIRequestFactory().get("/api/trip/big-cabin/laurel", {"fields": "route_map,secret"})
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert "secret" in response.data["error"]
+
+@pytest.mark.asyncio
+async def test_process_request_detail_levels(trip_planner, trip_services):
+    """Test that lower detail levels return smaller polylines."""
+    import polyline
+    lengths = {}
+    for detail in ("low", "medium", "full"):
+        request = APIRequestFactory().get("/api/trip/big-cabin/laurel", {"detail": detail})
+        response = await trip_planner.process_request(request, "big-cabin", "laurel")
+        assert response.status_code == status.HTTP_200_OK
+        lengths[detail] = len(polyline.decode(response.data["route_map"]["geometry"]))
+    assert lengths["low"] <= lengths["medium"] <= lengths["full"] == len(MOCK_ROUTE_POINTS)
+
+    request = APIRequestFactory().get("/api/trip/big-cabin/laurel", {"detail": "ultra"})
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.asyncio
+async def test_process_request_not_modified(api_request, trip_planner, trip_services):
+    """Test that the ETag of a freshly fetched route matches on the next request, which is answered from cache."""
+    from api.utils import make_route_key, store_route
+
+    async def fetch_and_store(start, finish):
+        await store_route(make_route_key(start, finish), MOCK_ROUTE)
+        return MOCK_ROUTE
+
+    trip_services.route.side_effect = fetch_and_store
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    etag = response["ETag"]
+    assert "max-age" in response["Cache-Control"]
+
+    request = APIRequestFactory().get("/api/trip/big-cabin/laurel", HTTP_IF_NONE_MATCH=etag)
+    response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response["ETag"] == etag
+    assert trip_services.route.await_count == 1
+
+@pytest.mark.asyncio
+async def test_process_request_uses_prefetched_stations(api_request, trip_planner, trip_services):
+    """Test that stations prefetched during routing are used when the route stays in their corridor."""
+    from api.corridor import PREFETCH_BUFFER_DEG
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["optimal_stations"]
+    assert trip_services.fetch.await_count == 2
+    assert trip_services.stations.await_count == 1
+    assert trip_services.stations.await_args.args[1] == PREFETCH_BUFFER_DEG
+
+@pytest.mark.asyncio
+async def test_process_request_short_trip_skips_stations(trip_planner, trip_services):
+    """Test that a trip within the vehicle's range does no station work."""
+    request = APIRequestFactory().get("/api/trip/big-cabin/laurel", {"fuel_capacity": "2000"})
+    with patch("api.views.regional_average_price", new_callable=AsyncMock) as mock_price:
+        mock_price.return_value = 3.5
+        response = await trip_planner.process_request(request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+    assert "no stations" in response.data["optimal_stations"]
+    trip_services.stations.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_process_request_infeasible_trip(api_request, trip_planner, trip_services):
+    """Test that a trip with no station within range is refused instead of answered with a partial plan."""
+    # A single station at the start: the 750-mile trip outlasts the 450 miles of usable range
+    trip_services.stations.return_value = MOCK_FUEL_STATIONS[:1]
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert "cannot be completed" in response.data["error"]
+    assert 0 < response.data["stranded_at_mile"] < 750
+    assert "ETag" not in response
+
+@pytest.mark.asyncio
+async def test_process_request_sheds_cache_misses(api_request, trip_planner, trip_services, settings):
+    """Test that cache misses get a 503 when saturated while cached lanes are still served."""
+    from api import async_cache
+    from api.utils import make_route_key
+    settings.ADMISSION_WORKER_LIMIT = 0
+    settings.ADMISSION_QUEUE_SIZE = 0
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response["Retry-After"] == str(settings.ADMISSION_RETRY_AFTER)
+    trip_services.route.assert_not_awaited()
+
+    settings.ADMISSION_WORKER_LIMIT = 8
+    await async_cache.set(make_route_key(TEST_CITIES["big-cabin"], TEST_CITIES["laurel"]), MOCK_ROUTE.to_cache())
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+
+    settings.ADMISSION_WORKER_LIMIT = 0
+    response = await trip_planner.process_request(api_request, "big-cabin", "laurel")
+    assert response.status_code == status.HTTP_200_OK
+
+@pytest.mark.asyncio
+async def test_process_request_serves_stale_corridor(api_request, trip_planner, trip_services):
+    """Test that a stale corridor is served while it is rebuilt in the background."""
+    from api.corridor import corridor_cache_key, get_cached_corridor
+    from api.utils import make_route_key, rebuild_corridor, stations_version
+    with patch("api.views.revalidate", new_callable=AsyncMock) as mock_revalidate:
+        assert (await trip_planner.process_request(api_request, "big-cabin", "laurel")).status_code == status.HTTP_200_OK
+        mock_revalidate.assert_not_called()
+
+        corridor_key = corridor_cache_key(make_route_key(TEST_CITIES["big-cabin"], TEST_CITIES["laurel"]), await stations_version())
+        (await get_cached_corridor(corridor_key)).fresh_until = 0.0
+        trip_services.stations.reset_mock()
+        assert (await trip_planner.process_request(api_request, "big-cabin", "laurel")).status_code == status.HTTP_200_OK
+        trip_services.stations.assert_not_awaited()
+        assert mock_revalidate.call_args[0][:2] == (corridor_key, rebuild_corridor)
+
+@pytest.mark.django_db
+def test_get_reuses_redis_connections(api_request, trip_planner, settings):
+    """Test that requests, each run on a loop of its own, share the process's Redis connections."""
+    import redis
+    from api import async_cache
+
+    async def process_request(request, start_city, finish_city):
+        await async_cache.set("probe", 1)
+        return Response(status=status.HTTP_200_OK)
+
+    connections = redis.Redis.from_url(settings.ASYNC_CACHE_URL)
+    with patch.object(trip_planner, "process_request", side_effect=process_request):
+        assert trip_planner.get(api_request, "big-cabin", "laurel").status_code == status.HTTP_200_OK
+        received = connections.info("stats")["total_connections_received"]
+        for _ in range(5):
+            assert trip_planner.get(api_request, "big-cabin", "laurel").status_code == status.HTTP_200_OK
+    assert connections.info("stats")["total_connections_received"] == received
+    connections.close()